@@ -0,0 +1,114 @@
+'''
+Benchmark of the memory taken by the alterations extracted from a VCF file:
+the AlteredGene, Gene and Alteration objects and the strings they refer to,
+with each object counted once however many times it is referred to (so that
+shared, interned strings only count once).
+
+The same file is extracted twice: with the slotted classes and interned
+strings used by reportgen.rules.general, and with a baseline representation
+as it was before them, i.e. old-style classes with a per-instance __dict__
+and a separate copy of each string, so that both numbers are printed.
+
+Usage, from the repository root:
+python -m benchmarks.bench_alteration_memory [n_annotations]
+'''
+
+import gc, os, shutil, sys, tempfile, time, types
+
+import reportgen.rules.general
+
+from reportgen.rules.general import AlterationExtractor, open_vcf
+
+from benchmarks.synthetic import write_vep_vcf
+
+TRANSCRIPTS_PER_RECORD = 10
+
+# Shared by all instances, rather than part of the extracted data:
+EXCLUDED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType, types.MethodType)
+
+# The slotted classes of reportgen.rules.general, replaced for the baseline:
+SLOTTED_CLASS_NAMES = ["MutationStatus", "Gene", "AlteredGene", "Alteration"]
+
+
+def get_deep_size(root):
+    '''Returns the total size in bytes of the object and all objects
+    reachable from it, excluding classes, modules and functions.'''
+
+    seen_ids = set()
+    pending = [root]
+    total_size = 0
+    while len(pending) > 0:
+        obj = pending.pop()
+        if id(obj) in seen_ids or isinstance(obj, EXCLUDED_TYPES):
+            continue
+        seen_ids.add(id(obj))
+        total_size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return total_size
+
+
+def make_dict_backed_class(slotted_class):
+    '''Returns an old-style class with the methods of the slotted class, whose
+    instances keep their fields in a __dict__.'''
+
+    methods = dict([(name, value) for (name, value) in slotted_class.__dict__.items()
+                    if isinstance(value, types.FunctionType)])
+    return types.ClassType(slotted_class.__name__, (), methods)
+
+
+def extract_alterations(vcf_filename):
+    extractor = AlterationExtractor()
+    start = time.time()
+    with open_vcf(vcf_filename) as vcf_file:
+        extractor.extract_mutations(vcf_file, AlterationExtractor.NATIVE_READER)
+    return extractor, time.time() - start
+
+
+def extract_baseline_alterations(vcf_filename):
+    '''As extract_alterations, with the classes of reportgen.rules.general
+    temporarily replaced by dict-backed ones, and without interning.'''
+
+    module = reportgen.rules.general
+    saved_attributes = dict([(name, getattr(module, name)) for name in SLOTTED_CLASS_NAMES + ["intern_string"]])
+    try:
+        for name in SLOTTED_CLASS_NAMES:
+            setattr(module, name, make_dict_backed_class(saved_attributes[name]))
+        module.intern_string = lambda value: value
+        return extract_alterations(vcf_filename)
+    finally:
+        for name, value in saved_attributes.items():
+            setattr(module, name, value)
+
+
+def measure(label, extract_function, vcf_filename):
+    extractor, elapsed = extract_function(vcf_filename)
+    symbol2gene = extractor.to_dict()
+    n_alterations = extractor.count_alterations()
+    total_size = get_deep_size(symbol2gene)
+    print "%-10s %d alterations in %d genes, extracted in %.2fs; %.1f MB in all, %.1f bytes per alteration" % \
+        (label, n_alterations, len(symbol2gene), elapsed, total_size / 1e6, float(total_size) / n_alterations)
+    return float(total_size) / n_alterations
+
+
+def main():
+    n_annotations = 1000000
+    if len(sys.argv) > 1:
+        n_annotations = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf_filename = os.path.join(tmp_dir, "sample.vcf")
+        with open(vcf_filename, 'w') as vcf_file:
+            write_vep_vcf(vcf_file, n_annotations / TRANSCRIPTS_PER_RECORD, TRANSCRIPTS_PER_RECORD)
+
+        # All annotations are kept, giving one alteration per annotation:
+        baseline_bytes = measure("baseline", extract_baseline_alterations, vcf_filename)
+        gc.collect()
+        current_bytes = measure("current", extract_alterations, vcf_filename)
+        print "current/baseline: %.2f" % (current_bytes / baseline_bytes)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+'''
+Benchmark of single-sample referral lookups against a local SQLite stand-in
+for the referral database, populated with synthetic referrals. Compares
+query_database, which issues an OR over all barcode columns per lookup,
+against a BarcodeIndex, which is built once and then answers each lookup
+with a primary key probe.
+
+Usage, from the repository root:
+python -m benchmarks.bench_barcode_lookup [n_referrals] [n_lookups]
+'''
+
+import os, random, shutil, sys, tempfile, time
+
+import sqlalchemy
+
+from referralmanager.cli.dbimport import get_session
+from referralmanager.cli.models.referrals import AlasccaBloodReferral
+
+from reportgen.reporting.metadata import BarcodeIndex, query_database
+
+from benchmarks.synthetic import write_referral_db
+
+
+def main():
+    n_referrals = 100000
+    n_lookups = 1000
+    if len(sys.argv) > 1:
+        n_referrals = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        n_lookups = int(sys.argv[2])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        uri = "sqlite:///" + os.path.join(tmp_dir, "referrals.db")
+        sample_pairs = write_referral_db(uri, n_referrals)
+        rng = random.Random(0)
+        sample_IDs = [rng.choice(sample_pairs)[0] + rng.randint(0, 2) for _ in range(n_lookups)]
+
+        engine = sqlalchemy.create_engine(uri)
+
+        # A new session for each method, so that neither benefits from
+        # referrals already loaded into the identity map by the other:
+        session = get_session(engine)
+        start = time.time()
+        or_crids = [query_database(sample_ID, AlasccaBloodReferral, session).crid for sample_ID in sample_IDs]
+        elapsed = time.time() - start
+        session.close()
+        print "%-22s %8d referrals %6d lookups %8.3fs %10.0f lookups/s" % \
+            ("OR over barcodes", n_referrals, n_lookups, elapsed, n_lookups / elapsed)
+
+        session = get_session(engine)
+        start = time.time()
+        index = BarcodeIndex(AlasccaBloodReferral, session)
+        build_seconds = time.time() - start
+        start = time.time()
+        index_crids = [index.query(sample_ID).crid for sample_ID in sample_IDs]
+        elapsed = time.time() - start
+        session.close()
+        print "%-22s %8d referrals %6d lookups %8.3fs %10.0f lookups/s (index build %.3fs)" % \
+            ("BarcodeIndex", n_referrals, n_lookups, elapsed, n_lookups / elapsed, build_seconds)
+
+        assert or_crids == index_crids
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
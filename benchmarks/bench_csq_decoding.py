@@ -0,0 +1,78 @@
+'''
+Benchmark of CSQ annotation decoding throughput, comparing the per-field
+AlterationExtractor.extract_* methods (one split per field) against
+CsqDecoder (one split per annotation).
+
+Usage, from the repository root:
+python -m benchmarks.bench_csq_decoding [n_annotations]
+'''
+
+import os, shutil, sys, tempfile, time
+
+from reportgen.rules.general import AlterationExtractor, CsqDecoder
+
+from benchmarks.synthetic import CSQ_FORMAT, write_vep_vcf
+
+TRANSCRIPTS_PER_RECORD = 10
+
+
+def read_annotations(vcf_filename):
+    '''Reads all raw CSQ annotation strings from the synthetic VCF.'''
+
+    annotations = []
+    for line in open(vcf_filename):
+        if line.startswith("#"):
+            continue
+        info = line.split("\t", 8)[7]
+        csq = info.split("CSQ=", 1)[1]
+        annotations.extend(csq.split(","))
+    return annotations
+
+
+def decode_per_field(annotations):
+    extractor = AlterationExtractor()
+    extractor.extract_field_idxs(CSQ_FORMAT.split("|"))
+    for annotation in annotations:
+        extractor.extract_symbol(annotation)
+        extractor.extract_gene_id(annotation)
+        extractor.extract_transcript_id(annotation)
+        extractor.extract_alteration_type(annotation)
+        extractor.extract_aa_position(annotation)
+
+
+def decode_single_split(annotations):
+    decoder = CsqDecoder(CSQ_FORMAT.split("|"))
+    for record in decoder.iter_records(annotations):
+        pass
+
+
+def time_call(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def main():
+    n_annotations = 1000000
+    if len(sys.argv) > 1:
+        n_annotations = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf_filename = os.path.join(tmp_dir, "synthetic.vcf")
+        with open(vcf_filename, "w") as vcf_file:
+            write_vep_vcf(vcf_file, n_annotations // TRANSCRIPTS_PER_RECORD, TRANSCRIPTS_PER_RECORD)
+
+        annotations = read_annotations(vcf_filename)
+
+        for name, function in [("per-field splitting", decode_per_field),
+                               ("CsqDecoder", decode_single_split)]:
+            elapsed = time_call(function, annotations)
+            print "%-20s %10d annotations %8.2fs %12.0f annotations/s" % \
+                  (name, len(annotations), elapsed, len(annotations) / elapsed)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+'''
+Benchmark of referral metadata lookup against a local SQLite stand-in for
+the referral database. Compares a fresh engine, table creation and session
+per sample pair (as when compileMetadata is run once per sample), against a
+single pooled engine and MetadataLookup, both one pair at a time and with
+bulk IN queries for all pairs, reporting the engine/DDL, connection and query
+times separately.
+
+Usage, from the repository root:
+python -m benchmarks.bench_metadata_lookup [n_referrals] [n_pairs]
+'''
+
+import os, shutil, sys, tempfile, time
+
+from referralmanager.cli.dbimport import create_tables, get_session
+
+from reportgen.reporting.metadata import MetadataLookup, retrieve_report_metadata
+from reportgen.reporting.util import get_engine, parse_address_table
+
+from benchmarks.synthetic import write_referral_db
+
+
+ADDRESS_TABLE = os.path.join(os.path.dirname(__file__), os.pardir, "reportgen", "assets", "addresses.csv")
+
+
+def report(name, n_pairs, timings):
+    total = sum(timings.values())
+    print "%-24s %6d pairs %8.3fs total %8.0f pairs/s" % (name, n_pairs, total, n_pairs / total)
+    for phase in sorted(timings.keys()):
+        print "    %-12s %8.3fs" % (phase, timings[phase])
+
+
+def main():
+    n_referrals = 10000
+    n_pairs = 200
+    if len(sys.argv) > 1:
+        n_referrals = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        n_pairs = int(sys.argv[2])
+
+    with open(ADDRESS_TABLE) as address_table_file:
+        id2addresses = parse_address_table(address_table_file)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        uri = "sqlite:///" + os.path.join(tmp_dir, "referrals.db")
+        sample_pairs = write_referral_db(uri, n_referrals)[:n_pairs]
+
+        # One engine, DDL pass and session per pair:
+        timings = {"create_tables": 0.0, "query": 0.0}
+        for blood_sample_ID, tumor_sample_ID in sample_pairs:
+            start = time.time()
+            engine = create_tables(uri)
+            timings["create_tables"] += time.time() - start
+
+            start = time.time()
+            session = get_session(engine)
+            retrieve_report_metadata(blood_sample_ID, tumor_sample_ID, session, id2addresses)
+            session.close()
+            timings["query"] += time.time() - start
+            engine.dispose()
+        report("engine per pair", len(sample_pairs), timings)
+
+        # A single pooled engine and connection:
+        start = time.time()
+        engine = get_engine(uri)
+        engine_seconds = time.time() - start
+        metadata_lookup = MetadataLookup(engine, id2addresses)
+        for blood_sample_ID, tumor_sample_ID in sample_pairs:
+            metadata_lookup.retrieve(blood_sample_ID, tumor_sample_ID)
+        metadata_lookup.close()
+        timings = dict(metadata_lookup.timings)
+        timings["engine"] = engine_seconds
+        report("pooled MetadataLookup", len(sample_pairs), timings)
+
+        # All pairs in bulk:
+        metadata_lookup = MetadataLookup(engine, id2addresses)
+        results = metadata_lookup.retrieve_bulk(sample_pairs)
+        metadata_lookup.close()
+        assert all(error == None for (_, error) in results)
+        report("bulk MetadataLookup", len(sample_pairs), metadata_lookup.timings)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
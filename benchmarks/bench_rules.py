@@ -0,0 +1,235 @@
+'''
+Throughput benchmarks for genomic report compilation, on synthetic inputs:
+- Alteration extraction, rule matching and end-to-end compilation (VCF, CNV
+and MSI files to report dictionary) of samples with 1k, 100k and 1M CSQ
+annotations, a tenth of whose records hit the 100-gene rule panel.
+- Rule spreadsheet parsing, rule index compilation and matching with rule
+tables of 100 and 10k rows.
+
+Each case is timed as the best of several runs. The results, along with
+output counts (alterations extracted, matches found), are written as JSON
+with --output, and compared against a stored baseline with --baseline: a
+case fails if it is more than --tolerance slower than the baseline, or if its
+output counts differ. Timings are only comparable on the machine the
+baseline was recorded on; benchmarks/baselines/bench_rules.json is the
+baseline for the current reference machine, and should be re-recorded
+(with --output) when that changes.
+
+Usage, from the repository root:
+python -m benchmarks.bench_rules [options]
+'''
+
+import datetime, json, os, platform, shutil, sys, tempfile, time, warnings
+
+from optparse import OptionParser
+
+from reportgen.reporting.compilation import AlasccaGenomicReportCompiler
+from reportgen.reporting.util import parse_mutation_table
+from reportgen.rules.alascca import AlasccaClassRule
+from reportgen.rules.general import AlterationExtractor, make_annotation_whitelist, open_vcf
+from reportgen.rules.index import compile_rule_index, find_matches
+
+from benchmarks.synthetic import write_cnv_json, write_msi_file, write_rule_spreadsheet, write_vep_vcf
+
+
+ANNOTATION_SCALES = [1000, 100000, 1000000]
+RULE_TABLE_SCALES = [100, 10000]
+
+TRANSCRIPTS_PER_RECORD = 10
+PANEL_FRACTION = 0.1
+N_PANEL_GENES = 100
+N_ALASCCA_RULES = 30
+
+# Annotations in the sample that rule tables of each size are matched against:
+RULE_MATCHING_ANNOTATIONS = 100000
+
+# Each case is run at least this many times, and until it has taken at least
+# MIN_SECONDS in all:
+N_REPEATS = 3
+MIN_SECONDS = 0.5
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "bench_rules.json")
+
+
+def time_best(function, n_repeats=N_REPEATS, min_seconds=MIN_SECONDS):
+    '''Returns the shortest wall time of repeated calls to the function, and
+    the result of the last call.'''
+
+    times = []
+    while len(times) < n_repeats or sum(times) < min_seconds:
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def make_result(seconds, n_items, count):
+    return {"seconds": seconds, "items": n_items, "items_per_second": n_items / max(seconds, 1e-9),
+            "count": count}
+
+
+def count_alterations(symbol2gene):
+    return sum([len(altered_gene.get_alterations()) for altered_gene in symbol2gene.values()])
+
+
+def write_sample(sample_dir, n_annotations, n_panel_genes):
+    '''Writes a synthetic VCF, CNV and MSI file set to sample_dir, returning
+    the three filenames.'''
+
+    if not os.path.isdir(sample_dir):
+        os.makedirs(sample_dir)
+
+    vcf_filename = os.path.join(sample_dir, "sample.vcf")
+    with open(vcf_filename, 'w') as vcf_file:
+        write_vep_vcf(vcf_file, n_annotations / TRANSCRIPTS_PER_RECORD, TRANSCRIPTS_PER_RECORD,
+                      n_panel_genes = n_panel_genes, panel_fraction = PANEL_FRACTION)
+    cnv_filename = os.path.join(sample_dir, "cnv.json")
+    with open(cnv_filename, 'w') as cnv_file:
+        write_cnv_json(cnv_file, 0)
+    msi_filename = os.path.join(sample_dir, "msi.txt")
+    with open(msi_filename, 'w') as msi_file:
+        write_msi_file(msi_file)
+
+    return vcf_filename, cnv_filename, msi_filename
+
+
+def extract_alterations(vcf_filename, annotation_whitelist):
+    alteration_extractor = AlterationExtractor(annotation_whitelist)
+    with open_vcf(vcf_filename) as vcf_file:
+        alteration_extractor.extract_mutations(vcf_file, AlterationExtractor.NATIVE_READER)
+    return alteration_extractor.to_dict()
+
+
+def run_sample_benchmarks(tmp_dir, annotation_scales, results):
+    crc_spreadsheet = os.path.join(tmp_dir, "crc_rules.xlsx")
+    write_rule_spreadsheet(crc_spreadsheet, N_PANEL_GENES)
+    alascca_spreadsheet = os.path.join(tmp_dir, "alascca_rules.xlsx")
+    write_rule_spreadsheet(alascca_spreadsheet, N_ALASCCA_RULES, seed = 1,
+                           flags = [AlasccaClassRule.CLASS_A, AlasccaClassRule.CLASS_B_1,
+                                    AlasccaClassRule.CLASS_B_2])
+
+    crc_classifications = parse_mutation_table(crc_spreadsheet)
+    whitelist = make_annotation_whitelist([crc_classifications, parse_mutation_table(alascca_spreadsheet)])
+    symbol2index = compile_rule_index(crc_classifications)
+    compiler = AlasccaGenomicReportCompiler(crc_spreadsheet, alascca_spreadsheet,
+                                            vcf_reader_type = AlterationExtractor.NATIVE_READER)
+
+    for n_annotations in annotation_scales:
+        vcf_filename, cnv_filename, msi_filename = \
+            write_sample(os.path.join(tmp_dir, "sample_%d" % n_annotations), n_annotations, N_PANEL_GENES)
+
+        seconds, symbol2gene = time_best(lambda: extract_alterations(vcf_filename, whitelist))
+        results["extract/%d" % n_annotations] = make_result(seconds, n_annotations,
+                                                             count_alterations(symbol2gene))
+
+        n_alterations = count_alterations(symbol2gene)
+        seconds, matches = time_best(lambda: find_matches(symbol2index, symbol2gene))
+        results["match/%d" % n_annotations] = make_result(seconds, n_alterations, len(matches))
+
+        seconds, report = time_best(lambda: compiler.compile(vcf_filename, cnv_filename, msi_filename).to_dict())
+        n_flagged = len([gene for gene in report["simple_somatic_mutations_report"].values()
+                         if len(gene["alterations"]) > 0])
+        results["compile/%d" % n_annotations] = make_result(seconds, n_annotations, n_flagged)
+
+
+def run_rule_table_benchmarks(tmp_dir, rule_table_scales, results):
+    for n_rows in rule_table_scales:
+        spreadsheet_filename = os.path.join(tmp_dir, "rules_%d.xlsx" % n_rows)
+        write_rule_spreadsheet(spreadsheet_filename, n_rows)
+        vcf_filename, _, _ = write_sample(os.path.join(tmp_dir, "rules_sample_%d" % n_rows),
+                                          RULE_MATCHING_ANNOTATIONS, n_rows)
+
+        seconds, classifications = time_best(lambda: parse_mutation_table(spreadsheet_filename))
+        results["rules.parse/%d" % n_rows] = make_result(seconds, n_rows, len(classifications))
+
+        seconds, symbol2index = time_best(lambda: compile_rule_index(classifications))
+        results["rules.index/%d" % n_rows] = make_result(seconds, n_rows, len(symbol2index))
+
+        # All annotations are kept, so that the rule index is also looked up
+        # for transcripts it does not cover:
+        symbol2gene = extract_alterations(vcf_filename, None)
+        seconds, matches = time_best(lambda: find_matches(symbol2index, symbol2gene))
+        results["rules.match/%d" % n_rows] = make_result(seconds, count_alterations(symbol2gene), len(matches))
+
+
+def compare_to_baseline(results, baseline_results, tolerance):
+    '''Prints a comparison of each case's time with the baseline's, returning
+    the names of the cases that are more than the tolerance slower, or whose
+    output counts differ.'''
+
+    failed_case_names = []
+    for case_name in sorted(results.keys()):
+        if not baseline_results.has_key(case_name):
+            continue
+        result = results[case_name]
+        baseline_result = baseline_results[case_name]
+        ratio = result["seconds"] / max(baseline_result["seconds"], 1e-9)
+
+        status = "ok"
+        if result["count"] != baseline_result["count"]:
+            status = "CHANGED OUTPUT (%d, baseline %d)" % (result["count"], baseline_result["count"])
+        elif ratio > 1 + tolerance:
+            status = "SLOWER"
+        if status != "ok":
+            failed_case_names.append(case_name)
+
+        print "%-22s %10.4fs %10.4fs %6.2fx  %s" % (case_name, result["seconds"], baseline_result["seconds"],
+                                                    ratio, status)
+
+    return failed_case_names
+
+
+def main():
+    parser = OptionParser(usage = __doc__.strip())
+    parser.add_option("--maxAnnotations", dest = "max_annotations", type = "int",
+                      default = max(ANNOTATION_SCALES),
+                      help = "Skip samples with more annotations than this. Default=[%default]")
+    parser.add_option("--maxRuleRows", dest = "max_rule_rows", type = "int",
+                      default = max(RULE_TABLE_SCALES),
+                      help = "Skip rule tables with more rows than this. Default=[%default]")
+    parser.add_option("--output", dest = "output_file", default = None,
+                      help = "JSON file to write the results to. Default=[%default]")
+    parser.add_option("--baseline", dest = "baseline_file", default = None,
+                      help = "JSON results file to compare with, e.g. " + DEFAULT_BASELINE + \
+                          ". Default=[%default]")
+    parser.add_option("--tolerance", dest = "tolerance", type = "float",
+                      default = 0.25,
+                      help = "Fraction by which a case can be slower than the baseline. Default=[%default]")
+    (options, args) = parser.parse_args()
+
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    results = {}
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        run_sample_benchmarks(tmp_dir, [n_annotations for n_annotations in ANNOTATION_SCALES
+                                        if n_annotations <= options.max_annotations], results)
+        run_rule_table_benchmarks(tmp_dir, [n_rows for n_rows in RULE_TABLE_SCALES
+                                            if n_rows <= options.max_rule_rows], results)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for case_name in sorted(results.keys()):
+        result = results[case_name]
+        print "%-22s %10.4fs %12.0f items/s %10d" % (case_name, result["seconds"], result["items_per_second"],
+                                                     result["count"])
+
+    if options.output_file != None:
+        with open(options.output_file, 'w') as output_file:
+            json.dump({"date": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+                       "platform": platform.platform(), "results": results},
+                      output_file, indent=4, sort_keys=True)
+
+    if options.baseline_file != None:
+        with open(options.baseline_file) as baseline_file:
+            baseline_results = json.load(baseline_file)["results"]
+        print
+        failed_case_names = compare_to_baseline(results, baseline_results, options.tolerance)
+        if len(failed_case_names) > 0:
+            print >> sys.stderr, "ERROR: %d cases regressed: %s" % (len(failed_case_names),
+                                                                   ", ".join(failed_case_names))
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+'''
+Micro-benchmark of rule spreadsheet loading, comparing openpyxl's default
+(full workbook) mode against the read-only streaming mode used by
+read_mutation_spreadsheet.
+
+Usage, from the repository root:
+python -m benchmarks.bench_spreadsheet_loading [n_rows]
+'''
+
+import os, shutil, sys, tempfile, time, warnings
+
+from reportgen.reporting.util import read_mutation_spreadsheet
+
+from benchmarks.synthetic import write_rule_spreadsheet
+
+
+def main():
+    n_rows = 50000
+    if len(sys.argv) > 1:
+        n_rows = int(sys.argv[1])
+
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        spreadsheet_filename = os.path.join(tmp_dir, "rules.xlsx")
+        write_rule_spreadsheet(spreadsheet_filename, n_rows)
+
+        for name, read_only in [("full workbook", False), ("read-only streaming", True)]:
+            start = time.time()
+            rows = read_mutation_spreadsheet(spreadsheet_filename, read_only)
+            elapsed = time.time() - start
+            print "%-20s %8d rows %8.2fs %10.0f rows/s" % (name, len(rows), elapsed, len(rows) / elapsed)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
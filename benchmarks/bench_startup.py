@@ -0,0 +1,74 @@
+'''
+Benchmark of console script startup time. Each entry point is run with
+--help in a fresh interpreter, which measures the imports done before option
+parsing, and the heavy third-party modules it has loaded are listed. Python
+2 has no "-X importtime", so the import time of each of those modules is
+also measured on its own, in a fresh interpreter.
+
+Usage, from the repository root:
+python -m benchmarks.bench_startup [n_repeats]
+'''
+
+import subprocess, sys, time
+
+
+ENTRY_POINTS = ["compileMetadata", "syncReferralSnapshot", "compileAlasccaGenomicReport",
+                "compileAlasccaGenomicReportBatch", "writeAlasccaReport", "writeAlasccaReportBatch",
+                "reportService", "alasccaReportPipeline"]
+
+HEAVY_MODULES = ["openpyxl", "sqlalchemy", "referralmanager.cli.dbimport", "vcf", "jinja2", "pysam"]
+
+ENTRY_POINT_SCRIPT = """
+import sys
+sys.argv = ["%(entry_point)s", "--help"]
+sys.stdout = open("/dev/null", "w")
+import reportgen.__main__
+try:
+    reportgen.__main__.%(entry_point)s()
+except SystemExit:
+    pass
+sys.stderr.write(",".join([name for name in %(modules)r if name in sys.modules]))
+"""
+
+
+def time_python(script, n_repeats):
+    '''Returns the minimum wall time of running the script in a fresh
+    interpreter, and the script's standard error output.'''
+
+    best_time = None
+    for _ in range(n_repeats):
+        start = time.time()
+        process = subprocess.Popen([sys.executable, "-c", script], stderr=subprocess.PIPE)
+        (_, stderr_output) = process.communicate()
+        elapsed = time.time() - start
+        if process.returncode != 0:
+            raise RuntimeError("Benchmark script failed:\n" + stderr_output)
+        if best_time == None or elapsed < best_time:
+            best_time = elapsed
+
+    return (best_time, stderr_output)
+
+
+def main():
+    n_repeats = 5
+    if len(sys.argv) > 1:
+        n_repeats = int(sys.argv[1])
+
+    (baseline_time, _) = time_python("pass", n_repeats)
+    print "%-34s %8.3fs" % ("interpreter", baseline_time)
+
+    for module in HEAVY_MODULES:
+        try:
+            (module_time, _) = time_python("import " + module, n_repeats)
+            print "%-34s %8.3fs" % ("import " + module, module_time - baseline_time)
+        except RuntimeError:
+            print "%-34s %9s" % ("import " + module, "n/a")
+
+    for entry_point in ENTRY_POINTS:
+        (startup_time, loaded_modules) = time_python(ENTRY_POINT_SCRIPT % {"entry_point": entry_point,
+                                                                           "modules": HEAVY_MODULES}, n_repeats)
+        print "%-34s %8.3fs  loads: %s" % (entry_point, startup_time - baseline_time, loaded_modules)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
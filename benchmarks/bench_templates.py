@@ -0,0 +1,64 @@
+'''
+Benchmark of report template compilation versus rendering. Compiling a
+report template (parsing it and generating python code) is done once per
+jinja environment; with a bytecode cache, later processes only load the
+compiled code. Rendering is done once per report.
+
+Usage, from the repository root:
+python -m benchmarks.bench_templates [n_reports]
+'''
+
+import shutil, sys, tempfile, time
+
+from reportgen.reporting.genomics import GenomicReport, make_jinja_environment
+
+from benchmarks.synthetic import make_genomic_report_json, make_report_metadata
+
+
+TEMPLATE_NAMES = ["alascca.tex", "alasccaOnly.tex"]
+
+DOC_FORMAT = {"checked": "checked.png", "unchecked": "unchecked.png", "logo_files": ["logo.png"]}
+
+N_LOADS = 20
+
+
+def time_template_loads(template_name, bytecode_cache_dir):
+    '''Returns the mean time to load the template into a new environment.'''
+
+    start = time.time()
+    for _ in range(N_LOADS):
+        make_jinja_environment(bytecode_cache_dir = bytecode_cache_dir).get_template(template_name)
+    return (time.time() - start) / N_LOADS
+
+
+def main():
+    n_reports = 200
+    if len(sys.argv) > 1:
+        n_reports = int(sys.argv[1])
+
+    report_jsons = [make_genomic_report_json(30, seed) for seed in range(n_reports)]
+    metadata_json = make_report_metadata()
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for template_name in TEMPLATE_NAMES:
+            compile_time = time_template_loads(template_name, None)
+
+            # Fill the bytecode cache, then time loading from it:
+            make_jinja_environment(bytecode_cache_dir = cache_dir).get_template(template_name)
+            cached_load_time = time_template_loads(template_name, cache_dir)
+
+            template = make_jinja_environment().get_template(template_name)
+            start = time.time()
+            for report_json in report_jsons:
+                GenomicReport(report_json, metadata_json, DOC_FORMAT, template, "2016-01-01").make_latex()
+            render_time = (time.time() - start) / n_reports
+
+            print "%-16s compile %7.2fms  cached load %7.2fms  render %7.2fms/report" % \
+                (template_name, compile_time * 1000, cached_load_time * 1000, render_time * 1000)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
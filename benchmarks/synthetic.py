@@ -0,0 +1,191 @@
+'''
+Generators for synthetic input files, used by the benchmark scripts in this
+directory.
+'''
+
+import datetime, json, random
+
+import openpyxl
+
+
+CSQ_FORMAT = "Allele|Gene|Feature|Feature_type|Consequence|cDNA_position|CDS_position|Protein_position|" + \
+             "Amino_acids|Codons|Existing_variation|AA_MAF|EA_MAF|ALLELE_NUM|RefSeq|EXON|INTRON|MOTIF_NAME|" + \
+             "MOTIF_POS|HIGH_INF_POS|MOTIF_SCORE_CHANGE|DISTANCE|STRAND|CLIN_SIG|CANONICAL|SYMBOL|" + \
+             "SYMBOL_SOURCE|SIFT|PolyPhen|GMAF|BIOTYPE|ENSP|DOMAINS|CCDS|HGVSc|HGVSp|AFR_MAF|AMR_MAF|" + \
+             "ASN_MAF|EUR_MAF|PUBMED"
+
+VCF_HEADER = """##fileformat=VCFv4.1
+##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence type as predicted by VEP. Format: %s">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tTUMOR\tNORMAL
+""" % CSQ_FORMAT
+
+CONSEQUENCES = ["missense_variant", "synonymous_variant", "stop_gained", "frameshift_variant",
+                "intron_variant", "missense_variant&splice_region_variant"]
+
+RESIDUES = ["Ala", "Arg", "Asn", "Asp", "Cys", "Gln", "Glu", "Gly", "His", "Ile",
+            "Leu", "Lys", "Met", "Phe", "Pro", "Ser", "Thr", "Trp", "Tyr", "Val"]
+
+
+def make_csq_annotation(rng, gene_idx, transcript_idx):
+    '''Returns a single synthetic CSQ annotation string, in CSQ_FORMAT column
+    order.'''
+
+    fields = [""] * len(CSQ_FORMAT.split("|"))
+    gene_id = "ENSG%011d" % gene_idx
+    transcript_id = "ENST%011d" % (gene_idx * 100 + transcript_idx)
+    position = rng.randint(1, 1200)
+    fields[0] = "T"
+    fields[1] = gene_id
+    fields[2] = transcript_id
+    fields[3] = "Transcript"
+    fields[4] = rng.choice(CONSEQUENCES)
+    fields[7] = "%d/1200" % position
+    fields[25] = "GENE%d" % gene_idx
+    fields[26] = "HGNC"
+    fields[30] = "protein_coding"
+    fields[31] = "ENSP%011d" % (gene_idx * 100 + transcript_idx)
+    fields[35] = "ENSP%011d.1:p.%s%d%s" % (gene_idx * 100 + transcript_idx, rng.choice(RESIDUES),
+                                           position, rng.choice(RESIDUES))
+    return "|".join(fields)
+
+
+def write_vep_vcf(output_file, n_records, transcripts_per_record, seed=0, n_panel_genes=0, panel_fraction=0.0):
+    '''Writes a VEP-annotated tumor/normal VCF with n_records records, each
+    carrying transcripts_per_record CSQ annotations.
+
+    If n_panel_genes is specified, a panel_fraction of the records (chosen at
+    random) are in one of the genes GENE0 to GENE<n_panel_genes - 1>, which
+    are the genes of the first n_panel_genes rows of a rule spreadsheet
+    written by write_rule_spreadsheet, and include an annotation for the
+    rule transcript. The other records are in genes outside of the panel.'''
+
+    rng = random.Random(seed)
+    output_file.write(VCF_HEADER)
+    for record_idx in range(n_records):
+        if n_panel_genes == 0:
+            gene_idx = record_idx % 20000
+        elif rng.random() < panel_fraction:
+            gene_idx = rng.randrange(n_panel_genes)
+        else:
+            gene_idx = n_panel_genes + record_idx % 20000
+        annotations = [make_csq_annotation(rng, gene_idx, transcript_idx)
+                       for transcript_idx in range(transcripts_per_record)]
+        output_file.write("\t".join(["1", str(record_idx + 1), ".", "C", "T", ".", "PASS",
+                                     "DP=100;CSQ=" + ",".join(annotations),
+                                     "GT:AD:DP", "0/1:50,50:100", "0/0:100,0:100"]) + "\n")
+
+
+def write_cnv_json(output_file, gene_idx, call="HOMLOSS"):
+    '''Writes a CNV call for the gene GENE<gene_idx>, in the format read by
+    AlterationExtractor.extract_cnvs.'''
+
+    json.dump({"name": "GENE%d" % gene_idx, "call": call, "ENSG": "ENSG%011d" % gene_idx,
+               "ENST": "ENST%011d" % (gene_idx * 100)}, output_file, indent=2)
+
+
+def write_msi_file(output_file, seed=0):
+    '''Writes an MSI status file, in the format read by
+    MSIStatus.set_from_file.'''
+
+    rng = random.Random(seed)
+    n_sites = rng.randint(50, 100)
+    n_somatic_sites = rng.randint(0, n_sites)
+    output_file.write("Total_Number_of_Sites\tNumber_of_Somatic_Sites\t%\n")
+    output_file.write("%d\t%d\t%.2f\n" % (n_sites, n_somatic_sites, 100.0 * n_somatic_sites / n_sites))
+
+
+def write_rule_spreadsheet(spreadsheet_filename, n_rows, seed=0, flags=None):
+    '''Writes an excel spreadsheet with a MutationTable sheet of n_rows
+    synthetic rules, in the format read by parse_mutation_table. The rows'
+    flags cycle through the specified list (e.g. the ALASCCA class flags,
+    which AlasccaClassRule requires), or three generic flags by default.'''
+
+    if flags == None:
+        flags = ["FLAG_0", "FLAG_1", "FLAG_2"]
+
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    mutation_table = workbook.create_sheet("MutationTable")
+    mutation_table.append(["Consequence", "Symbol", "Gene", "Feature", "Amino_acid_changes", "Flag"])
+    for row_idx in range(n_rows):
+        gene_idx = row_idx % 20000
+        positions = sorted(rng.sample(range(1, 1200), 5))
+        mutation_table.append([rng.choice(CONSEQUENCES).replace("&", ","), "GENE%d" % gene_idx,
+                               "ENSG%011d" % gene_idx, "ENST%011d" % (gene_idx * 100),
+                               ",".join(map(str, positions)) + ",%d:%d" % (positions[0], positions[-1]),
+                               flags[row_idx % len(flags)]])
+    workbook.save(spreadsheet_filename)
+
+
+def write_referral_db(uri, n_referrals, seed=0):
+    '''Creates the referral tables in the specified database and populates
+    them with n_referrals synthetic blood referrals and as many tissue
+    referrals, one of each per patient, all with hospital code 301 (as
+    listed in the address table asset). Returns the list of (blood barcode,
+    tumor barcode) sample pairs.'''
+
+    # Imported here, so that the other generators remain usable without the
+    # referral-manager package:
+    from referralmanager.cli.dbimport import create_tables
+    from referralmanager.cli.models.referrals import AlasccaBloodReferral, AlasccaTissueReferral
+
+    rng = random.Random(seed)
+    engine = create_tables(uri)
+
+    blood_rows = []
+    tissue_rows = []
+    sample_pairs = []
+    for referral_idx in range(n_referrals):
+        pnr = "19%02d%02d%02d%04d" % (rng.randint(20, 99), rng.randint(1, 12), rng.randint(1, 28), referral_idx % 10000)
+        collection_date = datetime.date(2016, 1, 1) + datetime.timedelta(rng.randint(0, 700))
+        blood_barcode = 10000000 + 3 * referral_idx
+        tumor_barcode = 20000000 + 2 * referral_idx
+        blood_rows.append({"crid": 100000 + referral_idx, "pnr": pnr, "collection_date": collection_date,
+                           "hospital_code": 301, "barcode1": blood_barcode, "barcode2": blood_barcode + 1,
+                           "barcode3": blood_barcode + 2})
+        tissue_rows.append({"crid": 100000 + referral_idx, "pnr": pnr, "collection_date": collection_date,
+                            "hospital_code": 301, "barcode1": tumor_barcode, "barcode2": tumor_barcode + 1})
+        sample_pairs.append((blood_barcode, tumor_barcode))
+
+    connection = engine.connect()
+    transaction = connection.begin()
+    connection.execute(AlasccaBloodReferral.__table__.insert(), blood_rows)
+    connection.execute(AlasccaTissueReferral.__table__.insert(), tissue_rows)
+    transaction.commit()
+    connection.close()
+    engine.dispose()
+
+    return sample_pairs
+
+
+def make_genomic_report_json(n_genes, seed=0):
+    '''Returns a synthetic genomic report dictionary, as written by
+    compileAlasccaGenomicReport, with n_genes genes in the simple somatic
+    mutations report.'''
+
+    rng = random.Random(seed)
+    mutations_report = {}
+    for gene_idx in range(n_genes):
+        alterations = [{"hgvsp": "p.%s%d%s" % (rng.choice(RESIDUES), rng.randint(1, 1200), rng.choice(RESIDUES))}
+                       for _ in range(rng.randint(0, 3))]
+        status = "Mutated"
+        if len(alterations) == 0:
+            status = rng.choice(["Not mutated", "Not determined"])
+        mutations_report["GENE%d" % gene_idx] = {"status": status, "alterations": alterations}
+
+    return {"alascca_class_report": {"alascca_class": rng.choice(["Mutation class A", "Mutation class B",
+                                                                  "Not mutated", "Not determined"])},
+            "msi_report": {"msi_status": rng.choice(["MSS/MSI-L", "MSI-H", "Not determined"])},
+            "simple_somatic_mutations_report": mutations_report,
+            "purity_report": {"purity": rng.choice(["OK", "FAIL"])}}
+
+
+def make_report_metadata():
+    '''Returns a synthetic report metadata dictionary, as written by
+    compileMetadata.'''
+
+    return {"personnummer": "191212121212", "blood_sample_ID": 3098121, "blood_referral_ID": 159725,
+            "blood_sample_date": "2016-01-01", "tumor_sample_ID": 3098849, "tumor_referral_ID": 159977,
+            "tumor_sample_date": "2016-01-01",
+            "return_addresses": [{"attn": "Dr", "line1": "l1", "line2": "l2", "line3": "l3"}]}
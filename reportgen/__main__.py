@@ -4,30 +4,41 @@ Created on Dec 1, 2015
 @author: thowhi
 '''
 
-import json, os, pdb, subprocess, sys, tempfile
-import jinja2
+import json, os, pdb, sys, time
 
 from optparse import OptionParser
 
+# NOTE: reportgen.reporting.metadata and reportgen.reporting.snapshot import
+# sqlalchemy and referral-manager, which are slow to import; they are only
+# imported by the console scripts that use them, to keep the others' startup
+# time down. openpyxl, pyvcf and jinja2 are similarly imported on first use
+# by the modules needing them.
+import reportgen.reporting.batch
 import reportgen.reporting.genomics
-import reportgen.reporting.metadata
+import reportgen.reporting.latex
+import reportgen.reporting.rendering
 import reportgen.reporting.util
 
-from reportgen.rules.general import AlterationExtractor, MSIStatus
-from reportgen.rules.purity import PurityRule
-from reportgen.reporting.caveats import CoverageCaveat, PurityCaveat, ContaminationCaveat
-from reportgen.rules.util import extract_qc_call
+from reportgen.reporting.cache import DEFAULT_CACHE_DIR
+from reportgen.reporting.compilation import AlasccaGenomicReportCompiler
+from reportgen.reporting.metrics import NULL_METRICS, Metrics
 
-import reportgen.rules.alascca
-import reportgen.rules.msi
-import reportgen.rules.simple_somatic_mutations
+from reportgen.rules.general import AlterationExtractor, parse_bed_regions
 
 
 def compileMetadata():
-    description = """usage: %prog [options] <bloodID> <tumorID>\n
+    import reportgen.reporting.metadata
+    import reportgen.reporting.snapshot
+
+    description = """usage: %prog [options] <bloodID> <tumorID>
+       %prog [options] --pairs <pairsFile>\n
 Inputs:
 - Blood sample ID. NOTE: Sticker ID, not referral ID.
 - Tumor sample ID. NOTE: Sticker ID, not referral ID.
+- Alternatively, a file listing many sample pairs; either a tab-separated file
+with a header line, or a JSON list of objects. Each pair has the fields "blood"
+and "tumor" (sample IDs), and optionally "output" (output location). The
+referrals for all pairs are fetched in a single pass.
 
 Outputs:
 - JSON file containing the required fields:
@@ -52,9 +63,34 @@ hard-coded.
     parser.add_option("--address_table_file", dest = "address_table_file",
                       default = "/nfs/ALASCCA/referrals/addresses.csv",
                       help = "File specifying addresses. Default=[%default]")
+    parser.add_option("--addressCacheDir", dest = "address_cache_dir",
+                      default = DEFAULT_CACHE_DIR,
+                      help = "Directory for caching the parsed address table. Default=[%default]")
+    parser.add_option("--noAddressCache", action="store_true", dest="no_address_cache", default=False,
+                      help = "Always parse the address table, without using the cache.")
     parser.add_option("--output", dest = "output_file",
                       default = "MetadataOutput.json",
                       help = "Output location. Default=[%default]")
+    parser.add_option("--pairs", dest = "pairs_file", default = None,
+                      help = "File listing blood/tumor sample pairs to compile metadata for. Default=[%default]")
+    parser.add_option("--output_dir", dest = "output_dir",
+                      default = ".",
+                      help = "Output directory, for pairs without an output location in the pairs file. " + \
+                          "Default=[%default]")
+    parser.add_option("--summary", dest = "summary_file",
+                      default = "MetadataSummary.tsv",
+                      help = "Summary output location, when using --pairs. Default=[%default]")
+    parser.add_option("--createTables", action="store_true", dest="create_tables", default=False,
+                      help = "Create any missing referral tables in the database before querying it.")
+    parser.add_option("--snapshot", dest = "snapshot_file", default = None,
+                      help = "Read referrals from this local snapshot of the database (see " + \
+                          "syncReferralSnapshot), instead of from the database itself. Default=[%default]")
+    parser.add_option("--barcodeIndex", action="store_true", dest="barcode_index", default=False,
+                      help = "Read the barcodes of all referrals into an in-memory index first, and look " + \
+                          "up each sample in it, rather than querying the database for each one. " + \
+                          "Faster for large --pairs files.")
+    parser.add_option("--timings", action="store_true", dest="timings", default=False,
+                      help = "Report the time spent on database setup, connecting and querying.")
     parser.add_option("--debug", action="store_true", dest="debug",
                       help = "Debug the program using pdb.")
     (options, args) = parser.parse_args()
@@ -65,38 +101,220 @@ hard-coded.
         pdb.set_trace()
 
     # Make sure the required input arguments exist:
-    if (len(args) != 2):
+    n_expected_args = 2
+    if options.pairs_file != None:
+        n_expected_args = 0
+    if (len(args) != n_expected_args):
         print >> sys.stderr, "WRONG # ARGS: ", len(args)
         parser.print_help()
         sys.exit(1)
 
-    # Check the input IDs:
-    blood_sample_ID = args[0]
-    if not reportgen.reporting.util.id_valid(blood_sample_ID):
-        print >> sys.stderr, "Invalid blood sample ID:", blood_sample_ID
-        sys.exit(1)
+    if options.pairs_file != None:
+        entries = reportgen.reporting.batch.read_manifest(options.pairs_file, ["blood", "tumor"], ["output"],
+                                                          ["output"])
+    else:
+        entries = [{"blood": args[0], "tumor": args[1], "output": options.output_file}]
 
-    tumor_sample_ID = args[1]
-    if not reportgen.reporting.util.id_valid(tumor_sample_ID):
-        print >> sys.stderr, "Invalid tumor sample ID:", tumor_sample_ID
-        sys.exit(1)
+    # Check the input IDs:
+    for entry in entries:
+        blood_sample_ID = entry["blood"]
+        if not reportgen.reporting.util.id_valid(blood_sample_ID):
+            print >> sys.stderr, "Invalid blood sample ID:", blood_sample_ID
+            sys.exit(1)
+
+        tumor_sample_ID = entry["tumor"]
+        if not reportgen.reporting.util.id_valid(tumor_sample_ID):
+            print >> sys.stderr, "Invalid tumor sample ID:", tumor_sample_ID
+            sys.exit(1)
+
+    address_cache_dir = options.address_cache_dir
+    if options.no_address_cache:
+        address_cache_dir = None
+    id2addresses = reportgen.reporting.util.load_address_index(options.address_table_file, address_cache_dir)
+
+    # Establish a connection to the KI biobank database. Table creation is
+    # only done if requested, as it is not needed for reading referrals:
+    start_time = time.time()
+    if options.snapshot_file != None:
+        if not os.path.exists(options.snapshot_file):
+            print >> sys.stderr, "ERROR: Referral snapshot does not exist:", options.snapshot_file
+            sys.exit(1)
+        db_uri = reportgen.reporting.snapshot.get_snapshot_uri(options.snapshot_file)
+    else:
+        db_uri = reportgen.reporting.util.read_db_uri(options.db_config_file)
+    engine = reportgen.reporting.util.get_engine(db_uri, options.create_tables)
+    setup_seconds = time.time() - start_time
 
-    # Establish an sqlalchemy session connecting to the KI biobank database:
-    session = reportgen.reporting.util.create_sql_session(options.db_config_file)
-    
-    address_table_file = open(options.address_table_file)
-    id2addresses = reportgen.reporting.util.parse_address_table(address_table_file)
+    metadata_lookup = reportgen.reporting.metadata.MetadataLookup(engine, id2addresses, options.barcode_index)
 
     # FIXME: Casting the blood and tumor IDs to ints here. Not sure if they should be ints,
     # but even if they are, I'm not sure if the casting should occur here:
-    report_metdata = reportgen.reporting.metadata.retrieve_report_metadata(int(blood_sample_ID), int(tumor_sample_ID),
-                                                                           session, id2addresses)
+    sample_pairs = [(int(entry["blood"]), int(entry["tumor"])) for entry in entries]
+    if options.pairs_file != None:
+        results = metadata_lookup.retrieve_bulk(sample_pairs)
+    else:
+        # A single pair is retrieved as before, with errors raised directly:
+        results = [(metadata_lookup.retrieve(sample_pairs[0][0], sample_pairs[0][1]), None)]
+    metadata_lookup.close()
+
+    if options.timings:
+        print >> sys.stderr, "Timings (seconds):"
+        print >> sys.stderr, "%s\t%.4f" % ("create_tables" if options.create_tables else "engine", setup_seconds)
+        print >> sys.stderr, "connect\t%.4f" % metadata_lookup.timings["connect"]
+        if options.barcode_index:
+            print >> sys.stderr, "index\t%.4f" % metadata_lookup.timings["index"]
+        print >> sys.stderr, "query\t%.4f" % metadata_lookup.timings["query"]
+
+    statuses = []
+    for entry, (report_metdata, error) in zip(entries, results):
+        output_filename = entry["output"]
+        if output_filename == None:
+            output_filename = os.path.join(options.output_dir,
+                                           "%s_%s_MetadataOutput.json" % (entry["blood"], entry["tumor"]))
+
+        status = {"blood": entry["blood"], "tumor": entry["tumor"], "output": output_filename}
+        if error != None:
+            status["status"] = reportgen.reporting.batch.STATUS_FAILED
+            status["error"] = str(error)
+        else:
+            status["status"] = reportgen.reporting.batch.STATUS_OK
+
+            # Open the output file:
+            output_file = open(output_filename, 'w')
+
+            json.dump(report_metdata, output_file, indent=4, sort_keys=True)
+            output_file.close()
+        statuses.append(status)
+
+    if options.pairs_file != None:
+        with open(options.summary_file, 'w') as summary_file:
+            reportgen.reporting.batch.write_summary(statuses, summary_file,
+                                                    ["blood", "tumor", "status", "output", "error"])
+
+        failed_statuses = [status for status in statuses
+                           if status["status"] != reportgen.reporting.batch.STATUS_OK]
+        for status in failed_statuses:
+            print >> sys.stderr, "ERROR: Sample pair %s/%s failed: %s" % \
+                (status["blood"], status["tumor"], status["error"])
+
+        if len(failed_statuses) > 0:
+            print >> sys.stderr, "ERROR: %d of %d sample pairs failed." % (len(failed_statuses), len(statuses))
+            sys.exit(1)
+
+
+def syncReferralSnapshot():
+    import reportgen.reporting.snapshot
+
+    description = """usage: %prog [options]\n
+Creates or refreshes a local SQLite snapshot of the referral data needed by
+compileMetadata, so that metadata can be compiled with "compileMetadata
+--snapshot" without contacting the referral database.
+
+If --timestampColumn names a modification time attribute of the referral
+tables, only referrals modified since the last sync are copied. Otherwise, or
+with --full, the whole snapshot is replaced. Referrals deleted from the
+database are only removed from the snapshot by a full refresh.
+
+The snapshot contains patient identifiers, so it is created readable only by
+the current user (mode 0600, in a directory with mode 0700 if created).
+"""
+
+    parser = OptionParser(usage = description)
+    parser.add_option("--db_config_file", dest = "db_config_file",
+                      default = "/nfs/ALASCCA/clinseq-referraldb-config.json",
+                      help = "Configuration file for logging into the " + \
+                          "database, including password. Default=[%default]")
+    parser.add_option("--snapshot", dest = "snapshot_file",
+                      default = os.path.join(DEFAULT_CACHE_DIR, "referral_snapshot.sqlite"),
+                      help = "Snapshot file to create or refresh. It contains patient " + \
+                          "identifiers, and is only readable by its owner. Default=[%default]")
+    parser.add_option("--timestampColumn", dest = "timestamp_attribute", default = None,
+                      help = "Referral modification time attribute, for incremental refreshes. " + \
+                          "Default=[%default]")
+    parser.add_option("--full", action="store_true", dest="full_refresh", default=False,
+                      help = "Replace the whole snapshot, even if --timestampColumn is given.")
+    parser.add_option("--debug", action="store_true", dest="debug",
+                      help = "Debug the program using pdb.")
+    (options, args) = parser.parse_args()
+
+    if (options.debug):
+        pdb.set_trace()
+
+    if (len(args) != 0):
+        print >> sys.stderr, "WRONG # ARGS: ", len(args)
+        parser.print_help()
+        sys.exit(1)
 
-    # Open the output file:
-    output_file = open(options.output_file, 'w')
+    engine = reportgen.reporting.util.get_engine(reportgen.reporting.util.read_db_uri(options.db_config_file))
 
-    json.dump(report_metdata, output_file, indent=4, sort_keys=True)
-    output_file.close()
+    start_time = time.time()
+    table_name2n_rows = reportgen.reporting.snapshot.sync_snapshot(engine, options.snapshot_file,
+                                                                   options.timestamp_attribute,
+                                                                   options.full_refresh)
+    for table_name in sorted(table_name2n_rows.keys()):
+        print >> sys.stderr, "Copied %d rows to %s" % (table_name2n_rows[table_name], table_name)
+    print >> sys.stderr, "Snapshot %s synced in %.2fs" % (options.snapshot_file, time.time() - start_time)
+
+
+def add_genomic_compilation_options(parser):
+    '''Adds the options shared by the single-sample and batch genomic report
+    compilation commands.'''
+
+    parser.add_option("--crcMutationRules", dest = "crc_mutation_rules_file",
+                      default = os.path.abspath(os.path.dirname(__file__) + "/assets/COLORECTAL_MUTATION_TABLE.xlsx"),
+                      help = "Rules for flagging mutations in colorectal cancer. Default=[%default]")
+    parser.add_option("--alasccaMutationRules", dest = "alascca_mutation_rules_file",
+                      default = os.path.abspath(os.path.dirname(__file__) + "/assets/ALASCCA_MUTATION_TABLE_SPECIFIC.xlsx"),
+                      help = "Rules for determining ALASCCA class status. Default=[%default]")
+    parser.add_option("--ruleCacheDir", dest = "rule_cache_dir",
+                      default = DEFAULT_CACHE_DIR,
+                      help = "Directory for caching parsed rule spreadsheets. Default=[%default]")
+    parser.add_option("--noRuleCache", action="store_true", dest="no_rule_cache", default=False,
+                      help = "Always parse the rule spreadsheets, without using the cache.")
+    parser.add_option("--vcfReader", dest = "vcf_reader", type = "choice",
+                      choices = [AlterationExtractor.NATIVE_READER, AlterationExtractor.PYVCF_READER],
+                      default = AlterationExtractor.PYVCF_READER,
+                      help = "VCF parser to use; one of pyvcf or native (a lighter parser that only " + \
+                          "extracts the CSQ INFO field). Default=[%default]")
+    parser.add_option("--regionsBED", dest = "regions_bed", default=None,
+                      help = "BED file of regions (e.g. the rule genes) to restrict the VCF to. Requires " + \
+                          "a bgzipped, tabix-indexed VCF file and pysam; uses the native VCF reader. " + \
+                          "Default=[%default]")
+    parser.add_option("--keepAllAnnotations", action="store_true", dest="keep_all_annotations", default=False,
+                      help = "Retain all VEP annotations, rather than only those for genes and transcripts " + \
+                          "referred to by the mutation rules. Only useful for debugging.")
+    parser.add_option("--singlePassRules", action="store_true", dest="single_pass_rules", default=False,
+                      help = "Evaluate all spreadsheet-driven rules in a single pass over the alterations.")
+    parser.add_option("--debug", action="store_true", dest="debug",
+                      help = "Debug the program using pdb.")
+
+
+def make_genomic_report_compiler(options, metrics=NULL_METRICS):
+    '''Returns an AlasccaGenomicReportCompiler configured from the options
+    added by add_genomic_compilation_options(), recording its timings and
+    counts in the metrics object.'''
+
+    rule_cache_dir = options.rule_cache_dir
+    if options.no_rule_cache:
+        rule_cache_dir = None
+
+    regions = None
+    if options.regions_bed is not None:
+        regions = parse_bed_regions(open(options.regions_bed))
+
+    return AlasccaGenomicReportCompiler(options.crc_mutation_rules_file,
+                                        options.alascca_mutation_rules_file,
+                                        rule_cache_dir = rule_cache_dir,
+                                        vcf_reader_type = options.vcf_reader,
+                                        regions = regions,
+                                        keep_all_annotations = options.keep_all_annotations,
+                                        single_pass_rules = options.single_pass_rules,
+                                        metrics = metrics)
+
+
+def write_genomic_report(report_compiler, output_filename):
+    with open(output_filename, 'w') as json_output_file:
+        json.dump(report_compiler.to_dict(), json_output_file, indent=4, sort_keys=True)
 
 
 def compileAlasccaGenomicReport():
@@ -105,7 +323,7 @@ def compileAlasccaGenomicReport():
     # FIXME: ADD MORE PRECISE DESCRIPTION of CNV file ONCE WE HAVE AGREED ON THE FILE FORMAT
     description = """usage: %prog [options] <vcfFile> <cnvFile> <msiFile>\n
 Inputs:
-- VCF file specifying somatic mutations
+- VCF file specifying somatic mutations (plain text or bgzipped)
 - Text file specifying CNVs
 - Text file specifying MSI information
 - Excel spreadsheet specifying rules regarding how to report colorectal cancer mutations
@@ -120,12 +338,6 @@ of this file's format.
     parser.add_option("--output", dest = "output_file",
                       default = "GenomicOutput.json",
                       help = "Output location. Default=[%default]")
-    parser.add_option("--crcMutationRules", dest = "crc_mutation_rules_file",
-                      default = os.path.abspath(os.path.dirname(__file__) + "/assets/COLORECTAL_MUTATION_TABLE.xlsx"),
-                      help = "Rules for flagging mutations in colorectal cancer. Default=[%default]")
-    parser.add_option("--alasccaMutationRules", dest = "alascca_mutation_rules_file",
-                      default = os.path.abspath(os.path.dirname(__file__) + "/assets/ALASCCA_MUTATION_TABLE_SPECIFIC.xlsx"),
-                      help = "Rules for determining ALASCCA class status. Default=[%default]")
     parser.add_option("--tumorCovJSON", dest = "tumor_cov_json", default=None,
                       help = "JSON file specifying coverage call for tumor sample. Default=[%default]")
     parser.add_option("--normalCovJSON", dest = "normal_cov_json", default=None,
@@ -134,8 +346,11 @@ of this file's format.
                       help = "JSON file specifying tumor purity call. Default=[%default]")
     parser.add_option("--contaminationJSON", dest = "contam_json", default=None,
                       help = "JSON file specifying tumor contamination call. Default=[%default]")
-    parser.add_option("--debug", action="store_true", dest="debug",
-                      help = "Debug the program using pdb.")
+    parser.add_option("--metrics", dest = "metrics_file", default=None,
+                      help = "JSON file to write the time taken by each compilation stage, and counts of " + \
+                          "the VCF records, annotations, alterations and rule classifications processed, " + \
+                          "to. Default=[%default]")
+    add_genomic_compilation_options(parser)
     (options, args) = parser.parse_args()
 
     # Parse the input parameters...
@@ -149,114 +364,108 @@ of this file's format.
         parser.print_help()
         sys.exit(1)
 
+    start_time = time.time()
+    metrics = NULL_METRICS
+    if options.metrics_file != None:
+        metrics = Metrics()
+
     # FIXME: Currently I have no error checking on the opening of the input and output
     # files. Need to implement this.
-    vcf_file = open(args[0])
-    cnv_file = open(args[1])
-    msi_file = open(args[2])
-
-    # Generate a dictionary of AlteredGene objects from the input files:
-    alteration_extractor = AlterationExtractor()
-    alteration_extractor.extract_mutations(vcf_file)
-    alteration_extractor.extract_cnvs(cnv_file)
-
-    symbol2altered_gene = alteration_extractor.to_dict()
+    compiler = make_genomic_report_compiler(options, metrics)
+    report_compiler = metrics.time("compile", compiler.compile, args[0], args[1], args[2],
+                                   tumor_cov_json = options.tumor_cov_json,
+                                   normal_cov_json = options.normal_cov_json,
+                                   purity_json = options.purity_json,
+                                   contam_json = options.contam_json)
 
-    # Extract msi status from an input file too:
-    msi_status = MSIStatus()
-    msi_status.set_from_file(msi_file)
-
-    crc_mutations_spreadsheet = options.crc_mutation_rules_file
-    alascca_class_spreadsheet = options.alascca_mutation_rules_file
-
-    # FIXME/ISSUE:
-    # It seems like we should be passing the genomic features to the rule
-    # objects when we call ".apply()", and not when we create the actual
-    # rule objects. The trouble with this is that another object then
-    # needs to keep track of what object should be passed to which rule.
-    # Currently, I'll implement it such that the Rule objects are passed
-    # the relevant information they need when they are created, so that
-    # their ".apply()" methods then accept no arguments.
+    # Write the genomic report to output in JSON format:
+    # FIXME: We may just want toDict instead of toJSON here.
+    metrics.time("write_output", write_genomic_report, report_compiler, options.output_file)
 
-    # Extract rules from the input excel spreadsheets (zero or one spreadsheet
-    # per rule object):
-    mutations_rule = reportgen.rules.simple_somatic_mutations.SimpleSomaticMutationsRule(crc_mutations_spreadsheet,
-                                                                                         symbol2altered_gene)
-    alascca_rule = reportgen.rules.alascca.AlasccaClassRule(alascca_class_spreadsheet,
-                                                            symbol2altered_gene)
-    msi_rule = reportgen.rules.msi.MsiStatusRule(msi_status)
+    if options.metrics_file != None:
+        metrics.add_time("total", time.time() - start_time)
+        metrics.write(options.metrics_file)
 
-    rules = [mutations_rule, alascca_rule, msi_rule]
+    # FIXME: Perhaps need to implement some kind of progress reporting. I normally do this with
+    # print statements to sys.stderr, but perhaps we want to write to log files instead?
 
-    # Extract QC calls from JSON files specified as command line arguments:
-    purity_call = extract_qc_call(open(options.purity_json))
-    tumor_cov_call = extract_qc_call(open(options.tumor_cov_json))
-    normal_cov_call = extract_qc_call(open(options.normal_cov_json))
-    contam_call = extract_qc_call(open(options.contam_json))
 
-    # Generate rule from that input:
-    if purity_call is not None:
-        rules.append(PurityRule(purity_call))
+def compileAlasccaGenomicReportBatch():
+    description = """usage: %prog [options] <manifestFile>\n
+Inputs:
+- Sample manifest, either a tab-separated file with a header line, or a JSON
+list of objects. Each sample has the fields "sample", "vcf", "cnv" and "msi",
+and optionally "tumorCov", "normalCov", "purity", "contamination" (QC JSON
+files) and "output" (output location). Relative paths are relative to the
+manifest's location.
+- Excel spreadsheets specifying the rules, as for compileAlasccaGenomicReport
 
-    report_compiler = reportgen.reporting.genomics.ReportCompiler(rules)
+Outputs:
+- One GenomicOutput JSON file per sample
+- A tab-separated summary file giving the status of each sample
 
-    report_compiler.extract_features()
+The rule spreadsheets are parsed once for the whole batch. A sample that fails
+does not stop the others from being compiled; the exit status is non-zero if any
+sample failed.
+"""
 
-    # Extract coverage, purity and contamination information (if they were provided):
-    caveats = []
+    parser = OptionParser(usage = description)
+    parser.add_option("--output_dir", dest = "output_dir",
+                      default = ".",
+                      help = "Output directory, for samples without an output location in the manifest. " + \
+                          "Default=[%default]")
+    parser.add_option("--summary", dest = "summary_file",
+                      default = "GenomicOutputSummary.tsv",
+                      help = "Summary output location. Default=[%default]")
+    parser.add_option("--workers", dest = "n_workers", type = "int",
+                      default = 1,
+                      help = "Number of worker processes to compile samples with. Default=[%default]")
+    add_genomic_compilation_options(parser)
+    (options, args) = parser.parse_args()
 
-    if purity_call is not None:
-        caveats.append(PurityCaveat(purity_call))
+    if (options.debug):
+        pdb.set_trace()
 
-    if tumor_cov_call is not None:
-        caveats.append(CoverageCaveat(tumor_cov_call))
+    if (len(args) != 1):
+        print >> sys.stderr, "WRONG # ARGS: ", len(args)
+        parser.print_help()
+        sys.exit(1)
 
-    if normal_cov_call is not None:
-        caveats.append(CoverageCaveat(normal_cov_call))
+    if options.n_workers < 1:
+        print >> sys.stderr, "ERROR: --workers must be at least 1."
+        sys.exit(1)
 
-    if contam_call is not None:
-        caveats.append(ContaminationCaveat(contam_call))
+    entries = reportgen.reporting.batch.parse_sample_manifest(args[0])
 
-    # Check the caveats and modify the report accordingly:
-    report_compiler.check_caveats(caveats)
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
 
-    # Set output file according to options:
-    json_output_file = open(options.output_file, 'w')
+    compiler = make_genomic_report_compiler(options)
+    statuses = reportgen.reporting.batch.compile_samples(compiler, entries, options.output_dir,
+                                                         options.n_workers)
 
-    # Write the genomic report to output in JSON format:
-    # FIXME: We may just want toDict instead of toJSON here.
-    output_dict = report_compiler.to_dict()
-    json.dump(output_dict, json_output_file, indent=4, sort_keys=True)
-    json_output_file.close()
+    with open(options.summary_file, 'w') as summary_file:
+        reportgen.reporting.batch.write_summary(statuses, summary_file)
 
-    # FIXME: Perhaps need to implement some kind of progress reporting. I normally do this with
-    # print statements to sys.stderr, but perhaps we want to write to log files instead?
+    failed_statuses = [status for status in statuses
+                       if status["status"] != reportgen.reporting.batch.STATUS_OK]
+    for status in failed_statuses:
+        print >> sys.stderr, "ERROR: Sample %s failed:" % status["sample"]
+        print >> sys.stderr, status["traceback"]
 
+    if len(failed_statuses) > 0:
+        print >> sys.stderr, "ERROR: %d of %d samples failed." % (len(failed_statuses), len(statuses))
+        sys.exit(1)
 
-def writeAlasccaReport():
-    # Parse the command-line arguments...
-    description = """usage: %prog [options] <reportJSONfile> <metadataJSONfile>\n
-Inputs:
-- JSON file containing metadata for the sample
-- JSON file containing the genomic status report data for the sample
-FIXME: Need to agree on a structure for these files and document this somewhere
-and then link to that documentation here
 
-Outputs:
-- Generates a pdf file displaying the formatted report
-"""
+def add_report_format_options(parser):
+    '''Adds the options shared by the single-report and batch PDF rendering
+    commands.'''
 
-    parser = OptionParser(usage = description)
     parser.add_option("--language", dest = "language",
                       default = "Swedish",
                       help = "Language in which the report text will be " + \
                           "generated. One of Swedish or English. Default=[%default]")
-    parser.add_option("--output_name", dest = "output_name",
-                      default = "Report",
-                      help = "Output file name (not including file extension). Default=[%default]")
-    parser.add_option("--output_dir", dest = "output_dir",
-                      default = ".",
-                      help = "Output directory for pdf. Default=[%default]")
     parser.add_option("--fontfamily", dest = "fontfamily",
                       default = "SansSerif",
                       help = "Font in which the report text will be " + \
@@ -299,13 +508,126 @@ Outputs:
                       help = "png file for checked checkbox. " + \
                           "Default=[%default]")
     parser.add_option("--tmp_dir", dest = "tmp_dir",
-                      default = "/tmp",
+                      default = None,
                       help = "Folder for containing temporary files. " + \
-                          "Default=[%default]")
+                          "Default=/dev/shm if available, otherwise the system temporary directory")
+    parser.add_option("--keep_tmp_files", action="store_true", dest="keep_tmp_files", default=False,
+                      help = "Retain the temporary directories of successful pdflatex jobs, as well as of " + \
+                          "failed ones.")
+    parser.add_option("--interaction", dest = "interaction", type = "choice",
+                      choices = reportgen.reporting.latex.INTERACTION_MODES,
+                      default = "batchmode",
+                      help = "pdflatex interaction mode; with nonstopmode, the pdflatex output is also " + \
+                          "written to <output_name>.stdout in the temporary directory. Default=[%default]")
     parser.add_option("--alascca_only", action="store_true", dest="alascca_only", default=False,
                       help = "Only include the alascca class results on the report, no other mutations or msi")
+    parser.add_option("--precompilePreamble", action="store_true", dest="precompile_preamble", default=False,
+                      help = "Precompile the report preamble into a cached pdflatex format file, and only " + \
+                          "run pdflatex on the body of each report.")
+    parser.add_option("--formatCacheDir", dest = "format_cache_dir",
+                      default = DEFAULT_CACHE_DIR,
+                      help = "Directory for caching precompiled report preambles. Default=[%default]")
+    parser.add_option("--templateCacheDir", dest = "template_cache_dir",
+                      default = DEFAULT_CACHE_DIR,
+                      help = "Directory for caching compiled report templates. Default=[%default]")
+    parser.add_option("--noTemplateCache", action="store_true", dest="no_template_cache", default=False,
+                      help = "Always compile the report template, without using the cache.")
+    parser.add_option("--reportDate", dest = "report_date", default = None,
+                      help = "Date to show on the report, e.g. to reproduce an earlier report. " + \
+                          "Default=today's date")
+    parser.add_option("--pdfCache", action="store_true", dest="pdf_cache", default=False,
+                      help = "Reuse a previously rendered PDF if the report's LaTeX code, assets and " + \
+                          "format options are unchanged, rather than running pdflatex.")
+    parser.add_option("--pdfCacheDir", dest = "pdf_cache_dir",
+                      default = DEFAULT_CACHE_DIR,
+                      help = "Directory for caching rendered PDFs. Default=[%default]")
+    parser.add_option("--linkCachedPDFs", action="store_true", dest="link_cached_pdfs", default=False,
+                      help = "Hard-link cached PDFs to the output location where possible, rather than " + \
+                          "copying them.")
     parser.add_option("--debug", action="store_true", dest="debug",
                       help = "Debug the program using pdb.")
+
+
+def make_doc_format(options):
+    return {"checked": options.checked,
+            "unchecked": options.unchecked,
+            "logo_files": options.logos.split(",")}
+
+
+def make_format_cache(options):
+    '''Returns a PreambleFormatCache if --precompilePreamble was specified,
+    otherwise None. The font and margin options are part of the cache key, so
+    changing them results in a new format file.'''
+
+    if not options.precompile_preamble:
+        return None
+
+    format_options = [options.fontfamily, options.sansfont, options.fontsize,
+                      options.margin, options.lmargin, options.rmargin]
+    return reportgen.reporting.rendering.PreambleFormatCache(options.format_cache_dir, format_options,
+                                                             options.tmp_dir)
+
+
+def make_pdf_cache(options):
+    '''Returns a PDFCache if --pdfCache was specified, otherwise None.'''
+
+    if not options.pdf_cache:
+        return None
+
+    # The options that do not (yet) affect the LaTeX code:
+    format_options = [options.language, options.fontfamily, options.sansfont, options.fontsize,
+                      options.margin, options.lmargin, options.rmargin, options.tablepos]
+    asset_filenames = reportgen.reporting.rendering.get_asset_filenames(make_doc_format(options))
+    return reportgen.reporting.rendering.PDFCache(options.pdf_cache_dir, asset_filenames, format_options,
+                                                  options.link_cached_pdfs)
+
+
+def get_report_jinja_environment(options):
+    '''Returns the shared jinja environment for the report templates, with
+    the bytecode cache configured by the options.'''
+
+    template_cache_dir = options.template_cache_dir
+    if options.no_template_cache:
+        template_cache_dir = None
+
+    return reportgen.reporting.genomics.get_jinja_environment(bytecode_cache_dir = template_cache_dir)
+
+
+def get_report_template_name(alascca_only):
+    '''Decide which template to use: If alascca_only is set, use the template
+    for reporting of only alascca class, otherwise use the standard template.'''
+
+    if (alascca_only):
+        return "alasccaOnly.tex"
+    else:
+        return "alascca.tex"
+
+
+def get_report_template(jinja_env, alascca_only):
+    return jinja_env.get_template(get_report_template_name(alascca_only))
+
+
+def writeAlasccaReport():
+    # Parse the command-line arguments...
+    description = """usage: %prog [options] <reportJSONfile> <metadataJSONfile>\n
+Inputs:
+- JSON file containing metadata for the sample
+- JSON file containing the genomic status report data for the sample
+FIXME: Need to agree on a structure for these files and document this somewhere
+and then link to that documentation here
+
+Outputs:
+- Generates a pdf file displaying the formatted report
+"""
+
+    parser = OptionParser(usage = description)
+    parser.add_option("--output_name", dest = "output_name",
+                      default = "Report",
+                      help = "Output file name (not including file extension). Default=[%default]")
+    parser.add_option("--output_dir", dest = "output_dir",
+                      default = ".",
+                      help = "Output directory for pdf. Default=[%default]")
+    add_report_format_options(parser)
     (options, args) = parser.parse_args()
 
     # Parse the input parameters...
@@ -354,38 +676,22 @@ Outputs:
         print >> sys.stderr, e
         sys.exit(1)
 
-    doc_format = {"checked": options.checked,
-                  "unchecked": options.unchecked,
-                  "logo_files": options.logos.split(",")}
-
-    jinja_env = jinja2.Environment(
-	    block_start_string = '\BLOCK{',
-	    block_end_string = '}',
-    	variable_start_string = '\VAR{',
-    	variable_end_string = '}',
-    	comment_start_string = '\#{',
-    	comment_end_string = '}',
-    	line_statement_prefix = '%%',
-    	line_comment_prefix = '%#',
-    	trim_blocks = True,
-    	autoescape = False,
-    	loader = jinja2.FileSystemLoader(os.path.abspath(os.path.dirname(__file__) +
-                                                         "/assets/templates"))
-    )
+    doc_format = make_doc_format(options)
+
+    jinja_env = get_report_jinja_environment(options)
 
     # Decide which template to use
     # If the "--alascca_only" flag is set, use template for reporting of only alascca class,
     # otherwise use the standard template
+    jinja_template = get_report_template(jinja_env, options.alascca_only)
     if (options.alascca_only):
-        jinja_template = jinja_env.get_template("alasccaOnly.tex")
         print >> sys.stdout, "Using template for reporting only alascca class"
     else:
-        jinja_template = jinja_env.get_template("alascca.tex")
         print >> sys.stdout, "Using template for reporting all variant types"
 
     try:
         alascca_report = reportgen.reporting.genomics.GenomicReport(report_json, meta_json, doc_format,
-                                                                    jinja_template)
+                                                                    jinja_template, options.report_date)
     except ValueError, e:
         print >> sys.stderr, "ERROR: Invalid report."
         print >> sys.stderr, e
@@ -394,26 +700,385 @@ Outputs:
     # Generate a string of latex code representing the report:
     report_latex_string = alascca_report.make_latex()
 
-    # Write the resulting latex string to a temporary output file:
-    (_, tmp_latex_filename) = tempfile.mkstemp("tmp", "LatexCode", options.tmp_dir)
-    tmp_latex_file = open(tmp_latex_filename, 'w')
-    print >> sys.stderr, "Writing latex to output file:", tmp_latex_filename
-    tmp_latex_file.write(report_latex_string.encode('utf8'))
-    tmp_latex_file.close()
+    # Reuse the PDF rendered from identical inputs, if it is cached:
+    pdf_cache = make_pdf_cache(options)
+    output_pdf_filename = os.path.join(options.output_dir, options.output_name + ".pdf")
+    if pdf_cache != None:
+        pdf_key = pdf_cache.get_key(report_latex_string)
+        if pdf_cache.retrieve(pdf_key, output_pdf_filename):
+            print >> sys.stderr, "Using cached report:", output_pdf_filename
+            return
+
+    # With a precompiled preamble, only the document body is run through
+    # pdflatex:
+    (report_latex_string, format_filename) = \
+        reportgen.reporting.rendering.apply_preamble_format(report_latex_string, make_format_cache(options))
+
+    # Convert latex to pdf by running pdflatex in a temporary directory, which
+    # is deleted afterwards unless the conversion fails:
+    latex_runner = reportgen.reporting.latex.LatexRunner(options.interaction, options.tmp_dir,
+                                                         keep_scratch_dirs = options.keep_tmp_files)
+    try:
+        latex_result = latex_runner.run(report_latex_string, options.output_name, output_pdf_filename,
+                                        format_filename)
+    except RuntimeError, e:
+        print >> sys.stderr, "ERROR:", e
+        sys.exit(1)
+
+    for (pass_idx, pass_seconds) in enumerate(latex_result["pass_seconds"]):
+        print >> sys.stderr, "pdflatex pass %d: %.2fs" % (pass_idx + 1, pass_seconds)
+
+    if latex_result["returncode"] != 0:
+        print >> sys.stderr, "ERROR: pdflatex conversion failed; see", latex_result["log"]
+        sys.exit(1)
+
+    if latex_result["scratch_dir"] != None:
+        print >> sys.stderr, "Temporary files retained in", latex_result["scratch_dir"]
+
+    if pdf_cache != None:
+        pdf_cache.store(pdf_key, output_pdf_filename)
+
+
+def writeAlasccaReportBatch():
+    description = """usage: %prog [options] <manifestFile>\n
+Inputs:
+- Report manifest, either a tab-separated file with a header line, or a JSON
+list of objects. Each report has the fields "name" (output file name, not
+including file extension), "report" (genomic status report JSON file) and
+"metadata" (metadata JSON file), and optionally "outputDir". Relative paths
+are relative to the manifest's location.
+
+Outputs:
+- One pdf file per report
+- A tab-separated summary file giving the exit status and latency of each
+pdflatex job
+
+The report template is loaded once, and up to --workers pdflatex jobs are run
+at a time, each in its own temporary directory. A report that fails does not
+stop the others from being rendered; the exit status is non-zero if any report
+failed.
+"""
+
+    parser = OptionParser(usage = description)
+    parser.add_option("--output_dir", dest = "output_dir",
+                      default = ".",
+                      help = "Output directory for pdfs, for reports without an outputDir in the manifest. " + \
+                          "Default=[%default]")
+    parser.add_option("--summary", dest = "summary_file",
+                      default = "ReportSummary.tsv",
+                      help = "Summary output location. Default=[%default]")
+    parser.add_option("--workers", dest = "n_workers", type = "int",
+                      default = 1,
+                      help = "Maximum number of concurrent pdflatex jobs. Default=[%default]")
+    add_report_format_options(parser)
+    (options, args) = parser.parse_args()
+
+    if (options.debug):
+        pdb.set_trace()
+
+    if (len(args) != 1):
+        print >> sys.stderr, "WRONG # ARGS: ", len(args)
+        parser.print_help()
+        sys.exit(1)
+
+    if options.n_workers < 1:
+        print >> sys.stderr, "ERROR: --workers must be at least 1."
+        sys.exit(1)
+
+    entries = reportgen.reporting.rendering.parse_render_manifest(args[0])
+
+    jinja_env = get_report_jinja_environment(options)
+    jinja_template = get_report_template(jinja_env, options.alascca_only)
+
+    renderer = reportgen.reporting.rendering.ReportRenderer(jinja_template, make_doc_format(options),
+                                                            options.tmp_dir, options.keep_tmp_files,
+                                                            make_format_cache(options), make_pdf_cache(options),
+                                                            options.report_date, options.interaction)
+    statuses = reportgen.reporting.rendering.render_reports(renderer, entries, options.output_dir,
+                                                            options.n_workers)
+
+    with open(options.summary_file, 'w') as summary_file:
+        reportgen.reporting.batch.write_summary(statuses, summary_file,
+                                                reportgen.reporting.rendering.SUMMARY_COLUMNS)
+
+    failed_statuses = [status for status in statuses
+                       if status["status"] != reportgen.reporting.batch.STATUS_OK]
+    for status in failed_statuses:
+        print >> sys.stderr, "ERROR: Report %s failed:" % status["name"]
+        print >> sys.stderr, status["traceback"]
+
+    if len(failed_statuses) > 0:
+        print >> sys.stderr, "ERROR: %d of %d reports failed." % (len(failed_statuses), len(statuses))
+        sys.exit(1)
+
+
+def add_referral_db_options(parser, default_db_config_file):
+    '''Adds the options for reading referral metadata used by the service and
+    pipeline commands.'''
+
+    parser.add_option("--db_config_file", dest = "db_config_file",
+                      default = default_db_config_file,
+                      help = "Configuration file for logging into the " + \
+                          "database, including password. Default=[%default]")
+    parser.add_option("--snapshot", dest = "snapshot_file", default = None,
+                      help = "Read referrals from this local snapshot of the database (see " + \
+                          "syncReferralSnapshot), instead of from the database itself. Default=[%default]")
+    parser.add_option("--address_table_file", dest = "address_table_file",
+                      default = "/nfs/ALASCCA/referrals/addresses.csv",
+                      help = "File specifying addresses. Default=[%default]")
+    parser.add_option("--addressCacheDir", dest = "address_cache_dir",
+                      default = DEFAULT_CACHE_DIR,
+                      help = "Directory for caching the parsed address table. Default=[%default]")
+    parser.add_option("--noAddressCache", action="store_true", dest="no_address_cache", default=False,
+                      help = "Always parse the address table, without using the cache.")
+
+
+def get_referral_db_uri(options):
+    if options.snapshot_file != None:
+        import reportgen.reporting.snapshot
+        return reportgen.reporting.snapshot.get_snapshot_uri(options.snapshot_file)
+    else:
+        return reportgen.reporting.util.read_db_uri(options.db_config_file)
+
+
+def load_address_index(options):
+    address_cache_dir = options.address_cache_dir
+    if options.no_address_cache:
+        address_cache_dir = None
+    return reportgen.reporting.util.load_address_index(options.address_table_file, address_cache_dir)
+
+
+def reportService():
+    description = """usage: %prog [options]\n
+Runs a report service, which keeps the rule spreadsheets, report template,
+address table and database connection pool loaded between jobs. Jobs are
+submitted as HTTP POST requests with a JSON body, to /compile (a sample
+manifest entry, as for compileAlasccaGenomicReportBatch), /metadata (an object
+with "blood" and "tumor" sample IDs) or /render (a report manifest entry, as for
+writeAlasccaReportBatch, including "outputDir"); GET /status reports the job
+counts. The response is a JSON status object.
+
+The service has no authentication. It listens on a UNIX socket that only the
+current user can connect to, unless --tcp is specified; any local user can
+connect to a TCP port. Output paths in requests must be relative to
+--output_root.
+
+Metadata jobs are only supported if --db_config_file or --snapshot is
+specified. The rule spreadsheets, templates, report assets and address table
+are reloaded when they change.
+"""
+
+    import reportgen.reporting.service
+
+    # The compilation and rendering options both include --debug:
+    parser = OptionParser(usage = description, conflict_handler = "resolve")
+    parser.add_option("--socket", dest = "socket_file",
+                      default = "reportService.sock",
+                      help = "UNIX socket to listen on, accessible only to the current user. " + \
+                          "Default=[%default]")
+    parser.add_option("--tcp", action="store_true", dest="tcp", default=False,
+                      help = "Listen on a TCP port instead of the UNIX socket. NOTE: There is no " + \
+                          "authentication; any local user can submit jobs.")
+    parser.add_option("--host", dest = "host",
+                      default = "127.0.0.1",
+                      help = "Address to listen on, with --tcp. Default=[%default]")
+    parser.add_option("--port", dest = "port", type = "int",
+                      default = 8080,
+                      help = "TCP port to listen on, with --tcp. Default=[%default]")
+    parser.add_option("--output_root", dest = "output_root",
+                      default = ".",
+                      help = "Directory that all output paths in requests are relative to; nothing " + \
+                          "is written outside of it. Default=[%default]")
+    parser.add_option("--workers", dest = "n_workers", type = "int",
+                      default = 2,
+                      help = "Maximum number of concurrently running jobs. Default=[%default]")
+    parser.add_option("--maxPending", dest = "max_pending", type = "int",
+                      default = 16,
+                      help = "Maximum number of jobs waiting to run; further jobs are rejected. " + \
+                          "Default=[%default]")
+    parser.add_option("--reloadInterval", dest = "reload_interval", type = "float",
+                      default = 1.0,
+                      help = "Minimum number of seconds between checks for changed assets. Default=[%default]")
+    add_referral_db_options(parser, None)
+    add_genomic_compilation_options(parser)
+    add_report_format_options(parser)
+    (options, args) = parser.parse_args()
+
+    if (options.debug):
+        pdb.set_trace()
+
+    if (len(args) != 0):
+        print >> sys.stderr, "WRONG # ARGS: ", len(args)
+        parser.print_help()
+        sys.exit(1)
+
+    if options.n_workers < 1:
+        print >> sys.stderr, "ERROR: --workers must be at least 1."
+        sys.exit(1)
+
+    # Compilation:
+    rule_filenames = [options.crc_mutation_rules_file, options.alascca_mutation_rules_file]
+    if options.regions_bed != None:
+        rule_filenames.append(options.regions_bed)
+    compiler_resource = reportgen.reporting.service.ReloadingResource(
+        "rules", rule_filenames, lambda: make_genomic_report_compiler(options), options.reload_interval)
+
+    # Rendering. The jinja environment checks the template for changes
+    # itself, but the renderer also depends on the asset files:
+    jinja_env = get_report_jinja_environment(options)
+    template_filename = os.path.join(reportgen.reporting.genomics.TEMPLATES_DIR,
+                                     get_report_template_name(options.alascca_only))
+    doc_format = make_doc_format(options)
+    format_cache = make_format_cache(options)
+
+    def make_renderer():
+        return reportgen.reporting.rendering.ReportRenderer(get_report_template(jinja_env, options.alascca_only),
+                                                            doc_format, options.tmp_dir, options.keep_tmp_files,
+                                                            format_cache, make_pdf_cache(options),
+                                                            options.report_date, options.interaction)
+
+    renderer_resource = reportgen.reporting.service.ReloadingResource(
+        "template", [template_filename] + reportgen.reporting.rendering.get_asset_filenames(doc_format),
+        make_renderer, options.reload_interval)
+
+    # Metadata:
+    engine = None
+    address_resource = None
+    if options.db_config_file != None or options.snapshot_file != None:
+        engine = reportgen.reporting.util.get_engine(get_referral_db_uri(options))
+        address_resource = reportgen.reporting.service.ReloadingResource(
+            "addresses", [options.address_table_file], lambda: load_address_index(options),
+            options.reload_interval)
+
+    service = reportgen.reporting.service.ReportService(compiler_resource, renderer_resource, engine,
+                                                        address_resource, options.n_workers,
+                                                        options.max_pending, os.path.abspath(options.output_root))
+
+    # Load everything up front, so that the first jobs are fast too, and
+    # errors in the assets are reported at startup:
+    compiler_resource.get()
+    renderer_resource.get()
+    if address_resource != None:
+        address_resource.get()
+
+    if options.tcp:
+        server = reportgen.reporting.service.make_server(service, host = options.host, port = options.port)
+        print >> sys.stderr, "WARNING: Listening on %s:%d, without authentication" % (options.host, options.port)
+    else:
+        try:
+            server = reportgen.reporting.service.make_server(service, socket_filename = options.socket_file)
+        except ValueError, e:
+            print >> sys.stderr, "ERROR:", e
+            sys.exit(1)
+        print >> sys.stderr, "Listening on", options.socket_file
+    print >> sys.stderr, "Job types:", ", ".join(service.get_job_types())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not options.tcp and os.path.exists(options.socket_file):
+            os.remove(options.socket_file)
+
+
+def alasccaReportPipeline():
+    import reportgen.reporting.metadata
+    import reportgen.reporting.pipeline
+
+    description = """usage: %prog [options] <bloodID> <tumorID> <vcfFile> <cnvFile> <msiFile>\n
+Inputs:
+- Blood and tumor sample IDs, as for compileMetadata
+- VCF, CNV and MSI files, as for compileAlasccaGenomicReport
+
+Outputs:
+- A pdf file displaying the formatted report, as for writeAlasccaReport
+- Optionally, the metadata and genomic report JSON files, as written by
+compileMetadata and compileAlasccaGenomicReport
 
-    # Convert latex to pdf by running pdflatex on the command line:
-    # -job-name=Report
-    call_result = subprocess.call(["pdflatex", "-jobname", options.output_name,
-                                   "-output-directory", options.output_dir, tmp_latex_filename])
+Runs compileMetadata, compileAlasccaGenomicReport and writeAlasccaReport in a
+single process, passing the metadata and genomic report between them in
+memory. The time taken by each stage is written to standard error.
+"""
 
-    print >> sys.stderr, tmp_latex_filename
+    # The compilation and rendering options both include --debug:
+    parser = OptionParser(usage = description, conflict_handler = "resolve")
+    parser.add_option("--output_name", dest = "output_name",
+                      default = "Report",
+                      help = "Output file name (not including file extension). Default=[%default]")
+    parser.add_option("--output_dir", dest = "output_dir",
+                      default = ".",
+                      help = "Output directory for pdf. Default=[%default]")
+    parser.add_option("--metadataJSON", dest = "metadata_json_file", default = None,
+                      help = "Also write the report metadata to this JSON file. Default=[%default]")
+    parser.add_option("--genomicJSON", dest = "genomic_json_file", default = None,
+                      help = "Also write the genomic report to this JSON file. Default=[%default]")
+    parser.add_option("--tumorCovJSON", dest = "tumor_cov_json", default=None,
+                      help = "JSON file specifying coverage call for tumor sample. Default=[%default]")
+    parser.add_option("--normalCovJSON", dest = "normal_cov_json", default=None,
+                      help = "JSON file specifying coverage call for normal sample. Default=[%default]")
+    parser.add_option("--purityJSON", dest = "purity_json", default=None,
+                      help = "JSON file specifying tumor purity call. Default=[%default]")
+    parser.add_option("--contaminationJSON", dest = "contam_json", default=None,
+                      help = "JSON file specifying tumor contamination call. Default=[%default]")
+    add_referral_db_options(parser, "/nfs/ALASCCA/clinseq-referraldb-config.json")
+    add_genomic_compilation_options(parser)
+    add_report_format_options(parser)
+    (options, args) = parser.parse_args()
+
+    if (options.debug):
+        pdb.set_trace()
 
-    # Delete the temporary latex file unless told to retain it in the command line options:
-    #if not options.keep_latex:
-    #    subprocess.call(["rm", tmp_latex_filename])
+    if (len(args) != 5):
+        print >> sys.stderr, "WRONG # ARGS: ", len(args)
+        parser.print_help()
+        sys.exit(1)
 
-    if call_result != 0:
-        print >> sys.stderr, "ERROR: pdflatex conversion failed."
+    (blood_sample_ID, tumor_sample_ID) = args[:2]
+    for sample_ID in [blood_sample_ID, tumor_sample_ID]:
+        if not reportgen.reporting.util.id_valid(sample_ID):
+            print >> sys.stderr, "Invalid sample ID:", sample_ID
+            sys.exit(1)
+
+    entry = {"vcf": args[2], "cnv": args[3], "msi": args[4],
+             "tumorCov": options.tumor_cov_json, "normalCov": options.normal_cov_json,
+             "purity": options.purity_json, "contamination": options.contam_json}
+
+    timings = reportgen.reporting.pipeline.StageTimings()
+
+    # Setup:
+    compiler = timings.run("load_rules", make_genomic_report_compiler, options)
+    id2addresses = timings.run("load_addresses", load_address_index, options)
+    engine = timings.run("connect", lambda: reportgen.reporting.util.get_engine(get_referral_db_uri(options)))
+    metadata_lookup = reportgen.reporting.metadata.MetadataLookup(engine, id2addresses)
+
+    def make_renderer():
+        jinja_template = get_report_template(get_report_jinja_environment(options), options.alascca_only)
+        return reportgen.reporting.rendering.ReportRenderer(jinja_template, make_doc_format(options),
+                                                            options.tmp_dir, options.keep_tmp_files,
+                                                            make_format_cache(options), make_pdf_cache(options),
+                                                            options.report_date, options.interaction)
+
+    renderer = timings.run("load_template", make_renderer)
+
+    # FIXME: Casting the blood and tumor IDs to ints here, as compileMetadata does:
+    try:
+        status = reportgen.reporting.pipeline.run_report_pipeline(
+            compiler, metadata_lookup, renderer, int(blood_sample_ID), int(tumor_sample_ID), entry,
+            options.output_name, options.output_dir, timings,
+            genomic_json_filename = options.genomic_json_file,
+            metadata_json_filename = options.metadata_json_file)
+    finally:
+        metadata_lookup.close()
+
+    print >> sys.stderr, "Timings (seconds):"
+    timings.write(sys.stderr)
+    for (pass_idx, pass_seconds) in enumerate(status["pass_seconds"]):
+        print >> sys.stderr, "pdflatex pass %d\t%.4f" % (pass_idx + 1, pass_seconds)
+
+    if status["status"] != reportgen.reporting.batch.STATUS_OK:
+        print >> sys.stderr, "ERROR: Report rendering failed:", status["error"]
         sys.exit(1)
 
 
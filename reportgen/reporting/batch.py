@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+'''
+Compilation of genomic reports for many samples in one process. The rule
+spreadsheets are parsed once for the whole batch, and samples are then
+compiled by a pool of worker processes. A failure in one sample is recorded
+in that sample's status and does not affect the others.
+'''
+
+import json, multiprocessing, os, time, traceback
+
+
+# Manifest columns/keys, mapped to the corresponding arguments of
+# AlasccaGenomicReportCompiler.compile():
+REQUIRED_MANIFEST_FIELDS = ["sample", "vcf", "cnv", "msi"]
+MANIFEST_FIELD2ARGUMENT = {"vcf": "vcf_filename",
+                           "cnv": "cnv_filename",
+                           "msi": "msi_filename",
+                           "tumorCov": "tumor_cov_json",
+                           "normalCov": "normal_cov_json",
+                           "purity": "purity_json",
+                           "contamination": "contam_json"}
+OPTIONAL_MANIFEST_FIELDS = ["tumorCov", "normalCov", "purity", "contamination", "output"]
+
+SUMMARY_COLUMNS = ["sample", "status", "output", "seconds", "error"]
+
+STATUS_OK = "OK"
+STATUS_FAILED = "FAILED"
+
+
+def read_manifest(manifest_filename, required_fields, optional_fields, path_fields):
+    '''Reads a manifest, returning a list of dictionaries, one per entry,
+    with the specified required and optional fields; missing optional fields
+    are None.
+
+    The manifest is either a JSON list of objects (if the filename ends with
+    ".json"), or a tab-separated file whose header line names the columns.
+    Relative paths in path_fields are interpreted relative to the manifest's
+    directory. Integer values of other fields (e.g. sample IDs in a JSON
+    manifest) are converted to strings; any other non-string value raises a
+    ValueError.'''
+
+    with open(manifest_filename) as manifest_file:
+        if manifest_filename.endswith(".json"):
+            raw_entries = json.load(manifest_file)
+            if not isinstance(raw_entries, list):
+                raise ValueError("JSON manifest must contain a list of entries: " + manifest_filename)
+        else:
+            raw_entries = parse_manifest_tsv(manifest_file, required_fields + optional_fields)
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_filename))
+    entries = []
+    for raw_entry in raw_entries:
+        for field in required_fields:
+            if raw_entry.get(field) in (None, ""):
+                raise ValueError("Manifest entry lacks required field %s: %s" % (field, str(raw_entry)))
+
+        entry = {}
+        for field in required_fields + optional_fields:
+            value = raw_entry.get(field)
+            if value in (None, ""):
+                entry[field] = None
+                continue
+
+            if isinstance(value, (int, long)) and not isinstance(value, bool) and not field in path_fields:
+                value = str(value)
+            if not isinstance(value, basestring):
+                raise ValueError("Manifest field %s must be a string: %s" % (field, repr(value)))
+
+            if field in path_fields:
+                entry[field] = os.path.join(manifest_dir, value)
+            else:
+                entry[field] = value
+        entries.append(entry)
+
+    return entries
+
+
+def parse_manifest_tsv(manifest_file, valid_columns):
+    '''Returns a list of dictionaries, one per non-empty line of the
+    tab-separated manifest file, keyed by the header line's column names.'''
+
+    header = manifest_file.readline().strip("\n").split("\t")
+    unknown_columns = set(header) - set(valid_columns)
+    if len(unknown_columns) > 0:
+        raise ValueError("Invalid manifest columns: " + ", ".join(sorted(unknown_columns)))
+
+    raw_entries = []
+    for line in manifest_file:
+        if line.strip() == "":
+            continue
+        values = line.strip("\n").split("\t")
+        if len(values) != len(header):
+            raise ValueError("Invalid manifest line, expected %d columns: %s" % (len(header), line))
+        raw_entries.append(dict(zip(header, values)))
+
+    return raw_entries
+
+
+def check_unique_names(entries, name_field):
+    observed_names = set()
+    for entry in entries:
+        if entry[name_field] in observed_names:
+            raise ValueError("Entry listed more than once in manifest: " + entry[name_field])
+        observed_names.add(entry[name_field])
+
+
+def parse_sample_manifest(manifest_filename):
+    '''Parses a sample manifest (see read_manifest), returning a list of
+    dictionaries, one per sample, with the keys listed in
+    REQUIRED_MANIFEST_FIELDS and OPTIONAL_MANIFEST_FIELDS.'''
+
+    path_fields = MANIFEST_FIELD2ARGUMENT.keys() + ["output"]
+    entries = read_manifest(manifest_filename, REQUIRED_MANIFEST_FIELDS, OPTIONAL_MANIFEST_FIELDS, path_fields)
+    check_unique_names(entries, "sample")
+    return entries
+
+
+def get_output_filename(entry, output_dir):
+    if entry.get("output") != None:
+        return entry["output"]
+    return os.path.join(output_dir, entry["sample"] + "_GenomicOutput.json")
+
+
+def compile_entry(compiler, entry):
+    '''Compiles the report for a single manifest entry, returning it as a
+    dictionary.'''
+
+    compile_args = {}
+    for field, argument in MANIFEST_FIELD2ARGUMENT.items():
+        compile_args[argument] = entry.get(field)
+
+    return compiler.compile(**compile_args).to_dict()
+
+
+def compile_sample(compiler, entry, output_dir):
+    '''Compiles the report for a single manifest entry and writes it to its
+    output file. Returns a status dictionary with the keys listed in
+    SUMMARY_COLUMNS; any exception is recorded there rather than raised.'''
+
+    start_time = time.time()
+    status = {"sample": entry.get("sample"), "output": None, "error": None}
+
+    try:
+        output_filename = get_output_filename(entry, output_dir)
+        status["output"] = output_filename
+        output_dict = compile_entry(compiler, entry)
+
+        # Write to a temporary file first, so that a failed sample never
+        # leaves a truncated report behind:
+        tmp_filename = output_filename + ".tmp"
+        with open(tmp_filename, 'w') as json_output_file:
+            json.dump(output_dict, json_output_file, indent=4, sort_keys=True)
+        os.rename(tmp_filename, output_filename)
+
+        status["status"] = STATUS_OK
+    except Exception, e:
+        status["status"] = STATUS_FAILED
+        status["error"] = "%s: %s" % (e.__class__.__name__, str(e))
+        status["traceback"] = traceback.format_exc()
+
+    status["seconds"] = time.time() - start_time
+    return status
+
+
+# The compiler used by the worker processes. It is set by the pool
+# initializer, so that the parsed rule tables are handed to each worker once
+# rather than being sent along with every sample:
+_worker_compiler = None
+_worker_output_dir = None
+
+
+def _init_worker(compiler, output_dir):
+    global _worker_compiler, _worker_output_dir
+    _worker_compiler = compiler
+    _worker_output_dir = output_dir
+
+
+def _compile_sample_in_worker(entry):
+    return compile_sample(_worker_compiler, entry, _worker_output_dir)
+
+
+def compile_samples(compiler, entries, output_dir, n_workers=1):
+    '''Compiles the reports for all manifest entries, using n_workers worker
+    processes, or the current process if n_workers is 1. Returns a list of
+    status dictionaries, in manifest order.'''
+
+    if n_workers < 1:
+        raise ValueError("Invalid number of workers: %d" % n_workers)
+
+    if n_workers == 1 or len(entries) <= 1:
+        return [compile_sample(compiler, entry, output_dir) for entry in entries]
+
+    pool = multiprocessing.Pool(min(n_workers, len(entries)), _init_worker, (compiler, output_dir))
+    try:
+        statuses = pool.map(_compile_sample_in_worker, entries, chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return statuses
+
+
+def write_summary(statuses, summary_file, columns=SUMMARY_COLUMNS):
+    '''Writes one tab-separated line per status dictionary, after a header
+    naming the columns.'''
+
+    print >> summary_file, "\t".join(columns)
+    for status in statuses:
+        values = []
+        for column in columns:
+            value = status.get(column)
+            if value == None:
+                value = ""
+            elif isinstance(value, float):
+                value = "%.3f" % value
+            elif not isinstance(value, basestring):
+                value = str(value)
+            # Keep each status on a single line:
+            values.append(value.replace("\t", " ").replace("\n", " "))
+        print >> summary_file, "\t".join(values)
@@ -0,0 +1,96 @@
+'''
+A simple on-disk cache for data derived from input files. Entries are keyed
+by a hash of the inputs' contents, so they are invalidated automatically
+whenever an input file changes.
+'''
+
+import cPickle, hashlib, os, tempfile
+
+
+# The cache location can be overridden for all reportgen caches by setting
+# REPORTGEN_CACHE_DIR:
+DEFAULT_CACHE_DIR = os.environ.get("REPORTGEN_CACHE_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "reportgen"))
+
+
+def file_digest(filename):
+    '''Returns the SHA-1 hex digest of the specified file's contents.'''
+
+    digest = hashlib.sha1()
+    with open(filename, "rb") as input_file:
+        for block in iter(lambda: input_file.read(1 << 16), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    '''Combines strings (e.g. file digests and format versions) into a single
+    cache key.'''
+
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode("utf8")
+        digest.update(str(len(part)) + ":" + part)
+    return digest.hexdigest()
+
+
+class FileCache:
+    '''Stores pickled python objects in a directory, one file per key. The
+    cache is best-effort: a missing, corrupt or unwritable cache is treated as
+    a cache miss and never causes an error.'''
+
+    def __init__(self, cache_dir, namespace):
+        self._cache_dir = os.path.join(cache_dir, namespace)
+
+    def get_path(self, key, suffix=".pickle"):
+        return os.path.join(self._cache_dir, key + suffix)
+
+    def load(self, key):
+        '''Returns the cached object for this key, or None on a cache miss.
+        An entry that cannot be unpickled (truncated, corrupt, or referring
+        to a class that no longer exists) is removed and treated as a miss.'''
+
+        try:
+            cache_file = open(self.get_path(key), "rb")
+        except IOError:
+            return None
+
+        try:
+            with cache_file:
+                return cPickle.load(cache_file)
+        except Exception:
+            self.remove(key)
+            return None
+
+    def remove(self, key, suffix=".pickle"):
+        try:
+            os.remove(self.get_path(key, suffix))
+        except OSError:
+            pass
+
+    def store(self, key, value):
+        self.store_file(key, lambda output_file: cPickle.dump(value, output_file, cPickle.HIGHEST_PROTOCOL))
+
+    def store_file(self, key, write_function, suffix=".pickle"):
+        '''Writes a cache entry with the specified function. The entry is
+        written to a temporary file and then renamed, so concurrent readers
+        never see a partially written entry. Returns the path of the entry,
+        or None if it could not be written.'''
+
+        try:
+            if not os.path.isdir(self._cache_dir):
+                os.makedirs(self._cache_dir)
+
+            (tmp_fd, tmp_filename) = tempfile.mkstemp(".tmp", key, self._cache_dir)
+            try:
+                with os.fdopen(tmp_fd, "wb") as tmp_file:
+                    write_function(tmp_file)
+                os.rename(tmp_filename, self.get_path(key, suffix))
+            except:
+                os.remove(tmp_filename)
+                raise
+        except (IOError, OSError):
+            return None
+
+        return self.get_path(key, suffix)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from reportgen.reporting.caveats import CoverageCaveat, PurityCaveat, ContaminationCaveat
+from reportgen.reporting.genomics import ReportCompiler
+from reportgen.reporting.metrics import NULL_METRICS
+from reportgen.reporting.util import parse_mutation_table
+from reportgen.rules.alascca import AlasccaClassRule
+from reportgen.rules.general import AlterationExtractor, MSIStatus, make_annotation_whitelist, open_vcf
+from reportgen.rules.index import AlterationMatchEngine, compile_rule_index
+from reportgen.rules.msi import MsiStatusRule
+from reportgen.rules.purity import PurityRule
+from reportgen.rules.simple_somatic_mutations import SimpleSomaticMutationsRule
+from reportgen.rules.util import extract_qc_call
+
+
+def read_qc_call(qc_json_filename):
+    '''Returns the QC call from the specified JSON file, or None if no file is
+    specified.'''
+
+    if qc_json_filename == None:
+        return None
+
+    with open(qc_json_filename) as qc_json_file:
+        return extract_qc_call(qc_json_file)
+
+
+class AlasccaGenomicReportCompiler:
+    '''Compiles the ALASCCA genomic report for individual samples. The rule
+    spreadsheets are parsed and compiled into rule indexes once, when this
+    object is created, and are then shared by all samples compiled with it.
+
+    Timings and counts for each compilation stage are recorded in the metrics
+    object, if one is specified (see reportgen.reporting.metrics).'''
+
+    def __init__(self, crc_mutations_spreadsheet, alascca_class_spreadsheet, rule_cache_dir=None,
+                 vcf_reader_type=AlterationExtractor.PYVCF_READER, regions=None,
+                 keep_all_annotations=False, single_pass_rules=False, metrics=NULL_METRICS):
+        self._metrics = metrics
+        self._crc_mutations_spreadsheet = crc_mutations_spreadsheet
+        self._alascca_class_spreadsheet = alascca_class_spreadsheet
+        self._vcf_reader_type = vcf_reader_type
+        # Optional list of (chrom, start, end) regions, as returned by
+        # parse_bed_regions, to restrict a tabix-indexed VCF to:
+        self._regions = regions
+        self._single_pass_rules = single_pass_rules
+
+        # Parse the rule spreadsheets up-front, so that VEP annotations that
+        # cannot match any rule can be discarded while parsing the VCF:
+        self._crc_classifications = metrics.time("parse_mutation_table", parse_mutation_table,
+                                                 crc_mutations_spreadsheet, rule_cache_dir)
+        self._alascca_classifications = metrics.time("parse_mutation_table", parse_mutation_table,
+                                                     alascca_class_spreadsheet, rule_cache_dir)
+        if metrics.enabled:
+            for gene_symbol2classifications in [self._crc_classifications, self._alascca_classifications]:
+                metrics.count("rule_classifications",
+                              sum([len(classifications) for classifications in gene_symbol2classifications.values()]))
+
+        self._crc_index = compile_rule_index(self._crc_classifications)
+        self._alascca_index = compile_rule_index(self._alascca_classifications)
+        self._match_engine = None
+        if single_pass_rules:
+            self._match_engine = AlterationMatchEngine(metrics)
+            self._match_engine.register(self._crc_classifications)
+            self._match_engine.register(self._alascca_classifications)
+
+        self._annotation_whitelist = None
+        if not keep_all_annotations:
+            self._annotation_whitelist = make_annotation_whitelist([self._crc_classifications,
+                                                                    self._alascca_classifications])
+
+    def extract_alterations(self, vcf_filename, cnv_filename):
+        '''Generates a dictionary of AlteredGene objects from the input
+        files.'''
+
+        alteration_extractor = AlterationExtractor(self._annotation_whitelist, self._metrics)
+        if self._regions != None:
+            self._metrics.time("extract_mutations", alteration_extractor.extract_mutations_in_regions,
+                               vcf_filename, self._regions)
+        else:
+            with open_vcf(vcf_filename) as vcf_file:
+                self._metrics.time("extract_mutations", alteration_extractor.extract_mutations,
+                                   vcf_file, self._vcf_reader_type)
+
+        with open(cnv_filename) as cnv_file:
+            self._metrics.time("extract_cnvs", alteration_extractor.extract_cnvs, cnv_file)
+
+        return alteration_extractor.to_dict()
+
+    def compile(self, vcf_filename, cnv_filename, msi_filename, tumor_cov_json=None, normal_cov_json=None,
+                purity_json=None, contam_json=None):
+        '''Compiles the genomic report for a single sample, returning the
+        ReportCompiler holding the resulting report features. The QC JSON
+        files are optional.'''
+
+        symbol2altered_gene = self.extract_alterations(vcf_filename, cnv_filename)
+
+        # Extract msi status from an input file too:
+        msi_status = MSIStatus()
+        with open(msi_filename) as msi_file:
+            self._metrics.time("read_msi", msi_status.set_from_file, msi_file)
+
+        # FIXME/ISSUE:
+        # It seems like we should be passing the genomic features to the rule
+        # objects when we call ".apply()", and not when we create the actual
+        # rule objects. The trouble with this is that another object then
+        # needs to keep track of what object should be passed to which rule.
+        # Currently, I'll implement it such that the Rule objects are passed
+        # the relevant information they need when they are created, so that
+        # their ".apply()" methods then accept no arguments.
+        mutations_rule = SimpleSomaticMutationsRule(self._crc_mutations_spreadsheet, symbol2altered_gene,
+                                                    self._crc_classifications, self._crc_index, self._metrics)
+        alascca_rule = AlasccaClassRule(self._alascca_class_spreadsheet, symbol2altered_gene,
+                                        self._alascca_classifications, self._alascca_index, self._metrics)
+        msi_rule = MsiStatusRule(msi_status)
+
+        rules = [mutations_rule, alascca_rule, msi_rule]
+
+        # Extract QC calls from the QC JSON files:
+        purity_call = read_qc_call(purity_json)
+        tumor_cov_call = read_qc_call(tumor_cov_json)
+        normal_cov_call = read_qc_call(normal_cov_json)
+        contam_call = read_qc_call(contam_json)
+
+        # Generate rule from that input:
+        if purity_call is not None:
+            rules.append(PurityRule(purity_call))
+
+        report_compiler = ReportCompiler(rules, self._metrics)
+
+        report_compiler.extract_features(self._single_pass_rules, self._match_engine)
+
+        # Extract coverage, purity and contamination information (if they were provided):
+        caveats = []
+
+        if purity_call is not None:
+            caveats.append(PurityCaveat(purity_call))
+
+        if tumor_cov_call is not None:
+            caveats.append(CoverageCaveat(tumor_cov_call))
+
+        if normal_cov_call is not None:
+            caveats.append(CoverageCaveat(normal_cov_call))
+
+        if contam_call is not None:
+            caveats.append(ContaminationCaveat(contam_call))
+
+        # Check the caveats and modify the report accordingly:
+        report_compiler.check_caveats(caveats)
+
+        return report_compiler
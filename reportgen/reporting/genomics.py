@@ -1,13 +1,66 @@
 # -*- coding: utf-8 -*-
 
-import datetime
+import datetime, os
+
+from reportgen.reporting.metrics import NULL_METRICS
+from reportgen.rules.index import AlterationMatchEngine
+
+
+TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "assets", "templates"))
+
+
+# Shared environments, by (templates directory, bytecode cache directory):
+_jinja_environments = {}
+
+
+def make_jinja_environment(templates_dir=TEMPLATES_DIR, bytecode_cache_dir=None):
+    '''Returns a jinja environment for rendering the LaTeX report templates,
+    using LaTeX-friendly delimiters. The environment caches compiled templates,
+    so a single environment should be shared by all reports that are
+    rendered in a process (see get_jinja_environment). If a bytecode cache
+    directory is specified, compiled templates are also cached there, so that
+    later processes need not compile them again.'''
+
+    # jinja2 is only needed for rendering, not for compiling reports:
+    import jinja2
+
+    bytecode_cache = None
+    if bytecode_cache_dir != None:
+        from reportgen.reporting.templatecache import TemplateBytecodeCache
+        bytecode_cache = TemplateBytecodeCache(bytecode_cache_dir)
+
+    return jinja2.Environment(
+        block_start_string = '\BLOCK{',
+        block_end_string = '}',
+        variable_start_string = '\VAR{',
+        variable_end_string = '}',
+        comment_start_string = '\#{',
+        comment_end_string = '}',
+        line_statement_prefix = '%%',
+        line_comment_prefix = '%#',
+        trim_blocks = True,
+        autoescape = False,
+        loader = jinja2.FileSystemLoader(templates_dir),
+        bytecode_cache = bytecode_cache
+    )
+
+
+def get_jinja_environment(templates_dir=TEMPLATES_DIR, bytecode_cache_dir=None):
+    '''Returns the environment made by make_jinja_environment for these
+    arguments, creating it on the first call only, so that all callers in a
+    process share its compiled templates.'''
+
+    key = (templates_dir, bytecode_cache_dir)
+    if not _jinja_environments.has_key(key):
+        _jinja_environments[key] = make_jinja_environment(templates_dir, bytecode_cache_dir)
+    return _jinja_environments[key]
 
 
 class GenomicReport(object):
     '''
     '''
 
-    def __init__(self, report_json, metadata_json, doc_format, jinja_template):
+    def __init__(self, report_json, metadata_json, doc_format, jinja_template, report_date=None):
         # Save the metadata and report json objects:
         self._report_json = report_json
         self._metadata_json = metadata_json
@@ -17,10 +70,19 @@ class GenomicReport(object):
 
         self.jinja_template = jinja_template
 
+        # The date shown on the report; today's date unless specified, e.g.
+        # to reproduce an earlier report exactly:
+        self._report_date = report_date
+
+    def get_report_date(self):
+        if self._report_date == None:
+            return unicode(datetime.date.today())
+        return unicode(self._report_date)
+
     def make_latex(self):
         return self.jinja_template.render(metaJSON=self._metadata_json,
                                           genomicJSON=self._report_json,
-                                          reportDate=unicode(datetime.date.today()),
+                                          reportDate=self.get_report_date(),
                                           docFormat=self._doc_format)
 
 
@@ -29,25 +91,57 @@ class ReportCompiler:
     output a JSON formatted representation of the report. NOTE: There is no
     alascca report subtype: The particular type of report is determined by
     the composition of rules the compiler is using to generate corresponding
-    report features.'''
+    report features.
+
+    The time taken to apply each rule, and to check the caveats, is recorded
+    in the metrics object, if one is specified (see
+    reportgen.reporting.metrics).'''
 
-    def __init__(self, rules):
+    def __init__(self, rules, metrics=NULL_METRICS):
         self._rules = rules
+        self._metrics = metrics
 
         # This will contain the report features once they have been generated
         # by applying the rules:
         self._name2feature = {}
 
-    def extract_features(self):
-        # Apply each rule, generating a corresponding report feature, which is
-        # then stored in this object:
+    def extract_features(self, single_pass=False, match_engine=None):
+        '''Applies each rule, generating a corresponding report feature, which
+        is then stored in this object.
+
+        If single_pass is True, the rules that match alterations against rule
+        tables (those with an apply_matches method) are evaluated together
+        by an AlterationMatchEngine, which walks over the alterations only
+        once. An engine with the rules' tables already registered can be
+        specified, so that the tables are only compiled once for many
+        samples; otherwise, one is built here.'''
+
+        rule2matches = {}
+        if single_pass:
+            if match_engine == None:
+                match_engine = AlterationMatchEngine(self._metrics)
+            matching_rules = [curr_rule for curr_rule in self._rules if hasattr(curr_rule, "apply_matches")]
+            for curr_rule in matching_rules:
+                match_engine.register(curr_rule.get_classifications())
+            match_lists = self._metrics.time("match_rules", match_engine.run,
+                                             [(curr_rule.get_classifications(), curr_rule.get_symbol2gene())
+                                              for curr_rule in matching_rules])
+            rule2matches = dict(zip(matching_rules, match_lists))
+
         for curr_rule in self._rules:
-            curr_feature = curr_rule.apply()
+            timer_name = "apply." + curr_rule.__class__.__name__
+            if rule2matches.has_key(curr_rule):
+                curr_feature = self._metrics.time(timer_name, curr_rule.apply_matches, rule2matches[curr_rule])
+            else:
+                curr_feature = self._metrics.time(timer_name, curr_rule.apply)
 
             # Store the current feature under this feature's name:
             self._name2feature[curr_feature.component_name()] = curr_feature
 
     def check_caveats(self, caveats):
+        self._metrics.time("check_caveats", self._apply_caveats, caveats)
+
+    def _apply_caveats(self, caveats):
         for feature in self._name2feature.values():
             for caveat in caveats:
                 feature.apply_caveat(caveat)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+'''
+Running pdflatex. Each job runs non-interactively in its own scratch
+directory, which is placed on a tmpfs (RAM-backed) filesystem when one is
+available, as pdflatex writes and rereads several auxiliary files per pass.
+A further pass is only run when the log says that one is needed.
+'''
+
+import os, re, shutil, subprocess, tempfile, time
+
+
+# pdflatex interaction modes that never wait for input: batchmode also
+# suppresses all terminal output, which is then only in the .log file.
+INTERACTION_MODES = ["batchmode", "nonstopmode"]
+
+TMPFS_DIR = "/dev/shm"
+
+MAX_PASSES = 3
+
+# Log messages from LaTeX and its packages (e.g. longtable and rerunfilecheck)
+# saying that the document changes with a further pass:
+RERUN_REGEX = re.compile(r"Rerun to get|Rerun LaTeX|Label\(s\) may have changed|Please rerun")
+
+
+def get_default_scratch_parent():
+    '''Returns TMPFS_DIR if it is a writable directory, otherwise None (i.e.
+    the system temporary directory).'''
+
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK | os.X_OK):
+        return TMPFS_DIR
+    return None
+
+
+def get_pdflatex_version():
+    '''Returns the first line of "pdflatex --version", or an empty string if
+    pdflatex cannot be run.'''
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            version_output = subprocess.check_output(["pdflatex", "--version"], stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+    version_lines = version_output.splitlines()
+    if len(version_lines) == 0:
+        return ""
+    return version_lines[0]
+
+
+def get_format_arguments(format_filename):
+    '''Returns the pdflatex arguments for using the specified format file, if
+    any.'''
+
+    if format_filename == None:
+        return []
+
+    # pdflatex adds the .fmt extension itself:
+    return ["-fmt", os.path.splitext(os.path.abspath(format_filename))[0]]
+
+
+def call_pdflatex(arguments, working_dir, output_name):
+    '''Runs pdflatex with the specified arguments, with no standard input,
+    writing its terminal output to <working_dir>/<output_name>.stdout.
+    Returns the exit status.'''
+
+    with open(os.path.join(working_dir, output_name + ".stdout"), 'w') as stdout_file:
+        with open(os.devnull) as devnull:
+            return subprocess.call(["pdflatex"] + arguments,
+                                   stdin=devnull, stdout=stdout_file, stderr=subprocess.STDOUT)
+
+
+def needs_rerun(log_filename):
+    '''Returns True if the pdflatex log file says that another pass is needed
+    to get cross-references, table widths etc. right.'''
+
+    try:
+        with open(log_filename) as log_file:
+            for line in log_file:
+                if RERUN_REGEX.search(line):
+                    return True
+    except IOError:
+        pass
+
+    return False
+
+
+class LatexRunner:
+    '''Renders LaTeX documents to PDF files, running each job in a new
+    scratch directory. The scratch directory is removed after a successful
+    job (unless keep_scratch_dirs is set), and retained after a failed one so
+    that the LaTeX code and log can be inspected.'''
+
+    def __init__(self, interaction="batchmode", scratch_parent=None, max_passes=MAX_PASSES,
+                 keep_scratch_dirs=False):
+        if not interaction in INTERACTION_MODES:
+            raise ValueError("Invalid pdflatex interaction mode: " + interaction)
+        if max_passes < 1:
+            raise ValueError("Invalid maximum number of pdflatex passes: %d" % max_passes)
+
+        self._interaction = interaction
+        self._scratch_parent = scratch_parent
+        if scratch_parent == None:
+            self._scratch_parent = get_default_scratch_parent()
+        self._max_passes = max_passes
+        self._keep_scratch_dirs = keep_scratch_dirs
+
+    def make_scratch_dir(self, name):
+        return tempfile.mkdtemp("", "Report_" + name + "_", self._scratch_parent)
+
+    def run_pass(self, latex_filename, output_name, scratch_dir, format_filename=None):
+        return call_pdflatex(["-interaction", self._interaction, "-jobname", output_name,
+                              "-output-directory", scratch_dir] +
+                             get_format_arguments(format_filename) + [latex_filename],
+                             scratch_dir, output_name)
+
+    def run(self, latex_string, output_name, output_filename, format_filename=None):
+        '''Renders the LaTeX code to the output PDF file, running pdflatex
+        once, or again (up to max_passes in all) while the log asks for a
+        rerun. If a format file is specified (see PreambleFormatCache), the
+        LaTeX code must only contain the document body.
+
+        Returns a dictionary with the keys "returncode" (of the last pass),
+        "pass_seconds" (a list of the wall time of each pass), "log" (the log
+        file, if retained) and "scratch_dir" (None if it was removed). Raises
+        a RuntimeError if pdflatex exits successfully without writing the
+        PDF file, retaining the scratch directory.'''
+
+        scratch_dir = self.make_scratch_dir(output_name)
+        result = {"returncode": None, "pass_seconds": [], "scratch_dir": scratch_dir,
+                  "log": os.path.join(scratch_dir, output_name + ".log")}
+
+        latex_filename = os.path.join(scratch_dir, "LatexCode.tex")
+        with open(latex_filename, 'w') as latex_file:
+            latex_file.write(latex_string.encode('utf8'))
+
+        while len(result["pass_seconds"]) < self._max_passes:
+            start_time = time.time()
+            result["returncode"] = self.run_pass(latex_filename, output_name, scratch_dir, format_filename)
+            result["pass_seconds"].append(time.time() - start_time)
+            if result["returncode"] != 0 or not needs_rerun(result["log"]):
+                break
+
+        if result["returncode"] == 0:
+            scratch_pdf_filename = os.path.join(scratch_dir, output_name + ".pdf")
+            if not os.path.exists(scratch_pdf_filename):
+                raise RuntimeError("pdflatex conversion failed; see " + result["log"])
+            shutil.move(scratch_pdf_filename, output_filename)
+            if not self._keep_scratch_dirs:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+                result["scratch_dir"] = None
+                result["log"] = None
+
+        return result
@@ -1,44 +1,154 @@
 # -*- coding: utf-8 -*-
 import sqlalchemy
-import pdb
+import sqlalchemy.orm
+import pdb, time
 
+from referralmanager.cli.dbimport import get_session
 from referralmanager.cli.models.referrals import AlasccaBloodReferral, AlasccaTissueReferral
 
 from reportgen.reporting.util import get_addresses
 
-def query_database(sample_ID, referral_type, session):
-    '''Queries the given database wih the given referral type and sample ID.
-    If one and only one record is found, the data for it is returned.'''
+# Maximum number of sample IDs per IN clause in bulk queries. Each ID appears
+# once per barcode column, and this keeps the number of bound parameters
+# below SQLite's default limit of 999:
+BULK_QUERY_CHUNK_SIZE = 300
+
+
+# Barcode attribute names, cached per referral type by get_barcode_attributes:
+_referral_type2barcode_attributes = {}
+
+
+def get_barcode_attributes(referral_type):
+    '''Returns the names of the barcode attributes for this referral type.
+    These are found by introspection the first time a referral type is seen,
+    and then cached.'''
+
+    if _referral_type2barcode_attributes.has_key(referral_type):
+        return _referral_type2barcode_attributes[referral_type]
 
     # Find the barcode attributes for this referral type (different number of barcodes per referral depending on type)
     referral_attributes = dir(referral_type)
     barcode_attributes = filter(lambda x: "barcode" in x, referral_attributes)
     if len(barcode_attributes) == 0:
         raise ValueError("Referral type %s has no barcode attributes" % referral_type.__class__.__name__)
-    
+
+    _referral_type2barcode_attributes[referral_type] = barcode_attributes
+    return barcode_attributes
+
+
+def check_single_record(sample_ID, records):
+    '''Returns the only record in records, raising a ValueError unless there
+    is exactly one.'''
+
+    # Check that there's one and only one record
+    if not len(records) == 1:
+        raise ValueError("Query does not yield a single unique entry: %d" % int(sample_ID))
+
+    return records[0]
+
+
+def query_database(sample_ID, referral_type, session):
+    '''Queries the given database wih the given referral type and sample ID.
+    If one and only one record is found, the data for it is returned.'''
+
+    barcode_attributes = get_barcode_attributes(referral_type)
+
     # Perform the query
     query = session.query(referral_type).filter(sqlalchemy.or_(getattr(referral_type, barcode_attr) == sample_ID
                                                                for barcode_attr in barcode_attributes))
     result = query.all()
-    
-    # Check that there's one and only one record
-    if not len(result) == 1:
-        raise ValueError("Query does not yield a single unique entry: %d" % int(sample_ID))
 
-    return result[0]
+    return check_single_record(sample_ID, result)
 
 
-def retrieve_report_metadata(blood_sample_ID, tissue_sample_ID, session, id2addresses):
-    '''Returns a ReportMetadata object containing the metadata information to
-    include in a report for a paired blood and tumor sample.
+def normalise_barcode(barcode):
+    '''Returns a canonical form of a barcode, so that an integer barcode and
+    its (possibly zero-padded) string form compare equal, as they do in the
+    database.'''
 
-    id2addresses is a dictionary with address ID keys and address array values.'''
+    try:
+        return int(barcode)
+    except (TypeError, ValueError):
+        return barcode
 
-    # Retrieve the relevant records from the tables clinseqalascca.bloodref and
-    # clinseqalascca.tissueref, by issuing queries with the input database
-    # connection...
-    blood_ref = query_database(blood_sample_ID, AlasccaBloodReferral, session)
-    tissue_ref = query_database(tissue_sample_ID, AlasccaTissueReferral, session)
+
+def query_database_bulk(sample_IDs, referral_type, session):
+    '''Retrieves the records of the given referral type matching any of the
+    sample IDs, using one IN query per BULK_QUERY_CHUNK_SIZE IDs. Returns a
+    dictionary of normalised sample ID to the list of matching records.'''
+
+    barcode_attributes = get_barcode_attributes(referral_type)
+
+    unique_sample_IDs = list(set(sample_IDs))
+    barcode2records = dict([(normalise_barcode(sample_ID), []) for sample_ID in unique_sample_IDs])
+    for chunk_start in range(0, len(unique_sample_IDs), BULK_QUERY_CHUNK_SIZE):
+        chunk = unique_sample_IDs[chunk_start:chunk_start + BULK_QUERY_CHUNK_SIZE]
+        query = session.query(referral_type).filter(sqlalchemy.or_(*[getattr(referral_type, barcode_attr).in_(chunk)
+                                                                     for barcode_attr in barcode_attributes]))
+
+        for record in query.all():
+            for barcode_attr in barcode_attributes:
+                barcode = normalise_barcode(getattr(record, barcode_attr))
+                # A record matching on several barcode columns only counts once:
+                if barcode2records.has_key(barcode) and not record in barcode2records[barcode]:
+                    barcode2records[barcode].append(record)
+
+    return barcode2records
+
+
+class BarcodeIndex:
+    '''In-process index of barcode to referral primary key, for a single
+    referral type. The index is built with one query over the primary key and
+    barcode columns, after which each lookup is a single primary key probe
+    (answered from the session's identity map if the referral has already
+    been loaded), rather than an OR over all barcode columns.
+
+    The index reflects the referrals at the time it was built, so it should
+    be built once per session or batch, not kept indefinitely.'''
+
+    def __init__(self, referral_type, session):
+        self._referral_type = referral_type
+        self._session = session
+
+        barcode_attributes = get_barcode_attributes(referral_type)
+        primary_key_columns = list(sqlalchemy.orm.class_mapper(referral_type).primary_key)
+        barcode_columns = [getattr(referral_type, barcode_attr) for barcode_attr in barcode_attributes]
+
+        self._barcode2keys = {}
+        n_key_columns = len(primary_key_columns)
+        for row in session.query(*(primary_key_columns + barcode_columns)):
+            primary_key = tuple(row[:n_key_columns])
+            for barcode in row[n_key_columns:]:
+                if barcode == None:
+                    continue
+
+                barcode = normalise_barcode(barcode)
+                if not self._barcode2keys.has_key(barcode):
+                    self._barcode2keys[barcode] = []
+                # A referral matching on several barcode columns only counts once:
+                if not primary_key in self._barcode2keys[barcode]:
+                    self._barcode2keys[barcode].append(primary_key)
+
+    def __len__(self):
+        return len(self._barcode2keys)
+
+    def get_records(self, sample_ID):
+        '''Returns the list of referrals with a barcode matching the sample
+        ID.'''
+
+        primary_keys = self._barcode2keys.get(normalise_barcode(sample_ID), [])
+        query = self._session.query(self._referral_type)
+        return filter(lambda record: record != None, [query.get(primary_key) for primary_key in primary_keys])
+
+    def query(self, sample_ID):
+        '''Equivalent to query_database for this index's referral type.'''
+
+        return check_single_record(sample_ID, self.get_records(sample_ID))
+
+
+def make_report_metadata(blood_sample_ID, tissue_sample_ID, blood_ref, tissue_ref, id2addresses):
+    '''Returns the report metadata dictionary for a paired blood and tumor
+    sample, given their referral records.'''
 
     # Do a sanity check that the personnummer is the same from both the `
     # and tumor ID. Exit and report an error if this is not the case:
@@ -63,3 +173,136 @@ def retrieve_report_metadata(blood_sample_ID, tissue_sample_ID, session, id2addr
                        "return_addresses": return_addresses}
 
     return output_metadata
+
+
+def retrieve_report_metadata(blood_sample_ID, tissue_sample_ID, session, id2addresses):
+    '''Returns a ReportMetadata object containing the metadata information to
+    include in a report for a paired blood and tumor sample.
+
+    id2addresses is a dictionary with address ID keys and address array values.'''
+
+    # Retrieve the relevant records from the tables clinseqalascca.bloodref and
+    # clinseqalascca.tissueref, by issuing queries with the input database
+    # connection...
+    blood_ref = query_database(blood_sample_ID, AlasccaBloodReferral, session)
+    tissue_ref = query_database(tissue_sample_ID, AlasccaTissueReferral, session)
+
+    return make_report_metadata(blood_sample_ID, tissue_sample_ID, blood_ref, tissue_ref, id2addresses)
+
+
+def retrieve_report_metadata_bulk(sample_pairs, session, id2addresses):
+    '''Retrieves the report metadata for a list of (blood sample ID, tumor
+    sample ID) pairs, fetching the referrals for all of them in a single
+    query per referral table (or per BULK_QUERY_CHUNK_SIZE samples). Each
+    pair is then checked as by retrieve_report_metadata.
+
+    Returns a list with one (metadata, error) tuple per pair, in order: the
+    metadata dictionary and None for a valid pair, or None and the
+    ValueError raised for an invalid one.'''
+
+    barcode2blood_refs = query_database_bulk([blood_sample_ID for (blood_sample_ID, _) in sample_pairs],
+                                             AlasccaBloodReferral, session)
+    barcode2tissue_refs = query_database_bulk([tissue_sample_ID for (_, tissue_sample_ID) in sample_pairs],
+                                              AlasccaTissueReferral, session)
+
+    results = []
+    for blood_sample_ID, tissue_sample_ID in sample_pairs:
+        try:
+            blood_ref = check_single_record(blood_sample_ID, barcode2blood_refs[normalise_barcode(blood_sample_ID)])
+            tissue_ref = check_single_record(tissue_sample_ID,
+                                             barcode2tissue_refs[normalise_barcode(tissue_sample_ID)])
+            results.append((make_report_metadata(blood_sample_ID, tissue_sample_ID, blood_ref, tissue_ref,
+                                                 id2addresses), None))
+        except ValueError, e:
+            results.append((None, e))
+
+    return results
+
+
+class MetadataLookup:
+    '''Retrieves report metadata for any number of blood/tumor sample pairs
+    over a single database connection, checked out once from the engine's
+    connection pool.
+
+    The time spent connecting, building barcode indexes and querying is
+    accumulated in the timings dictionary, so that it can be reported separately from engine creation
+    and table creation.'''
+
+    def __init__(self, engine, id2addresses, use_barcode_index=False):
+        self._id2addresses = id2addresses
+        self.timings = {"connect": 0.0, "index": 0.0, "query": 0.0}
+        self.n_lookups = 0
+
+        start_time = time.time()
+        self._connection = engine.connect()
+        self._session = get_session(self._connection)
+        self.timings["connect"] += time.time() - start_time
+
+        # If use_barcode_index is set, lookups use a BarcodeIndex for each
+        # referral type, built on the first lookup and kept for the rest of
+        # the session. This only pays off when a session serves many
+        # lookups, e.g. a --pairs batch:
+        self._use_barcode_index = use_barcode_index
+        self._referral_type2index = {}
+
+    def get_barcode_index(self, referral_type):
+        if not self._referral_type2index.has_key(referral_type):
+            start_time = time.time()
+            self._referral_type2index[referral_type] = BarcodeIndex(referral_type, self._session)
+            self.timings["index"] += time.time() - start_time
+
+        return self._referral_type2index[referral_type]
+
+    def retrieve(self, blood_sample_ID, tissue_sample_ID):
+        '''Returns the metadata for the sample pair; see
+        retrieve_report_metadata.'''
+
+        if self._use_barcode_index:
+            blood_index = self.get_barcode_index(AlasccaBloodReferral)
+            tissue_index = self.get_barcode_index(AlasccaTissueReferral)
+
+        start_time = time.time()
+        try:
+            if self._use_barcode_index:
+                return make_report_metadata(blood_sample_ID, tissue_sample_ID, blood_index.query(blood_sample_ID),
+                                            tissue_index.query(tissue_sample_ID), self._id2addresses)
+            else:
+                return retrieve_report_metadata(blood_sample_ID, tissue_sample_ID, self._session,
+                                                self._id2addresses)
+        finally:
+            self.timings["query"] += time.time() - start_time
+            self.n_lookups += 1
+
+    def retrieve_bulk(self, sample_pairs):
+        '''Returns the metadata for a list of sample pairs; see
+        retrieve_report_metadata_bulk. With a barcode index, each pair is
+        looked up in the index instead of by the bulk IN queries.'''
+
+        if self._use_barcode_index:
+            blood_index = self.get_barcode_index(AlasccaBloodReferral)
+            tissue_index = self.get_barcode_index(AlasccaTissueReferral)
+
+        start_time = time.time()
+        try:
+            if not self._use_barcode_index:
+                return retrieve_report_metadata_bulk(sample_pairs, self._session, self._id2addresses)
+
+            results = []
+            for blood_sample_ID, tissue_sample_ID in sample_pairs:
+                try:
+                    results.append((make_report_metadata(blood_sample_ID, tissue_sample_ID,
+                                                         blood_index.query(blood_sample_ID),
+                                                         tissue_index.query(tissue_sample_ID),
+                                                         self._id2addresses), None))
+                except ValueError, e:
+                    results.append((None, e))
+            return results
+        finally:
+            self.timings["query"] += time.time() - start_time
+            self.n_lookups += len(sample_pairs)
+
+    def close(self):
+        '''Closes the session and returns the connection to the pool.'''
+
+        self._session.close()
+        self._connection.close()
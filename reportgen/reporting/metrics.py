@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+Timers and counters for the stages of genomic report compilation (VCF
+parsing, rule spreadsheet loading, rule application etc.). Instrumented code
+takes a metrics object defaulting to NULL_METRICS, which discards everything,
+so that instrumentation costs next to nothing unless a Metrics object is
+supplied (e.g. with the --metrics option of compileAlasccaGenomicReport).
+
+Counts in inner loops should be accumulated locally and passed to count()
+once, and any extra work needed only to produce a count should be guarded
+by the metrics object's "enabled" attribute.
+'''
+
+import json, time
+
+
+class NullMetrics:
+    '''Discards all timings and counts.'''
+
+    enabled = False
+
+    def time(self, timer_name, function, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    def add_time(self, timer_name, seconds):
+        pass
+
+    def count(self, counter_name, n=1):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class Metrics:
+    '''Accumulates the total wall time and number of calls of each named
+    timer, and the total of each named counter.'''
+
+    enabled = True
+
+    def __init__(self):
+        self._timer_name2seconds = {}
+        self._timer_name2calls = {}
+        self._counter_name2total = {}
+
+    def time(self, timer_name, function, *args, **kwargs):
+        '''Runs the function with the specified arguments, adding its wall
+        time to the named timer, and returns its result.'''
+
+        start_time = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.add_time(timer_name, time.time() - start_time)
+
+    def add_time(self, timer_name, seconds):
+        self._timer_name2seconds[timer_name] = self._timer_name2seconds.get(timer_name, 0.0) + seconds
+        self._timer_name2calls[timer_name] = self._timer_name2calls.get(timer_name, 0) + 1
+
+    def count(self, counter_name, n=1):
+        self._counter_name2total[counter_name] = self._counter_name2total.get(counter_name, 0) + n
+
+    def get_seconds(self, timer_name):
+        return self._timer_name2seconds.get(timer_name, 0.0)
+
+    def get_count(self, counter_name):
+        return self._counter_name2total.get(counter_name, 0)
+
+    def to_dict(self):
+        timers = {}
+        for timer_name in self._timer_name2seconds.keys():
+            timers[timer_name] = {"seconds": self._timer_name2seconds[timer_name],
+                                  "calls": self._timer_name2calls[timer_name]}
+        return {"timers": timers, "counters": dict(self._counter_name2total)}
+
+    def write(self, output_filename):
+        with open(output_filename, 'w') as output_file:
+            json.dump(self.to_dict(), output_file, indent=4, sort_keys=True)
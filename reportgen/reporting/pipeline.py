@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+'''
+The complete report pipeline for one sample pair, in a single process:
+metadata retrieval, genomic report compilation and PDF rendering. The report
+and metadata dictionaries are passed between the stages in memory; the
+intermediate JSON files are only written if requested, e.g. for auditing.
+'''
+
+import json, time
+
+from reportgen.reporting.batch import compile_entry
+
+
+class StageTimings:
+    '''Records the wall time of each named stage, in the order in which they
+    were run.'''
+
+    def __init__(self):
+        self.stages = []
+
+    def run(self, stage_name, function, *args, **kwargs):
+        '''Runs the function with the specified arguments, recording its wall
+        time under the stage name, and returns its result.'''
+
+        start_time = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.add(stage_name, time.time() - start_time)
+
+    def add(self, stage_name, seconds):
+        self.stages.append((stage_name, seconds))
+
+    def get_total(self):
+        return sum([seconds for (_, seconds) in self.stages])
+
+    def write(self, output_file):
+        for (stage_name, seconds) in self.stages:
+            print >> output_file, "%s\t%.4f" % (stage_name, seconds)
+        print >> output_file, "%s\t%.4f" % ("total", self.get_total())
+
+
+def decode_strings(value):
+    '''Returns a copy of a JSON-compatible value with all byte strings decoded
+    from UTF-8, as a JSON round trip would do. (The address table, for
+    example, yields UTF-8 byte strings, which cannot be mixed with the
+    unicode template text.)'''
+
+    if isinstance(value, str):
+        return value.decode('utf8')
+    elif isinstance(value, dict):
+        return dict([(decode_strings(key), decode_strings(item)) for (key, item) in value.items()])
+    elif isinstance(value, (list, tuple)):
+        return [decode_strings(item) for item in value]
+    else:
+        return value
+
+
+def write_json(output_dict, output_filename):
+    '''Writes the dictionary in the same format as the individual console
+    scripts, so that audit files can be compared with their output.'''
+
+    with open(output_filename, 'w') as output_file:
+        json.dump(output_dict, output_file, indent=4, sort_keys=True)
+
+
+def run_report_pipeline(compiler, metadata_lookup, renderer, blood_sample_ID, tumor_sample_ID, entry,
+                        output_name, output_dir, timings, genomic_json_filename=None,
+                        metadata_json_filename=None):
+    '''Retrieves the metadata for the sample pair, compiles the genomic report
+    for the sample manifest entry (see parse_sample_manifest; the "sample"
+    and "output" fields are not used) and renders the PDF report to
+    <output_dir>/<output_name>.pdf. The time taken by each stage is added to
+    timings (a StageTimings). Returns the renderer's status dictionary, which
+    also gives the time taken by each pdflatex pass.
+
+    Errors in metadata retrieval or compilation are raised directly; the
+    report and metadata are written to the specified JSON files, if any,
+    before rendering.'''
+
+    report_metadata = timings.run("metadata", lambda: decode_strings(metadata_lookup.retrieve(blood_sample_ID,
+                                                                                          tumor_sample_ID)))
+    genomic_report = timings.run("compile", lambda: decode_strings(compile_entry(compiler, entry)))
+
+    if metadata_json_filename != None:
+        timings.run("write_metadata_json", write_json, report_metadata, metadata_json_filename)
+    if genomic_json_filename != None:
+        timings.run("write_genomic_json", write_json, genomic_report, genomic_json_filename)
+
+    return timings.run("render", renderer.render_data, output_name, genomic_report, report_metadata,
+                       output_dir)
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+'''
+Rendering of many PDF reports in one process. The jinja environment and
+template are set up once, and the pdflatex jobs are then run by a bounded pool,
+each in its own scratch directory (see LatexRunner) so that their auxiliary
+files never collide.
+
+The report preamble (document class, packages, fonts and page layout) is the
+same for every report, so it can optionally be precompiled into a pdflatex
+format file, which is cached; each report then only runs its body through
+pdflatex. See PreambleFormatCache.
+'''
+
+import json, os, shutil, sys, tempfile, threading, time, traceback
+
+from multiprocessing.pool import ThreadPool
+
+from reportgen.reporting.batch import check_unique_names, read_manifest, STATUS_FAILED, STATUS_OK
+from reportgen.reporting.cache import FileCache, file_digest, make_key
+from reportgen.reporting.genomics import GenomicReport
+from reportgen.reporting.latex import LatexRunner, call_pdflatex, get_default_scratch_parent, get_pdflatex_version
+
+
+REQUIRED_MANIFEST_FIELDS = ["name", "report", "metadata"]
+OPTIONAL_MANIFEST_FIELDS = ["outputDir"]
+
+SUMMARY_COLUMNS = ["name", "status", "cached", "returncode", "passes", "pdflatex_seconds", "seconds",
+                   "output", "error"]
+
+# Increment this when the way format files are built changes, to invalidate
+# previously cached ones:
+PREAMBLE_FORMAT_VERSION = "1"
+
+# Likewise for cached PDF files:
+PDF_CACHE_VERSION = "1"
+
+BEGIN_DOCUMENT = u"\\begin{document}"
+
+
+def parse_render_manifest(manifest_filename):
+    '''Parses a rendering manifest (see read_manifest), returning a list of
+    dictionaries, one per report, with the keys "name" (the output file name,
+    without extension), "report" and "metadata" (the JSON input files) and
+    optionally "outputDir".'''
+
+    entries = read_manifest(manifest_filename, REQUIRED_MANIFEST_FIELDS, OPTIONAL_MANIFEST_FIELDS,
+                            ["report", "metadata", "outputDir"])
+    check_unique_names(entries, "name")
+    return entries
+
+
+def split_latex_preamble(latex_string):
+    '''Splits a LaTeX document into its preamble and its body, which starts
+    at \\begin{document}. Returns a (preamble, body) tuple, or None if the
+    document has no \\begin{document}.'''
+
+    begin_idx = latex_string.find(BEGIN_DOCUMENT)
+    if begin_idx == -1:
+        return None
+
+    return (latex_string[:begin_idx], latex_string[begin_idx:])
+
+
+class PreambleFormatCache:
+    '''Builds and caches pdflatex format files, each containing a precompiled
+    report preamble, so that the preamble's packages and fonts need not be
+    loaded again for every report.
+
+    A format file is keyed by the preamble text itself (which changes with
+    the template), the pdflatex version (format files can only be loaded by
+    the pdflatex that dumped them) and the specified format options (e.g. the
+    fonts and margins), so a changed template or option results in a new
+    format file being built automatically.
+
+    Instances may be shared between threads. Failing to build a format file
+    is not an error: get_format() then returns None, and the report should be
+    rendered from the complete LaTeX document instead. Format files are
+    built in a scratch directory under tmp_dir, which defaults to the same
+    location as LatexRunner's (see get_default_scratch_parent).'''
+
+    def __init__(self, cache_dir, format_options=[], tmp_dir=None):
+        self._cache = FileCache(cache_dir, "latex_formats")
+        self._format_options = [unicode(option) for option in format_options]
+        self._tmp_dir = tmp_dir
+        if tmp_dir == None:
+            self._tmp_dir = get_default_scratch_parent()
+        self._pdflatex_version = None
+        self._preamble2format_filename = {}
+        self._lock = threading.Lock()
+
+    def get_key(self, preamble):
+        if self._pdflatex_version == None:
+            self._pdflatex_version = get_pdflatex_version()
+
+        return make_key(PREAMBLE_FORMAT_VERSION, self._pdflatex_version, preamble, *self._format_options)
+
+    def get_format(self, preamble):
+        '''Returns the filename of the format file for this preamble, building
+        it if it is not already cached, or None if it could not be built.'''
+
+        with self._lock:
+            if not self._preamble2format_filename.has_key(preamble):
+                self._preamble2format_filename[preamble] = self.load_or_build_format(preamble)
+            return self._preamble2format_filename[preamble]
+
+    def load_or_build_format(self, preamble):
+        key = self.get_key(preamble)
+        format_filename = self._cache.get_path(key, ".fmt")
+        if os.path.exists(format_filename):
+            return format_filename
+
+        scratch_dir = tempfile.mkdtemp("", "ReportFormat_", self._tmp_dir)
+        try:
+            preamble_filename = os.path.join(scratch_dir, "Preamble.tex")
+            with open(preamble_filename, 'w') as preamble_file:
+                preamble_file.write(preamble.encode('utf8'))
+                preamble_file.write("\n\\dump\n")
+
+            # Initialise a new format from the standard LaTeX one, then read
+            # the preamble and dump the result:
+            returncode = call_pdflatex(["-ini", "-interaction", "batchmode", "-jobname", key,
+                                        "-output-directory", scratch_dir, "&pdflatex", preamble_filename],
+                                       scratch_dir, key)
+
+            dumped_filename = os.path.join(scratch_dir, key + ".fmt")
+            if returncode != 0 or not os.path.exists(dumped_filename):
+                print >> sys.stderr, "WARNING: Could not precompile the report preamble; see " + \
+                    os.path.join(scratch_dir, key + ".log")
+                return None
+
+            def copy_format(output_file):
+                with open(dumped_filename, "rb") as dumped_file:
+                    shutil.copyfileobj(dumped_file, output_file)
+
+            format_filename = self._cache.store_file(key, copy_format, ".fmt")
+            if format_filename == None:
+                # The cache is not writable; keep the dumped format file:
+                return dumped_filename
+        except OSError, e:
+            print >> sys.stderr, "WARNING: Could not precompile the report preamble:", e
+            return None
+
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        return format_filename
+
+
+def apply_preamble_format(latex_string, format_cache):
+    '''Returns a (latex_string, format_filename) tuple, for running pdflatex
+    on the body of the specified LaTeX document with its preamble precompiled.
+    If format_cache is None, or the preamble cannot be precompiled, the
+    complete document is returned, with a format filename of None.'''
+
+    if format_cache == None:
+        return (latex_string, None)
+
+    split_latex = split_latex_preamble(latex_string)
+    if split_latex == None:
+        return (latex_string, None)
+
+    (preamble, body) = split_latex
+    format_filename = format_cache.get_format(preamble)
+    if format_filename == None:
+        return (latex_string, None)
+
+    return (body, format_filename)
+
+
+def get_asset_filenames(doc_format):
+    '''Returns the names of the image files included in reports with the
+    specified document format.'''
+
+    return [doc_format["checked"], doc_format["unchecked"]] + list(doc_format["logo_files"])
+
+
+class PDFCache:
+    '''Caches rendered PDF reports, keyed by the report's LaTeX code, the
+    contents of the asset files it includes, the format options that are not
+    part of the LaTeX code, and the pdflatex version. The LaTeX code is
+    generated from the report and metadata JSON and the template, so a change
+    to any of them changes the key. NOTE: The LaTeX code includes the report
+    date, so reports are only found in the cache on the day they were
+    rendered, unless the report date is specified (see GenomicReport).
+
+    With link=True, cached PDFs are hard-linked to the output location where
+    possible rather than copied; the output files must then not be modified
+    in place.'''
+
+    def __init__(self, cache_dir, asset_filenames=[], format_options=[], link=False):
+        self._cache = FileCache(cache_dir, "pdfs")
+        self._asset_digests = [file_digest(filename) for filename in asset_filenames]
+        self._format_options = [unicode(option) for option in format_options]
+        self._link = link
+        self._pdflatex_version = None
+
+    def get_key(self, latex_string):
+        if self._pdflatex_version == None:
+            self._pdflatex_version = get_pdflatex_version()
+
+        return make_key(PDF_CACHE_VERSION, self._pdflatex_version, latex_string,
+                        *(self._asset_digests + self._format_options))
+
+    def retrieve(self, key, output_filename):
+        '''Writes the cached PDF for this key to the output file, returning True,
+        or returns False on a cache miss.'''
+
+        cached_filename = self._cache.get_path(key, ".pdf")
+        if not os.path.exists(cached_filename):
+            return False
+
+        # Write to a temporary file first, so that an existing output file is
+        # replaced atomically:
+        output_dir = os.path.dirname(os.path.abspath(output_filename))
+        (tmp_fd, tmp_filename) = tempfile.mkstemp(".tmp", os.path.basename(output_filename), output_dir)
+        os.close(tmp_fd)
+        try:
+            linked = False
+            if self._link:
+                try:
+                    os.remove(tmp_filename)
+                    os.link(cached_filename, tmp_filename)
+                    linked = True
+                except OSError:
+                    pass
+            if not linked:
+                shutil.copyfile(cached_filename, tmp_filename)
+            os.rename(tmp_filename, output_filename)
+        except:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+        return True
+
+    def store(self, key, pdf_filename):
+        def copy_pdf(output_file):
+            with open(pdf_filename, "rb") as pdf_file:
+                shutil.copyfileobj(pdf_file, output_file)
+
+        return self._cache.store_file(key, copy_pdf, ".pdf")
+
+
+class ReportRenderer:
+    '''Renders PDF reports from genomic report and metadata JSON files, using
+    a single jinja template. The pdflatex jobs' scratch directories are
+    created in tmp_dir (by default a tmpfs, if available; see LatexRunner).'''
+
+    def __init__(self, jinja_template, doc_format, tmp_dir=None, keep_tmp_files=False, format_cache=None,
+                 pdf_cache=None, report_date=None, interaction="batchmode"):
+        self._jinja_template = jinja_template
+        self._doc_format = doc_format
+        self._latex_runner = LatexRunner(interaction, tmp_dir, keep_scratch_dirs=keep_tmp_files)
+        self._format_cache = format_cache
+        self._pdf_cache = pdf_cache
+        self._report_date = report_date
+
+    def make_latex(self, report_json_filename, meta_json_filename):
+        with open(meta_json_filename) as meta_json_file:
+            meta_json = json.load(meta_json_file)
+
+        with open(report_json_filename) as report_json_file:
+            report_json = json.load(report_json_file)
+
+        return self.make_latex_from_data(report_json, meta_json)
+
+    def make_latex_from_data(self, report_json, meta_json):
+        report = GenomicReport(report_json, meta_json, self._doc_format, self._jinja_template,
+                               self._report_date)
+        return report.make_latex()
+
+    def render(self, name, report_json_filename, meta_json_filename, output_dir):
+        '''Renders a single report to <output_dir>/<name>.pdf. Returns a status
+        dictionary with the keys listed in SUMMARY_COLUMNS; any exception is
+        recorded there rather than raised.
+
+        The scratch directory is removed after a successful job, and retained
+        after a failed one so that the LaTeX code and log can be inspected.
+        If the report is found in the PDF cache, pdflatex is not run. The
+        status also has the key "pass_seconds", giving the wall time of each
+        pdflatex pass.'''
+
+        return self._render(name, lambda: self.make_latex(report_json_filename, meta_json_filename), output_dir)
+
+    def render_data(self, name, report_json, meta_json, output_dir):
+        '''As render(), for a report and metadata that are already loaded
+        (e.g. just compiled and retrieved), rather than JSON files.'''
+
+        return self._render(name, lambda: self.make_latex_from_data(report_json, meta_json), output_dir)
+
+    def _render(self, name, make_latex_function, output_dir):
+        output_filename = os.path.join(output_dir, name + ".pdf")
+        start_time = time.time()
+        status = {"name": name, "output": output_filename, "returncode": None, "error": None,
+                  "scratch_dir": None, "cached": False, "pass_seconds": [], "passes": 0,
+                  "pdflatex_seconds": 0.0}
+
+        try:
+            report_latex_string = make_latex_function()
+
+            pdf_key = None
+            if self._pdf_cache != None:
+                pdf_key = self._pdf_cache.get_key(report_latex_string)
+                if self._pdf_cache.retrieve(pdf_key, output_filename):
+                    status["cached"] = True
+                    status["status"] = STATUS_OK
+                    status["seconds"] = time.time() - start_time
+                    return status
+
+            (report_latex_string, format_filename) = apply_preamble_format(report_latex_string,
+                                                                           self._format_cache)
+
+            latex_result = self._latex_runner.run(report_latex_string, name, output_filename, format_filename)
+            status["returncode"] = latex_result["returncode"]
+            status["scratch_dir"] = latex_result["scratch_dir"]
+            status["pass_seconds"] = latex_result["pass_seconds"]
+            status["passes"] = len(latex_result["pass_seconds"])
+            status["pdflatex_seconds"] = sum(latex_result["pass_seconds"])
+            if status["returncode"] != 0:
+                raise RuntimeError("pdflatex conversion failed; see " + latex_result["log"])
+
+            if pdf_key != None:
+                self._pdf_cache.store(pdf_key, output_filename)
+            status["status"] = STATUS_OK
+        except Exception, e:
+            status["status"] = STATUS_FAILED
+            status["error"] = "%s: %s" % (e.__class__.__name__, str(e))
+            status["traceback"] = traceback.format_exc()
+
+        status["seconds"] = time.time() - start_time
+        return status
+
+
+def render_reports(renderer, entries, output_dir, n_workers=1):
+    '''Renders the reports for all manifest entries, running at most n_workers
+    pdflatex jobs at a time. Returns a list of status dictionaries, in
+    manifest order.
+
+    The jobs are dispatched from a thread pool: each thread spends nearly all
+    of its time waiting for its pdflatex process, so this bounds the number
+    of concurrent pdflatex processes without copying the renderer into
+    separate python processes.'''
+
+    if n_workers < 1:
+        raise ValueError("Invalid number of workers: %d" % n_workers)
+
+    def render_entry(entry):
+        entry_output_dir = entry.get("outputDir")
+        if entry_output_dir == None:
+            entry_output_dir = output_dir
+        return renderer.render(entry["name"], entry["report"], entry["metadata"], entry_output_dir)
+
+    if n_workers == 1 or len(entries) <= 1:
+        return [render_entry(entry) for entry in entries]
+
+    pool = ThreadPool(min(n_workers, len(entries)))
+    try:
+        statuses = pool.map(render_entry, entries, chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return statuses
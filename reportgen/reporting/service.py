@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+'''
+A resident report service. The parsed rule spreadsheets, the address table,
+the report template and a database engine (with its connection pool) are
+kept loaded between requests, so that a job only pays for its own work rather
+than for interpreter startup and asset parsing. Each asset is reloaded when
+its files change (see ReloadingResource).
+
+Jobs are submitted as HTTP POST requests with a JSON object body, over TCP
+or a UNIX socket, and the response is a JSON status object:
+- /compile: A sample manifest entry (see parse_sample_manifest). The genomic
+report is written to the entry's "output" file if specified, and otherwise
+returned in the status, under "report".
+- /metadata: An object with the sample IDs "blood" and "tumor". The report
+metadata is returned in the status, under "metadata".
+- /render: A rendering manifest entry (see parse_render_manifest); the
+"outputDir" field is required.
+GET /status returns the job counts and asset load counts. Input paths in
+requests are relative to the service's working directory. Output paths
+("output" and "outputDir") must be relative, and are relative to the
+service's output root; paths outside of it are rejected with HTTP status 400.
+
+At most n_workers jobs are run at a time, and at most max_pending more
+wait; further jobs are rejected with HTTP status 503.
+
+The service has no authentication, so by default it only listens on a UNIX
+socket that is accessible to its own user (see make_server). POST requests
+must have the Content-Type application/json, which a web page cannot send
+cross-origin without a preflight request (which the service does not answer).
+'''
+
+import BaseHTTPServer, SocketServer, json, os, stat, sys, threading, time, traceback
+
+from reportgen.reporting.batch import STATUS_FAILED, STATUS_OK, compile_entry, compile_sample
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class InvalidRequestError(Exception):
+    pass
+
+
+class JobQueue:
+    '''Bounds the number of concurrently running jobs, and the number of jobs
+    waiting to run.'''
+
+    def __init__(self, n_workers, max_pending):
+        if n_workers < 1:
+            raise ValueError("Invalid number of workers: %d" % n_workers)
+
+        self._n_workers = n_workers
+        self._max_pending = max_pending
+        self._worker_semaphore = threading.Semaphore(n_workers)
+        self._lock = threading.Lock()
+        self.n_pending = 0
+        self.n_running = 0
+        self.n_completed = 0
+        self.n_rejected = 0
+
+    def run(self, function, *args):
+        '''Runs the function with the specified arguments once a worker slot
+        is free, and returns its result. Raises QueueFullError if max_pending
+        jobs are already waiting.'''
+
+        with self._lock:
+            if self.n_pending + self.n_running >= self._n_workers + self._max_pending:
+                self.n_rejected += 1
+                raise QueueFullError("Job queue is full")
+            self.n_pending += 1
+
+        self._worker_semaphore.acquire()
+        with self._lock:
+            self.n_pending -= 1
+            self.n_running += 1
+
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.n_running -= 1
+                self.n_completed += 1
+            self._worker_semaphore.release()
+
+    def get_counts(self):
+        with self._lock:
+            return {"pending": self.n_pending, "running": self.n_running,
+                    "completed": self.n_completed, "rejected": self.n_rejected}
+
+
+def get_files_signature(filenames):
+    '''Returns a value that changes whenever any of the files is modified,
+    created or removed.'''
+
+    signature = []
+    for filename in filenames:
+        try:
+            file_stat = os.stat(filename)
+            signature.append((filename, file_stat.st_mtime, file_stat.st_size))
+        except OSError:
+            signature.append((filename, None, None))
+    return tuple(signature)
+
+
+class ReloadingResource:
+    '''An object loaded from files, e.g. the rule tables parsed from the rule
+    spreadsheets, which is reloaded when any of the files changes. The files
+    are checked at most once every check_interval seconds.
+
+    If reloading fails (e.g. because a spreadsheet is being rewritten), the
+    error is reported and the previously loaded object is used until the
+    files change again.'''
+
+    def __init__(self, name, filenames, load_function, check_interval=1.0):
+        self.name = name
+        self._filenames = filenames
+        self._load_function = load_function
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._value = None
+        self._signature = None
+        self._last_check_time = None
+        self.n_loads = 0
+
+    def get(self):
+        with self._lock:
+            now = time.time()
+            if self._last_check_time == None or now - self._last_check_time >= self._check_interval:
+                self._last_check_time = now
+                signature = get_files_signature(self._filenames)
+                if signature != self._signature:
+                    self.load(signature)
+            return self._value
+
+    def load(self, signature):
+        try:
+            value = self._load_function()
+        except Exception:
+            if self.n_loads == 0:
+                raise
+            print >> sys.stderr, "WARNING: Could not reload %s; using the previous version:" % self.name
+            traceback.print_exc()
+            # Retry once the files change again:
+            self._signature = signature
+            return
+
+        self._value = value
+        self._signature = signature
+        self.n_loads += 1
+
+
+def resolve_output_path(output_root, path):
+    '''Returns the absolute location of the relative output path under the
+    output root. Raises InvalidRequestError if the path is absolute, or
+    refers to a location outside of the output root (e.g. via ".." or a
+    symbolic link).'''
+
+    if output_root == None:
+        raise InvalidRequestError("No output root is configured")
+    if not isinstance(path, basestring):
+        raise InvalidRequestError("Output path is not a string: %r" % (path,))
+    if os.path.isabs(path):
+        raise InvalidRequestError("Output path is not relative: " + path)
+
+    real_root = os.path.realpath(output_root)
+    real_path = os.path.realpath(os.path.join(real_root, path))
+    if real_path != real_root and not real_path.startswith(real_root + os.sep):
+        raise InvalidRequestError("Output path is outside of the output root: " + path)
+
+    return real_path
+
+
+def get_error_status(status, e):
+    status["status"] = STATUS_FAILED
+    status["error"] = "%s: %s" % (e.__class__.__name__, str(e))
+    status["traceback"] = traceback.format_exc()
+    return status
+
+
+class ReportService:
+    '''Runs compile, metadata and render jobs against warm resources. Each
+    resource argument is a ReloadingResource, or None if the corresponding
+    job type is not supported: the compiler resource provides an
+    AlasccaGenomicReportCompiler, the address resource an address index
+    (see load_address_index) and the renderer resource a ReportRenderer.
+    Metadata jobs also need a database engine, whose connection pool is
+    shared by all jobs. Output files are only written under output_root (see
+    resolve_output_path).'''
+
+    def __init__(self, compiler_resource=None, renderer_resource=None, engine=None, address_resource=None,
+                 n_workers=1, max_pending=16, output_root=None):
+        self._output_root = output_root
+        self._compiler_resource = compiler_resource
+        self._renderer_resource = renderer_resource
+        self._engine = engine
+        self._address_resource = address_resource
+        self.job_queue = JobQueue(n_workers, max_pending)
+        self._start_time = time.time()
+
+        self._job_type2function = {}
+        if compiler_resource != None:
+            self._job_type2function["compile"] = self.compile
+        if renderer_resource != None:
+            self._job_type2function["render"] = self.render
+        if engine != None and address_resource != None:
+            self._job_type2function["metadata"] = self.retrieve_metadata
+
+    def get_job_types(self):
+        return sorted(self._job_type2function.keys())
+
+    def run_job(self, job_type, request):
+        '''Runs a job of the specified type via the job queue, returning its
+        status dictionary. Raises KeyError for an unsupported job type or a
+        missing request field, InvalidRequestError for an invalid output
+        path, and QueueFullError if the job queue is full.'''
+
+        job_function = self._job_type2function[job_type]
+        if job_type == "compile" and request.get("output") != None:
+            request = dict(request)
+            request["output"] = resolve_output_path(self._output_root, request["output"])
+        elif job_type == "render":
+            request = dict(request)
+            request["outputDir"] = resolve_output_path(self._output_root, request["outputDir"])
+            # The name is used as a file name in the output directory:
+            if not isinstance(request["name"], basestring):
+                raise InvalidRequestError("Report name is not a string: %r" % (request["name"],))
+            resolve_output_path(request["outputDir"], request["name"] + ".pdf")
+
+        return self.job_queue.run(job_function, request)
+
+    def compile(self, entry):
+        start_time = time.time()
+        compiler = self._compiler_resource.get()
+        if entry.get("output") != None:
+            return compile_sample(compiler, entry, None)
+
+        status = {"sample": entry.get("sample"), "output": None, "error": None}
+        try:
+            status["report"] = compile_entry(compiler, entry)
+            status["status"] = STATUS_OK
+        except Exception, e:
+            get_error_status(status, e)
+        status["seconds"] = time.time() - start_time
+        return status
+
+    def retrieve_metadata(self, request):
+        # Imported here, as it imports sqlalchemy and referral-manager, which
+        # are only needed for metadata jobs:
+        from reportgen.reporting.metadata import MetadataLookup
+
+        start_time = time.time()
+        status = {"blood": request.get("blood"), "tumor": request.get("tumor"), "error": None}
+        try:
+            # Each job checks out a connection from the engine's pool:
+            lookup = MetadataLookup(self._engine, self._address_resource.get())
+            try:
+                status["metadata"] = lookup.retrieve(int(request["blood"]), int(request["tumor"]))
+            finally:
+                lookup.close()
+            status["status"] = STATUS_OK
+        except Exception, e:
+            get_error_status(status, e)
+        status["seconds"] = time.time() - start_time
+        return status
+
+    def render(self, entry):
+        return self._renderer_resource.get().render(entry["name"], entry["report"], entry["metadata"],
+                                                    entry["outputDir"])
+
+    def get_status(self):
+        resources = [self._compiler_resource, self._renderer_resource, self._address_resource]
+        return {"jobs": self.job_queue.get_counts(),
+                "job_types": self.get_job_types(),
+                "loads": dict([(resource.name, resource.n_loads) for resource in resources if resource != None]),
+                "uptime": time.time() - self._start_time}
+
+
+class ReportRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Maps HTTP requests to ReportService jobs; the service is an attribute
+    of the server.'''
+
+    def send_json(self, http_status, response):
+        body = json.dumps(response, sort_keys=True)
+        self.send_response(http_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"error": "Unknown path: " + self.path})
+            return
+        self.send_json(200, self.server.service.get_status())
+
+    def do_POST(self):
+        job_type = self.path.strip("/")
+        if not job_type in self.server.service.get_job_types():
+            self.send_json(404, {"error": "Unsupported job type: " + job_type})
+            return
+
+        content_type = self.headers.getheader("Content-Type", "").split(";")[0].strip()
+        if content_type != "application/json":
+            self.send_json(415, {"error": "Content-Type must be application/json"})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+            if not isinstance(request, dict):
+                raise ValueError("Request is not a JSON object")
+        except ValueError, e:
+            self.send_json(400, {"error": "Invalid request: " + str(e)})
+            return
+
+        try:
+            status = self.server.service.run_job(job_type, request)
+        except QueueFullError, e:
+            self.send_json(503, {"error": str(e)})
+            return
+        except InvalidRequestError, e:
+            self.send_json(400, {"error": "Invalid request: " + str(e)})
+            return
+        except KeyError, e:
+            self.send_json(400, {"error": "Missing request field: " + str(e)})
+            return
+
+        self.send_json(200, status)
+
+    def address_string(self):
+        # UNIX socket clients have no address:
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "local"
+
+    def log_message(self, format, *args):
+        print >> sys.stderr, "%s - - [%s] %s" % (self.address_string(), self.log_date_time_string(), format % args)
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_unix_server(socket_filename):
+    '''Returns a server listening on the UNIX socket, which only the current
+    user can connect to. A socket left behind at that location (e.g. by a
+    previous instance) is replaced, but any other existing file raises a
+    ValueError.'''
+
+    try:
+        socket_stat = os.lstat(socket_filename)
+    except OSError:
+        socket_stat = None
+    if socket_stat != None:
+        if not stat.S_ISSOCK(socket_stat.st_mode):
+            raise ValueError("Not a socket, refusing to replace it: " + socket_filename)
+        os.remove(socket_filename)
+
+    # Create the socket without group or other permissions, rather than
+    # restricting it after it is already accepting connections:
+    old_umask = os.umask(0177)
+    try:
+        server = ThreadingUnixHTTPServer(socket_filename, ReportRequestHandler)
+    finally:
+        os.umask(old_umask)
+    os.chmod(socket_filename, 0600)
+    return server
+
+
+def make_server(service, socket_filename=None, host="127.0.0.1", port=None):
+    '''Returns a server handling requests for the service, listening on the
+    UNIX socket if specified. Listening on TCP (which any local user, and
+    web pages via the browser, can connect to) must be requested explicitly
+    by specifying the port. Each request is handled in its own thread; the
+    service's job queue bounds the number of jobs actually running.'''
+
+    if socket_filename != None:
+        server = make_unix_server(socket_filename)
+    elif port != None:
+        server = ThreadingHTTPServer((host, port), ReportRequestHandler)
+    else:
+        raise ValueError("Either a UNIX socket or a TCP port must be specified")
+
+    server.service = service
+    return server
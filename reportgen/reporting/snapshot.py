@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+'''
+A local SQLite snapshot of the referral data needed for report metadata.
+The snapshot uses the same tables as the referral database, so it can be read
+with the same code, via get_engine(get_snapshot_uri(filename)); only the
+columns needed for report metadata are filled in. Each barcode column is
+indexed.
+
+NOTE: The snapshot contains patient identifiers (personal numbers), so it is
+only readable by its owner: sync_snapshot creates the file with mode 0600,
+and any directories it needs with mode 0700.
+'''
+
+import os
+
+import sqlalchemy
+import sqlalchemy.orm
+
+from referralmanager.cli.models.referrals import AlasccaBloodReferral, AlasccaTissueReferral
+
+from reportgen.reporting.metadata import get_barcode_attributes
+
+
+REFERRAL_TYPES = [AlasccaBloodReferral, AlasccaTissueReferral]
+
+# The columns used by make_report_metadata, in addition to the primary key and
+# barcode columns:
+METADATA_ATTRIBUTES = ["pnr", "collection_date", "hospital_code"]
+
+# Number of rows inserted per statement:
+SYNC_CHUNK_SIZE = 1000
+
+
+def get_snapshot_uri(snapshot_filename):
+    return "sqlite:///" + os.path.abspath(snapshot_filename)
+
+
+def create_snapshot_file(snapshot_filename):
+    '''Creates the snapshot file, and any missing parent directories, readable
+    only by the current user, before SQLite opens it. An existing snapshot
+    file is restricted to the current user as well.'''
+
+    snapshot_dir = os.path.dirname(os.path.abspath(snapshot_filename))
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir, 0700)
+        os.chmod(snapshot_dir, 0700)
+
+    os.close(os.open(snapshot_filename, os.O_WRONLY | os.O_CREAT, 0600))
+    os.chmod(snapshot_filename, 0600)
+
+
+def get_snapshot_attributes(referral_type, timestamp_attribute=None):
+    '''Returns the names of the attributes of this referral type to copy to
+    the snapshot.'''
+
+    primary_key_attributes = [column.key for column in sqlalchemy.orm.class_mapper(referral_type).primary_key]
+    snapshot_attributes = primary_key_attributes + METADATA_ATTRIBUTES + get_barcode_attributes(referral_type)
+    if timestamp_attribute != None and not timestamp_attribute in snapshot_attributes:
+        snapshot_attributes.append(timestamp_attribute)
+
+    return snapshot_attributes
+
+
+def create_snapshot_tables(snapshot_engine):
+    '''Creates the referral tables, and an index on each barcode column, in
+    the snapshot database, unless they already exist.'''
+
+    for referral_type in REFERRAL_TYPES:
+        table = referral_type.__table__
+        table.create(snapshot_engine, checkfirst=True)
+        for barcode_attr in get_barcode_attributes(referral_type):
+            column_name = getattr(referral_type, barcode_attr).property.columns[0].name
+            snapshot_engine.execute("CREATE INDEX IF NOT EXISTS ix_%s_%s ON %s (%s)" %
+                                    (table.name, column_name, table.name, column_name))
+
+
+def sync_referral_type(source_connection, snapshot_connection, referral_type, timestamp_attribute=None,
+                       full_refresh=False):
+    '''Copies the referrals of one type from the source database to the
+    snapshot, returning the number of rows copied.
+
+    If a timestamp attribute (a modification time column) is specified, and
+    full_refresh is False, only referrals modified at or after the time of
+    the latest one already in the snapshot are copied, replacing any earlier
+    copy of them. (Referrals modified at exactly that time are copied again,
+    as some of them may not have been committed at the previous sync.)
+    Otherwise, all referrals in the snapshot are replaced. NOTE: Referrals
+    deleted from the source database are only removed by a full refresh.'''
+
+    table = referral_type.__table__
+    snapshot_attributes = get_snapshot_attributes(referral_type, timestamp_attribute)
+    source_columns = [getattr(referral_type, attr).property.columns[0] for attr in snapshot_attributes]
+    primary_key_columns = list(sqlalchemy.orm.class_mapper(referral_type).primary_key)
+
+    query = sqlalchemy.select(source_columns)
+    incremental = timestamp_attribute != None and not full_refresh
+    if incremental:
+        timestamp_column = getattr(referral_type, timestamp_attribute).property.columns[0]
+        latest_timestamp = snapshot_connection.execute(sqlalchemy.select([sqlalchemy.func.max(timestamp_column)])).scalar()
+        if latest_timestamp != None:
+            query = query.where(timestamp_column >= latest_timestamp)
+    else:
+        snapshot_connection.execute(table.delete())
+
+    n_rows = 0
+    rows = []
+    for source_row in source_connection.execute(query):
+        rows.append(dict([(column.name, value) for (column, value) in zip(source_columns, source_row)]))
+        if len(rows) == SYNC_CHUNK_SIZE:
+            n_rows += insert_snapshot_rows(snapshot_connection, table, primary_key_columns, rows, incremental)
+            rows = []
+    n_rows += insert_snapshot_rows(snapshot_connection, table, primary_key_columns, rows, incremental)
+
+    return n_rows
+
+
+def insert_snapshot_rows(snapshot_connection, table, primary_key_columns, rows, replace_existing):
+    if len(rows) == 0:
+        return 0
+
+    if replace_existing:
+        # Remove any earlier copies of these referrals first:
+        if len(primary_key_columns) == 1:
+            key_column = primary_key_columns[0]
+            snapshot_connection.execute(table.delete().where(key_column.in_([row[key_column.name] for row in rows])))
+        else:
+            for row in rows:
+                snapshot_connection.execute(table.delete().where(
+                    sqlalchemy.and_(*[column == row[column.name] for column in primary_key_columns])))
+
+    snapshot_connection.execute(table.insert(), rows)
+    return len(rows)
+
+
+def sync_snapshot(source_engine, snapshot_filename, timestamp_attribute=None, full_refresh=False):
+    '''Creates or refreshes the snapshot of the referral database accessed via
+    source_engine. All referral types are updated in a single snapshot
+    transaction, so readers see either the previous or the new snapshot.
+    Returns a dictionary of table name to number of rows copied. See
+    sync_referral_type regarding timestamp_attribute. The snapshot file is
+    created with mode 0600; see create_snapshot_file.'''
+
+    create_snapshot_file(snapshot_filename)
+    snapshot_engine = sqlalchemy.create_engine(get_snapshot_uri(snapshot_filename))
+    try:
+        create_snapshot_tables(snapshot_engine)
+
+        table_name2n_rows = {}
+        source_connection = source_engine.connect()
+        snapshot_connection = snapshot_engine.connect()
+        transaction = snapshot_connection.begin()
+        try:
+            for referral_type in REFERRAL_TYPES:
+                table_name2n_rows[referral_type.__table__.name] = \
+                    sync_referral_type(source_connection, snapshot_connection, referral_type,
+                                       timestamp_attribute, full_refresh)
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        finally:
+            snapshot_connection.close()
+            source_connection.close()
+    finally:
+        snapshot_engine.dispose()
+
+    return table_name2n_rows
@@ -0,0 +1,30 @@
+'''
+A persistent cache of compiled jinja templates. jinja2 is imported by this
+module, so it is only imported where templates are rendered (see
+make_jinja_environment).
+'''
+
+import jinja2
+
+from reportgen.reporting.cache import FileCache
+
+
+class TemplateBytecodeCache(jinja2.BytecodeCache):
+    '''Stores the python bytecode compiled from each template in a FileCache.
+    jinja checks the template source's checksum when loading an entry, so a
+    changed template is recompiled automatically. Like FileCache, this cache
+    is best-effort, and entries are written atomically, so several processes
+    may share it.'''
+
+    def __init__(self, cache_dir):
+        self._cache = FileCache(cache_dir, "jinja_templates")
+
+    def load_bytecode(self, bucket):
+        try:
+            with open(self._cache.get_path(bucket.key, ".cache"), "rb") as cache_file:
+                bucket.load_bytecode(cache_file)
+        except IOError:
+            pass
+
+    def dump_bytecode(self, bucket):
+        self._cache.store_file(bucket.key, bucket.write_bytecode, ".cache")
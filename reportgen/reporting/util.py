@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 
-import re, json, sys
-
-import openpyxl
+import os, re, json, sys
 
 from reportgen.rules.general import AlterationClassification
+from reportgen.reporting.cache import FileCache, file_digest, make_key
 
-from referralmanager.cli.dbimport import create_tables, get_session
+# openpyxl, sqlalchemy and referral-manager are slow to import, and each is
+# only needed by some of the console scripts using this module, so they are
+# imported on first use. openpyxl is imported by read_mutation_spreadsheet:
+openpyxl = None
 
 
 def id_valid(id_string):
@@ -23,6 +25,9 @@ def get_addresses(id2addresses, ids):
     '''Retrieves the unique set of return addresses for the given IDs, from
     the id2addresses dictionary.'''
 
+    if isinstance(id2addresses, AddressIndex):
+        return id2addresses.get_addresses(ids)
+
     for id in ids:
         if not id2addresses.has_key(id):
             raise ValueError("Address ID {} is not in id2addresses.".format(id))
@@ -30,13 +35,53 @@ def get_addresses(id2addresses, ids):
     all_addresses = reduce(lambda list1, list2: list1 + list2, map(lambda id: id2addresses[id], ids))
     all_addresses.sort()
 
-    # O(N^^2) algorithm, but ok since list of addresses will be small:
-    def reduce_pair(curr_list, next_item):
-        if next_item not in curr_list:
-            curr_list.append(next_item)
-        return curr_list
+    # Drop repeated addresses, keeping the first of each:
+    unique_addresses = []
+    observed_addresses = set()
+    for address in all_addresses:
+        address_key = tuple(sorted(address.items()))
+        if not address_key in observed_addresses:
+            observed_addresses.add(address_key)
+            unique_addresses.append(address)
+
+    return unique_addresses
+
+
+# The fields of each address, in sorted order. Sorting tuples of these field
+# values orders addresses the same way as sorting the address dictionaries:
+ADDRESS_FIELDS = ["attn", "line1", "line2", "line3"]
+
+
+class AddressIndex(dict):
+    '''A dictionary of address ID to address array, as returned by
+    parse_address_table, which also answers get_addresses() lookups. The
+    addresses are held as tuples, so that they can be de-duplicated with a
+    set, and the result for each set of IDs is computed only once.'''
 
-    return reduce(reduce_pair, all_addresses, [])
+    def __init__(self, id2addresses):
+        dict.__init__(self, id2addresses)
+
+        self._id2address_tuples = {}
+        for id, addresses in id2addresses.items():
+            self._id2address_tuples[id] = [tuple([address[field] for field in ADDRESS_FIELDS])
+                                           for address in addresses]
+
+        self._ids2address_tuples = {}
+
+    def get_addresses(self, ids):
+        ids_key = frozenset(ids)
+        if not self._ids2address_tuples.has_key(ids_key):
+            for id in ids_key:
+                if not self._id2address_tuples.has_key(id):
+                    raise ValueError("Address ID {} is not in id2addresses.".format(id))
+
+            unique_address_tuples = set()
+            for id in ids_key:
+                unique_address_tuples.update(self._id2address_tuples[id])
+            self._ids2address_tuples[ids_key] = sorted(unique_address_tuples)
+
+        # Return new dictionaries, so that callers cannot modify the index:
+        return [dict(zip(ADDRESS_FIELDS, address_tuple)) for address_tuple in self._ids2address_tuples[ids_key]]
 
 
 class AddressFileParseException(Exception):
@@ -78,47 +123,117 @@ def parse_address_table(address_table_file):
     return id2addresses
 
 
-def extract_mutation_spreadsheet_contents(spreadsheet_filename):
+# Increment this whenever the structure returned by parse_address_table
+# changes, to invalidate cached copies:
+ADDRESS_TABLE_CACHE_VERSION = "1"
+
+
+def load_address_index(address_table_filename, cache_dir=None):
+    '''Returns an AddressIndex for the specified address table file. If
+    cache_dir is specified, the parsed table is cached there, keyed by the
+    file's path, size and modification time, so that the file itself is only
+    read (e.g. from NFS) when it has changed.'''
+
+    if cache_dir == None:
+        with open(address_table_filename) as address_table_file:
+            return AddressIndex(parse_address_table(address_table_file))
+
+    file_stat = os.stat(address_table_filename)
+    cache = FileCache(cache_dir, "address_tables")
+    cache_key = make_key(ADDRESS_TABLE_CACHE_VERSION, os.path.abspath(address_table_filename),
+                         str(file_stat.st_size), repr(file_stat.st_mtime))
+
+    id2addresses = cache.load(cache_key)
+    if id2addresses == None:
+        with open(address_table_filename) as address_table_file:
+            id2addresses = parse_address_table(address_table_file)
+        cache.store(cache_key, id2addresses)
+
+    return AddressIndex(id2addresses)
+
+
+# Increment this whenever the structure returned by
+# extract_mutation_spreadsheet_contents changes, to invalidate cached copies:
+MUTATION_TABLE_CACHE_VERSION = "1"
+
+
+def extract_mutation_spreadsheet_contents(spreadsheet_filename, cache_dir=None):
+    '''Extracts the rows of the MutationTable sheet of the specified excel
+    spreadsheet. If cache_dir is specified, the extracted contents are cached
+    there, keyed by the spreadsheet's contents, and the spreadsheet is only
+    parsed on a cache miss.'''
+
+    if cache_dir == None:
+        return read_mutation_spreadsheet(spreadsheet_filename)
+
+    cache = FileCache(cache_dir, "mutation_tables")
+    cache_key = make_key(MUTATION_TABLE_CACHE_VERSION, file_digest(spreadsheet_filename))
+
+    extracted_content = cache.load(cache_key)
+    if extracted_content == None:
+        extracted_content = read_mutation_spreadsheet(spreadsheet_filename)
+        cache.store(cache_key, extracted_content)
+
+    return extracted_content
+
+
+def read_mutation_spreadsheet(spreadsheet_filename, read_only=True):
+    '''Reads the rows of the MutationTable sheet, stopping at the first
+    blank row. By default, the workbook is opened in openpyxl's read-only
+    mode, so that rows are streamed from the MutationTable sheet instead of
+    loading every sheet, style and cell object into memory first.'''
+
     # Break each row up, generating a data structure representing
     # the spreadsheet...
 
     # Use openpyxl to parse the input file:
-    workbook = openpyxl.load_workbook(filename=spreadsheet_filename)
+    global openpyxl
+    if openpyxl == None:
+        import openpyxl
+    workbook = openpyxl.load_workbook(filename=spreadsheet_filename, read_only=read_only)
     mutation_table = workbook.get_sheet_by_name("MutationTable")
 
-    # Get the initial rows containing data...
-    rows_of_interest = []
     row_iter = mutation_table.iter_rows()
 
     # Skip over the first header row:
     curr_row = row_iter.next()
 
-    for curr_row in row_iter:
-        if curr_row[0].value != None:
-            rows_of_interest.append(curr_row)
-
     extracted_content = []
-    for row in rows_of_interest:
-        consequences = row[0].value.split(",")
-        symbol = row[1].value
-        gene_ID = row[2].value  # Not currently used.
-        transcript_ID = row[3].value
+    for curr_row in row_iter:
+        # Only materialise the values of the six table columns. Rows
+        # streamed in read-only mode can be shorter than that:
+        values = [cell.value for cell in curr_row[:6]]
+        values.extend([None] * (6 - len(values)))
+
+        # The table ends at the first blank row:
+        if values[0] == None:
+            break
+
+        consequences = values[0].split(",")
+        symbol = values[1]
+        gene_ID = values[2]  # Not currently used.
+        transcript_ID = values[3]
         amino_acid_changes = []
-        if row[4].value != None:
-            amino_acid_changes = row[4].value.split(",")
-        flag = row[5].value
+        if values[4] != None:
+            amino_acid_changes = values[4].split(",")
+        flag = values[5]
         extracted_content.append([consequences, symbol, gene_ID, transcript_ID,
                                  amino_acid_changes, flag])
 
+    # Read-only workbooks keep the file open until closed:
+    if read_only:
+        workbook.close()
+
     return extracted_content
 
 
-def parse_mutation_table(spreadsheet_filename):
+def parse_mutation_table(spreadsheet_filename, cache_dir=None):
     '''Parses a given excel spreadsheet, extracting mutation classification
     rows from the mutation table. Returns a dictionary of gene symbol to
-    classification.'''
+    classification. See extract_mutation_spreadsheet_contents regarding
+    cache_dir.'''
 
-    spreadsheet_contents = extract_mutation_spreadsheet_contents(spreadsheet_filename)
+    spreadsheet_contents = extract_mutation_spreadsheet_contents(spreadsheet_filename, cache_dir)
 
     gene_symbol2classifications = {}
 
@@ -149,12 +264,46 @@ def format_personnummer(personnummer):
     return personnummer[2:8] + "-" + personnummer[8:]
 
 
-def create_sql_session(db_config_file):
-    '''Establish an sqlalchemy session connecting to the database'''
-    
+def read_db_uri(db_config_file):
+    '''Reads the database URI from a JSON database configuration file.'''
+
     cred_conf = json.load(open(db_config_file))
-    uri = cred_conf['dburi']
-    engine = create_tables(uri)
+    return cred_conf['dburi']
+
+
+# Engines created by get_engine, keyed by database URI:
+_uri2engine = {}
+
+
+def get_engine(uri, create_missing_tables=False):
+    '''Returns an sqlalchemy engine for the given database URI. The engine,
+    and hence its connection pool, is created once per URI and then shared
+    by all callers in this process.
+
+    The referral tables are only created (issuing schema DDL and
+    introspection queries against the database) if create_missing_tables is
+    True; reading referral metadata never requires this. Table creation
+    uses a separate engine, disposed of afterwards, so that the shared
+    engine is never replaced while other callers may be using it.'''
+
+    import sqlalchemy
+    from referralmanager.cli.dbimport import create_tables
+
+    if create_missing_tables:
+        create_tables(uri).dispose()
+
+    if not _uri2engine.has_key(uri):
+        _uri2engine[uri] = sqlalchemy.create_engine(uri)
+
+    return _uri2engine[uri]
+
+
+def create_sql_session(db_config_file, create_missing_tables=False):
+    '''Establish an sqlalchemy session connecting to the database'''
+
+    from referralmanager.cli.dbimport import get_session
+
+    engine = get_engine(read_db_uri(db_config_file), create_missing_tables)
     session = get_session(engine)
-    
+
     return session
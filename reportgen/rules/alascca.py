@@ -1,5 +1,7 @@
 from reportgen.reporting.util import parse_mutation_table
 from reportgen.reporting.features import AlasccaClassReport
+from reportgen.reporting.metrics import NULL_METRICS
+from reportgen.rules.index import compile_rule_index, find_matches
 from reportgen.rules.util import FeatureStatus
 
 
@@ -18,42 +20,53 @@ class AlasccaClassRule:
     # the apply() method. It should be fairly straightforward now though. See
     # SimpleSomaticMutationsRule as a template.
 
-    def __init__(self, excel_spreadsheet, symbol2gene):
-        self._gene_symbol2classifications = parse_mutation_table(excel_spreadsheet)
+    def __init__(self, excel_spreadsheet, symbol2gene, gene_symbol2classifications=None, symbol2index=None,
+                 metrics=NULL_METRICS):
+        # The spreadsheet is only parsed if its contents have not already
+        # been supplied:
+        if gene_symbol2classifications is None:
+            gene_symbol2classifications = parse_mutation_table(excel_spreadsheet)
+        self._gene_symbol2classifications = gene_symbol2classifications
+        # The compiled rule index can also be supplied, e.g. so that it is
+        # only compiled once for many samples:
+        if symbol2index is None:
+            symbol2index = compile_rule_index(gene_symbol2classifications)
+        self._symbol2index = symbol2index
 
         self._symbol2gene = symbol2gene
+        self._metrics = metrics
 
     # FIXME: It is currently unclear when we should be calling
     # "not determined".
 
+    def get_classifications(self):
+        return self._gene_symbol2classifications
+
+    def get_symbol2gene(self):
+        return self._symbol2gene
+
     def apply(self):
+        return self.apply_matches(find_matches(self._symbol2index, self._symbol2gene, self._metrics))
+
+    def apply_matches(self, matches):
+        '''Generates the AlasccaClassReport from a list of (alteration,
+        classification) matches, as produced by find_matches() or an
+        AlterationMatchEngine.'''
+
         # If there is one or more genes with at least one class A alteration,
         # then call class A. Otherwise, if there is one or more genes with at
         # least one class B_1 mutation, then call class B. Otherwise, if there
         # are at least two class B_2 mutations, then call class B. Otherwise,
         # call no mutation.
 
-        # Classify alterations and count the flag instances...
+        # Count the flag instances of the classified alterations...
         flag_instances = {self.CLASS_B_1: 0, self.CLASS_B_2: 0,
                           self.CLASS_A: 0}
 
-        for symbol in self._gene_symbol2classifications.keys():
-            # Retrieve all the classifications for the current gene:
-            gene_classifications = self._gene_symbol2classifications[symbol]
-
-            # Find all mutations matching this gene's rules:
-            alterations = []
-            if symbol in self._symbol2gene.keys():
-                gene = self._symbol2gene[symbol]
-                alterations = gene.get_alterations()
-
-            for alteration in alterations:
-                # Apply all rules to this alteration:
-                for classification in gene_classifications:
-                    if classification.match(alteration):
-                        flag = classification.get_output_flag()
-                        assert flag_instances.has_key(flag)
-                        flag_instances[flag] = flag_instances[flag] + 1
+        for alteration, classification in matches:
+            flag = classification.get_output_flag()
+            assert flag_instances.has_key(flag)
+            flag_instances[flag] = flag_instances[flag] + 1
 
         # Apply logic based on numbers of flag instances:
         report = AlasccaClassReport()
@@ -1,8 +1,10 @@
-import json, re, sys
+import gzip, json, re, sys
 
-from reportgen.rules.util import FeatureStatus
+from collections import namedtuple
+from operator import itemgetter
 
-import vcf
+from reportgen.reporting.metrics import NULL_METRICS
+from reportgen.rules.util import FeatureStatus
 
 
 class AlterationClassification:
@@ -101,11 +103,46 @@ class AlterationClassification:
                        and alterationIntegerPosition <= classificationRangeEnd
 
 
-class MutationStatus:
+def make_annotation_whitelist(rule_tables):
+    '''Returns the set of (symbol, transcript_ID) pairs referred to by the
+    given rule tables (each a dictionary of gene symbol to
+    AlterationClassification list, as returned by parse_mutation_table).
+    CSQ annotations outside of this set can never match any of those
+    rules.'''
+
+    whitelist = set()
+    for gene_symbol2classifications in rule_tables:
+        for symbol, classifications in gene_symbol2classifications.items():
+            for classification in classifications:
+                whitelist.add((symbol, classification.get_transcript_ID()))
+
+    return whitelist
+
+
+def intern_string(value):
+    '''Returns the canonical copy of a byte string (see the intern
+    built-in), so that the many alterations sharing a gene symbol,
+    transcript ID or sequence ontology term also share a single string
+    object. Other values (None, or unicode strings, e.g. from a CNV JSON
+    file) are returned unchanged.'''
+
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+# NOTE: Many instances of the classes below are held for each sample (e.g.
+# one Alteration per retained CSQ annotation), so they are new-style classes
+# with __slots__: a per-instance __dict__ would take several times as much
+# memory as their fields.
+
+class MutationStatus(object):
     '''Mutation status of a given gene. Note: Currently, the gene is not
     directly stated, but can be accessed via the contained Alteration
     objects, which must all refer to the same AlteredGene object.'''
 
+    __slots__ = ("_status", "_mutation_list")
+
     def __init__(self):
         self._status = FeatureStatus.NOT_MUTATED
         self._mutation_list = []
@@ -137,9 +174,11 @@ class MutationStatus:
         self._mutation_list = []
 
 
-class Gene:
+class Gene(object):
+    __slots__ = ("_symbol", "_gene_ID")
+
     def __init__(self, symbol):
-        self._symbol = symbol
+        self._symbol = intern_string(symbol)
         self._gene_ID = None
 
     def set_ID(self, gene_ID):
@@ -154,7 +193,9 @@ class Gene:
         return self._symbol
 
 
-class AlteredGene:
+class AlteredGene(object):
+    __slots__ = ("_gene", "_alterations")
+
     def __init__(self, gene):
         self._gene = gene
         self._alterations = []
@@ -169,16 +210,18 @@ class AlteredGene:
         return self._gene
 
 
-class Alteration:
+class Alteration(object):
     '''NOTE: This single concrete class will currently be used to represent
     all types of alterations, without having subclasses. The type of the
     alteration will be specified by self._sequence_ontology_term, which must
     contain a valid sequence ontology string.'''
 
+    __slots__ = ("_altered_gene", "_sequence_ontology_term", "_transcript_ID", "_hgvsp")
+
     def __init__(self, alteredGene, transcriptID, alterationType, positionalString):
         self._altered_gene = alteredGene
-        self._sequence_ontology_term = alterationType
-        self._transcript_ID = transcriptID
+        self._sequence_ontology_term = intern_string(alterationType)
+        self._transcript_ID = intern_string(transcriptID)
         # Note: positing string can be None, when the alteration type does
         # not imply positional information.
         self._hgvsp = positionalString
@@ -196,9 +239,194 @@ class Alteration:
         return self._transcript_ID
 
 
+# The subset of CSQ columns required in order to construct an Alteration:
+CsqRecord = namedtuple("CsqRecord", ["symbol", "gene_id", "transcript_id", "alteration_type", "hgvsp"])
+
+
+class CsqDecoder:
+    '''Decodes VEP CSQ annotation strings into CsqRecord tuples. Each
+    annotation is split only once, and only the columns needed by the
+    AlterationExtractor are retained.'''
+
+    # CSQ column names, in CsqRecord field order:
+    CSQ_COLUMNS = ("SYMBOL", "Gene", "Feature", "Consequence", "HGVSp")
+
+    def __init__(self, csq_fieldnames):
+        idxs = [csq_fieldnames.index(column) for column in self.CSQ_COLUMNS]
+        self._get_columns = itemgetter(*idxs)
+
+    def decode(self, annotation):
+        symbol, gene_id, transcript_id, consequence, hgvsp = \
+            self._get_columns(annotation.split("|"))
+
+        # Only the first (most severe) consequence term is used, and the
+        # HGVSp string is stripped of its protein ID prefix:
+        return CsqRecord(symbol, gene_id, transcript_id,
+                         consequence.split("&", 1)[0], hgvsp.split(":")[-1])
+
+    def iter_records(self, annotations):
+        '''Lazily decodes a sequence of CSQ annotation strings.'''
+
+        decode = self.decode
+        for annotation in annotations:
+            yield decode(annotation)
+
+
+class NativeVcfRecord(object):
+    '''A VCF data line, split only as far as the INFO column. The sample
+    columns are never parsed.'''
+
+    __slots__ = ["CHROM", "POS", "REF", "ALT", "_info"]
+
+    def __init__(self, line, line_number=None):
+        fields = line.rstrip("\r\n").split("\t", 8)
+        if len(fields) < 8:
+            raise ValueError("Truncated VCF record on line %s: %d columns, expected at least 8." %
+                             (line_number, len(fields)))
+        self.CHROM = fields[0]
+        self.POS = int(fields[1])
+        self.REF = fields[3]
+        self.ALT = fields[4]
+        self._info = fields[7]
+
+    def get_csq_annotations(self):
+        '''Returns the list of raw CSQ annotation strings for this record,
+        or an empty list if the record has no CSQ INFO entry.'''
+
+        for entry in self._info.split(";"):
+            if entry.startswith("CSQ="):
+                return entry[4:].split(",")
+        return []
+
+
+class NativeVcfReader:
+    '''A minimal line-oriented VCF reader, for use instead of pyvcf when only
+    the CSQ INFO field is required. Only the CSQ header line is interpreted,
+    and CSQ annotations are only extracted from a record on request.
+
+    Mirrors pyvcf by raising StopIteration upon construction if the input is
+    completely empty (see AlterationExtractor.extract_mutations). Blank data
+    lines are skipped, and a record with fewer than the eight fixed columns
+    raises a ValueError naming its line number.'''
+
+    CSQ_HEADER_PREFIX = "##INFO=<ID=CSQ,"
+
+    def __init__(self, vcf_file):
+        self._lines = iter(vcf_file)
+        self._csq_description = None
+
+        # Read the meta-information lines, up to and including the column
+        # header line:
+        line = self._lines.next()
+        self._line_number = 1
+        while not line.startswith("#CHROM"):
+            if not line.startswith("##"):
+                raise ValueError("Invalid VCF header line: " + line)
+            if line.startswith(self.CSQ_HEADER_PREFIX):
+                self._csq_description = re.search(r'Description="((?:[^"\\]|\\.)*)"', line).group(1)
+            try:
+                line = self._lines.next()
+                self._line_number += 1
+            except StopIteration:
+                raise ValueError("VCF header has no #CHROM line.")
+
+    def get_csq_description(self):
+        if self._csq_description is None:
+            raise ValueError("VCF header does not define the CSQ INFO field.")
+        return self._csq_description
+
+    def __iter__(self):
+        for line in self._lines:
+            self._line_number += 1
+            if line.strip() == "":
+                continue
+            yield NativeVcfRecord(line, self._line_number)
+
+
+def open_vcf(vcf_filename):
+    '''Opens a plain text or a gzip/bgzip-compressed VCF file, depending on
+    the file's contents.'''
+
+    with open(vcf_filename, "rb") as vcf_file:
+        magic = vcf_file.read(2)
+
+    if magic == "\x1f\x8b":
+        return gzip.open(vcf_filename)
+    else:
+        return open(vcf_filename)
+
+
+def parse_bed_regions(bed_file):
+    '''Parses a BED file, returning a sorted list of non-overlapping
+    (chrom, start, end) regions, with overlapping or adjacent input regions
+    merged.'''
+
+    regions = []
+    for line in bed_file:
+        if line.startswith("#") or line.startswith("track") or line.startswith("browser") or line.strip() == "":
+            continue
+        elems = line.strip().split("\t")
+        if len(elems) < 3:
+            raise ValueError("Invalid BED line: " + line)
+        regions.append((elems[0], int(elems[1]), int(elems[2])))
+
+    regions.sort()
+
+    merged_regions = []
+    for region in regions:
+        if len(merged_regions) > 0 and merged_regions[-1][0] == region[0] and \
+                merged_regions[-1][2] >= region[1]:
+            prev_region = merged_regions[-1]
+            merged_regions[-1] = (prev_region[0], prev_region[1], max(prev_region[2], region[2]))
+        else:
+            merged_regions.append(region)
+
+    return merged_regions
+
+
+def fetch_vcf_regions(vcf_filename, regions):
+    '''Generates the header lines of a bgzipped, tabix-indexed VCF file,
+    followed by only those records overlapping the specified (chrom, start,
+    end) regions. Only the index blocks covering those regions are read.
+
+    Requires pysam, which is imported here so that it is only needed when
+    using region-restricted input. The file is closed once the generator is
+    exhausted or closed.'''
+
+    import pysam
+
+    tabix_file = pysam.TabixFile(vcf_filename)
+    try:
+        for line in tabix_file.header:
+            yield line + "\n"
+
+        contigs = set(tabix_file.contigs)
+        observed_records = set()
+        for (chrom, start, end) in regions:
+            if not chrom in contigs:
+                continue
+
+            for line in tabix_file.fetch(chrom, start, end):
+                # A record can overlap more than one region:
+                if not line in observed_records:
+                    observed_records.add(line)
+                    yield line + "\n"
+    finally:
+        tabix_file.close()
+
+
 class AlterationExtractor:
-    def __init__(self):
+    PYVCF_READER = "pyvcf"
+    NATIVE_READER = "native"
+
+    def __init__(self, annotation_whitelist=None, metrics=NULL_METRICS):
         self._symbol2gene = {}
+        self._metrics = metrics
+
+        # Optional set of (symbol, transcript_ID) pairs; CSQ annotations not
+        # in this set are discarded. All annotations are kept if it is None:
+        self._annotation_whitelist = annotation_whitelist
+
         self._symbol_idx = None
         self._gene_id_idx = None
         self._transcript_id_idx = None
@@ -232,10 +460,14 @@ class AlterationExtractor:
         fields = annotation.split("|")
         return fields[self._aa_position_idx].split(":")[-1]
 
-    def extract_mutations(self, vcf_file):
+    def extract_mutations(self, vcf_file, vcf_reader_type=PYVCF_READER):
         """
         Extract mutations from a VCF file.
 
+        vcf_reader_type selects between parsing the VCF with pyvcf
+        (PYVCF_READER) or with the much lighter NativeVcfReader
+        (NATIVE_READER), which only extracts the CSQ INFO field.
+
         Note regarding a but in VEP:
         If no mutations are present when running VEP on a VCF file, VEP will
         create an empty file rather than a VCF file with a header only. This
@@ -243,38 +475,77 @@ class AlterationExtractor:
         since the header can't be parsed. For this reason, creation of the reader
         object is wrapped in a try-except below.
         """
+        if not vcf_reader_type in (self.PYVCF_READER, self.NATIVE_READER):
+            raise ValueError("Invalid VCF reader type: " + vcf_reader_type)
+
         try:
-            vcf_reader = vcf.Reader(vcf_file)
+            if vcf_reader_type == self.NATIVE_READER:
+                vcf_reader = NativeVcfReader(vcf_file)
+            else:
+                # pyvcf is only imported when it is used:
+                import vcf
+                vcf_reader = vcf.Reader(vcf_file)
         except StopIteration:
             return
 
         # Retrieve the indexes of the relevant fields from the list of INFO
-        # fields:
-        self.extract_field_idxs(vcf_reader.infos["CSQ"].desc.split("|"))
+        # fields, and the CSQ annotations of each record:
+        if vcf_reader_type == self.NATIVE_READER:
+            csq_fieldnames = vcf_reader.get_csq_description().split("|")
+            annotation_lists = (record.get_csq_annotations() for record in vcf_reader)
+        else:
+            csq_fieldnames = vcf_reader.infos["CSQ"].desc.split("|")
+            annotation_lists = (mutation.INFO['CSQ'] for mutation in vcf_reader)
+
+        self.extract_field_idxs(csq_fieldnames)
+        csq_decoder = CsqDecoder(csq_fieldnames)
+
+        whitelist = self._annotation_whitelist
 
-        for mutation in vcf_reader:
-            vep_annotations = mutation.INFO['CSQ']
+        # Counted per record rather than per annotation, and only reported
+        # once the whole file is read:
+        n_records = 0
+        n_annotations = 0
+        n_alterations_before = self.count_alterations()
 
-            for annotation in vep_annotations:
-                # Extract gene symbol, ID, transcript_ID, alteration position and alteration type:
-                symbol = self.extract_symbol(annotation)
-                gene_id = self.extract_gene_id(annotation)
-                transcript_id = self.extract_transcript_id(annotation)
-                alteration_type = self.extract_alteration_type(annotation)
-                aa_position = self.extract_aa_position(annotation)
+        for vep_annotations in annotation_lists:
+            n_records += 1
+            n_annotations += len(vep_annotations)
+            # Extract gene symbol, ID, transcript_ID, alteration position and
+            # alteration type from each annotation:
+            for record in csq_decoder.iter_records(vep_annotations):
+                if whitelist is None or (record.symbol, record.transcript_id) in whitelist:
+                    self.add_csq_record(record)
 
-                # Add this gene if it has not already been added:
-                if not self._symbol2gene.has_key(symbol):
-                    curr_gene = Gene(symbol)
-                    curr_gene.set_ID(gene_id)
-                    altered_gene = AlteredGene(curr_gene)
-                    self._symbol2gene[symbol] = altered_gene
+        self._metrics.count("vcf_records_read", n_records)
+        self._metrics.count("annotations_parsed", n_annotations)
+        self._metrics.count("alterations_created", self.count_alterations() - n_alterations_before)
 
-                altered_gene = self._symbol2gene[symbol]
+    def extract_mutations_in_regions(self, vcf_filename, regions):
+        '''Extract mutations from a bgzipped, tabix-indexed VCF file, only
+        considering records overlapping the specified regions (as returned
+        by parse_bed_regions). Always uses the native VCF reader.'''
 
-                # Record the current alteration:
-                curr_alteration = Alteration(altered_gene, transcript_id, alteration_type, aa_position)
-                altered_gene.add_alteration(curr_alteration)
+        self.extract_mutations(fetch_vcf_regions(vcf_filename, regions), self.NATIVE_READER)
+
+    def add_csq_record(self, record):
+        '''Records the alteration described by a decoded CSQ annotation.'''
+
+        symbol = record.symbol
+
+        # Add this gene if it has not already been added:
+        if not self._symbol2gene.has_key(symbol):
+            curr_gene = Gene(symbol)
+            curr_gene.set_ID(record.gene_id)
+            altered_gene = AlteredGene(curr_gene)
+            self._symbol2gene[symbol] = altered_gene
+
+        altered_gene = self._symbol2gene[symbol]
+
+        # Record the current alteration:
+        curr_alteration = Alteration(altered_gene, record.transcript_id,
+                                     record.alteration_type, record.hgvsp)
+        altered_gene.add_alteration(curr_alteration)
 
     def extract_cnvs(self, cnvFile):
         cnv_dict = json.load(cnvFile)
@@ -301,11 +572,15 @@ class AlterationExtractor:
                                          call2sequence_ontology[call],
                                          None)
             altered_gene.add_alteration(curr_alteration)
+            self._metrics.count("alterations_created")
 
         else:
             if call != "NOCALL":
                 raise ValueError("Invalid CNV call value: " + call)
 
+    def count_alterations(self):
+        return sum([len(altered_gene.get_alterations()) for altered_gene in self._symbol2gene.values()])
+
     def to_dict(self):
         return self._symbol2gene
 
@@ -0,0 +1,258 @@
+import re
+
+from bisect import bisect_right
+
+from reportgen.reporting.metrics import NULL_METRICS
+
+
+RESIDUE_CHANGE_PATTERN = re.compile("^p\.[A-Z][a-z]{2}[0-9]+[A-Z][a-z]{2}$")
+POSITION_PATTERN = re.compile("^[0-9]+$")
+POSITION_RANGE_PATTERN = re.compile("^[0-9]+:[0-9]+$")
+INTEGER_PATTERN = re.compile("[0-9]+")
+
+
+class PositionPredicate:
+    '''Pre-parsed form of the position strings of an AlterationClassification.
+    Exact residue changes and integer positions are held in sets, and
+    position ranges are merged into sorted, non-overlapping intervals that are
+    searched by bisection. matches() gives the same result as
+    AlterationClassification.matches_positions().'''
+
+    def __init__(self, position_strings):
+        self._residue_changes = set()
+        self._positions = set()
+        ranges = []
+
+        for position_string in position_strings:
+            if RESIDUE_CHANGE_PATTERN.match(position_string) != None:
+                self._residue_changes.add(position_string)
+            elif POSITION_PATTERN.match(position_string) != None:
+                self._positions.add(int(position_string))
+            elif POSITION_RANGE_PATTERN.match(position_string) != None:
+                range_start, range_end = map(int, position_string.split(":"))
+                # An inverted range can never match:
+                if range_start <= range_end:
+                    ranges.append((range_start, range_end))
+            else:
+                raise ValueError("Invalid position string: " + position_string)
+
+        ranges.sort()
+        self._range_starts = []
+        self._range_ends = []
+        for range_start, range_end in ranges:
+            if len(self._range_ends) > 0 and range_start <= self._range_ends[-1]:
+                self._range_ends[-1] = max(self._range_ends[-1], range_end)
+            else:
+                self._range_starts.append(range_start)
+                self._range_ends.append(range_end)
+
+        self._uses_integer_position = len(self._positions) > 0 or len(self._range_starts) > 0
+
+    def matches(self, hgvsp):
+        # An alteration without an HGVSp string does not match any position:
+        if hgvsp == None:
+            return False
+
+        if hgvsp in self._residue_changes:
+            return True
+
+        if not self._uses_integer_position:
+            return False
+
+        # The remaining checks depend solely on the position of the
+        # alteration, disregarding the residue information:
+        position_match = INTEGER_PATTERN.search(hgvsp)
+        if position_match == None:
+            return False
+        position = int(position_match.group())
+
+        if position in self._positions:
+            return True
+
+        range_idx = bisect_right(self._range_starts, position) - 1
+        return range_idx >= 0 and position <= self._range_ends[range_idx]
+
+
+class ClassificationIndex:
+    '''Index of the AlterationClassification objects for a single gene, keyed
+    by (transcript_ID, consequence). match() returns the same classifications,
+    in the same order, as calling AlterationClassification.match() on each of
+    the gene's classifications in turn.
+
+    Each classification can optionally be added along with a target object,
+    which is returned alongside it by match_targets(). This allows
+    classifications from several rules to share a single index.'''
+
+    def __init__(self, classifications=()):
+        self._key2entries = {}
+
+        for classification in classifications:
+            self.add(classification)
+
+    def add(self, classification, target=None):
+        # Absence of position information means that position is not
+        # used to discount a match:
+        predicate = None
+        if len(classification.get_position_information()) > 0:
+            predicate = PositionPredicate(classification.get_position_information())
+
+        # A consequence listed more than once must still only yield one
+        # match for this classification:
+        for consequence in set(classification.get_consequences()):
+            key = (classification.get_transcript_ID(), consequence)
+            if not self._key2entries.has_key(key):
+                self._key2entries[key] = []
+            self._key2entries[key].append((classification, predicate, target))
+
+    def match_targets(self, alteration):
+        '''Returns (target, classification) pairs for all classifications
+        matching the alteration, in the order they were added.'''
+
+        entries = self._key2entries.get((alteration.get_transcript_ID(), alteration.get_sequence_ontology()))
+        if entries == None:
+            return []
+
+        hgvsp = alteration.get_hgvsp()
+        return [(target, classification) for (classification, predicate, target) in entries
+                if predicate == None or predicate.matches(hgvsp)]
+
+    def match(self, alteration):
+        return [classification for (_, classification) in self.match_targets(alteration)]
+
+    def count_candidates(self, alteration):
+        '''Returns the number of classifications that match_targets()
+        evaluates for the alteration.'''
+
+        entries = self._key2entries.get((alteration.get_transcript_ID(), alteration.get_sequence_ontology()))
+        if entries == None:
+            return 0
+        return len(entries)
+
+
+def compile_rule_index(gene_symbol2classifications):
+    '''Compiles a rule table, as returned by parse_mutation_table, into a
+    dictionary of gene symbol to ClassificationIndex.'''
+
+    symbol2index = {}
+    for symbol, classifications in gene_symbol2classifications.items():
+        symbol2index[symbol] = ClassificationIndex(classifications)
+
+    return symbol2index
+
+
+def find_matches(symbol2index, symbol2gene, metrics=NULL_METRICS):
+    '''Returns a list of (alteration, classification) pairs for all
+    alterations in symbol2gene matching a classification in the compiled
+    rule index. Matches for each gene are listed in alteration order, and
+    then in classification order.'''
+
+    count_evaluated = metrics.enabled
+    n_evaluated = 0
+
+    matches = []
+    for symbol, gene_index in symbol2index.items():
+        if not symbol2gene.has_key(symbol):
+            continue
+
+        for alteration in symbol2gene[symbol].get_alterations():
+            if count_evaluated:
+                n_evaluated += gene_index.count_candidates(alteration)
+            for classification in gene_index.match(alteration):
+                matches.append((alteration, classification))
+
+    metrics.count("classifications_evaluated", n_evaluated)
+    return matches
+
+
+class AlterationMatchEngine:
+    '''Matches alterations against the rule tables of several rules in a
+    single pass. The rule tables are registered once, and compiled into one
+    shared index per gene; run() can then be called for any number of
+    samples, each time looking up every alteration once and sorting the
+    matches by the rule table they belong to. run() does not modify the
+    engine, so that one engine can be shared by concurrent jobs.
+
+    For any one rule, run() returns the same matches as find_matches(), and
+    within each gene in the same order: by alteration, and then by the
+    classification's position in the rule table. The genes themselves are
+    visited in symbol2gene order rather than rule index order, so matches
+    for different genes may be interleaved differently.'''
+
+    def __init__(self, metrics=NULL_METRICS):
+        self._metrics = metrics
+        self._symbol2index = {}
+
+        # The registered rule tables; the index targets are positions in
+        # this list:
+        self._tables = []
+
+    def get_table_idx(self, gene_symbol2classifications):
+        for table_idx, table in enumerate(self._tables):
+            if table is gene_symbol2classifications:
+                return table_idx
+        return None
+
+    def register(self, gene_symbol2classifications):
+        '''Adds a rule table (as returned by parse_mutation_table) to the
+        shared index. Registering the same table again has no effect.'''
+
+        if self.get_table_idx(gene_symbol2classifications) != None:
+            return
+
+        table_idx = len(self._tables)
+        self._tables.append(gene_symbol2classifications)
+        for symbol, classifications in gene_symbol2classifications.items():
+            if not self._symbol2index.has_key(symbol):
+                self._symbol2index[symbol] = ClassificationIndex()
+
+            for classification in classifications:
+                self._symbol2index[symbol].add(classification, table_idx)
+
+    def run(self, rule_inputs):
+        '''Takes a list of (rule table, symbol2gene) pairs, each rule table
+        having been registered, and returns the list of (alteration,
+        classification) matches for each pair, in the same order.'''
+
+        match_lists = [[] for _ in rule_inputs]
+
+        # Rules normally share the same symbol2gene dictionary, but are not
+        # required to; each distinct one is walked over once, collecting the
+        # matches for the rule tables it is paired with:
+        symbol2gene_id2symbol2gene = {}
+        symbol2gene_id2table_idx2match_lists = {}
+        for (gene_symbol2classifications, symbol2gene), matches in zip(rule_inputs, match_lists):
+            table_idx = self.get_table_idx(gene_symbol2classifications)
+            if table_idx == None:
+                raise ValueError("Rule table has not been registered")
+
+            symbol2gene_id = id(symbol2gene)
+            if not symbol2gene_id2symbol2gene.has_key(symbol2gene_id):
+                symbol2gene_id2symbol2gene[symbol2gene_id] = symbol2gene
+                symbol2gene_id2table_idx2match_lists[symbol2gene_id] = {}
+            table_idx2match_lists = symbol2gene_id2table_idx2match_lists[symbol2gene_id]
+            if not table_idx2match_lists.has_key(table_idx):
+                table_idx2match_lists[table_idx] = []
+            table_idx2match_lists[table_idx].append(matches)
+
+        count_evaluated = self._metrics.enabled
+        n_evaluated = 0
+
+        for symbol2gene_id, symbol2gene in symbol2gene_id2symbol2gene.items():
+            table_idx2match_lists = symbol2gene_id2table_idx2match_lists[symbol2gene_id]
+
+            for symbol, altered_gene in symbol2gene.items():
+                gene_index = self._symbol2index.get(symbol)
+                if gene_index == None:
+                    continue
+
+                for alteration in altered_gene.get_alterations():
+                    if count_evaluated:
+                        n_evaluated += gene_index.count_candidates(alteration)
+                    for (table_idx, classification) in gene_index.match_targets(alteration):
+                        # Registered tables need not be paired with this
+                        # symbol2gene:
+                        for matches in table_idx2match_lists.get(table_idx, []):
+                            matches.append((alteration, classification))
+
+        self._metrics.count("classifications_evaluated", n_evaluated)
+        return match_lists
@@ -1,6 +1,8 @@
 import pdb
 from reportgen.reporting.util import parse_mutation_table
 from reportgen.reporting.features import SimpleSomaticMutationsReport
+from reportgen.reporting.metrics import NULL_METRICS
+from reportgen.rules.index import compile_rule_index, find_matches
 
 
 class SimpleSomaticMutationsRule:
@@ -12,7 +14,8 @@ class SimpleSomaticMutationsRule:
     of interest and how they should be flagged, and these rules then get applied
     to a set of gene mutations by an instance of this class.'''
 
-    def __init__(self, excel_spreadsheet, symbol2gene):
+    def __init__(self, excel_spreadsheet, symbol2gene, gene_symbol2classifications=None, symbol2index=None,
+                 metrics=NULL_METRICS):
         # FIXME: Somewhere, we need to have an exact specification of the structure
         # of the excel spreadsheet specifying rules. Writing this down here for
         # the time being.
@@ -35,41 +38,49 @@ class SimpleSomaticMutationsRule:
         # - Flag (string)
 
         # This data structure is ugly but I think it should work; it will
-        # facilitate matching mutations to rules:
-        self._gene_symbol2classifications = parse_mutation_table(excel_spreadsheet)
+        # facilitate matching mutations to rules. The spreadsheet is only
+        # parsed if its contents have not already been supplied:
+        if gene_symbol2classifications is None:
+            gene_symbol2classifications = parse_mutation_table(excel_spreadsheet)
+        self._gene_symbol2classifications = gene_symbol2classifications
+        # The compiled rule index can also be supplied, e.g. so that it is
+        # only compiled once for many samples:
+        if symbol2index is None:
+            symbol2index = compile_rule_index(gene_symbol2classifications)
+        self._symbol2index = symbol2index
 
         self._symbol2gene = symbol2gene
+        self._metrics = metrics
+
+    def get_classifications(self):
+        return self._gene_symbol2classifications
+
+    def get_symbol2gene(self):
+        return self._symbol2gene
 
     def apply(self):
         '''Generates a new SimpleSomaticMutationsReport object, summarising all
         somatic mutations of interest observed in the specified gene
         mutations.'''
 
+        return self.apply_matches(find_matches(self._symbol2index, self._symbol2gene, self._metrics))
+
+    def apply_matches(self, matches):
+        '''Generates the SimpleSomaticMutationsReport from a list of
+        (alteration, classification) matches, as produced by find_matches()
+        or an AlterationMatchEngine.'''
+
         report = SimpleSomaticMutationsReport()
 
         for symbol in self._gene_symbol2classifications.keys():
-            # Retrieve all the classifications for the current gene:
-            gene_classifications = self._gene_symbol2classifications[symbol]
-
             report.add_gene(symbol)
 
-            # Find all mutations matching this gene's rules:
-            alterations = []
-            if self._symbol2gene.has_key(symbol):
-                gene = self._symbol2gene[symbol]
-                alterations = gene.get_alterations()
-
-            for alteration in alterations:
-                # Apply all rules to this alteration, in order of precedence.
-                # In this way, later matched rules will overwrite any preceding
-                # flag result:
-                for classification in gene_classifications:
-                    flag = None
-                    if classification.match(alteration):
-                        flag = classification.get_output_flag()
-
-                    # Only add a mutation if it corresponds to a flag:
-                    if flag != None:
-                        report.add_mutation(alteration, flag)
-
-        return report
\ No newline at end of file
+        # Matches for each alteration are in order of precedence:
+        for alteration, classification in matches:
+            flag = classification.get_output_flag()
+
+            # Only add a mutation if it corresponds to a flag:
+            if flag != None:
+                report.add_mutation(alteration, flag)
+
+        return report
@@ -19,8 +19,13 @@ setup(name='reportgen',
       entry_points={
           'console_scripts': [
               'writeAlasccaReport = reportgen.__main__:writeAlasccaReport',
+              'writeAlasccaReportBatch = reportgen.__main__:writeAlasccaReportBatch',
               'compileAlasccaGenomicReport = reportgen.__main__:compileAlasccaGenomicReport',
-              'compileMetadata = reportgen.__main__:compileMetadata'
+              'compileAlasccaGenomicReportBatch = reportgen.__main__:compileAlasccaGenomicReportBatch',
+              'compileMetadata = reportgen.__main__:compileMetadata',
+              'syncReferralSnapshot = reportgen.__main__:syncReferralSnapshot',
+              'reportService = reportgen.__main__:reportService',
+              'alasccaReportPipeline = reportgen.__main__:alasccaReportPipeline'
           ]
       }
       )
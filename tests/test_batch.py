@@ -0,0 +1,172 @@
+import json, os, shutil, tempfile, unittest
+
+from StringIO import StringIO
+
+from mock import patch
+
+from reportgen.reporting.batch import compile_samples, parse_sample_manifest, read_manifest, write_summary, \
+    STATUS_FAILED, STATUS_OK
+from reportgen.reporting.compilation import AlasccaGenomicReportCompiler
+from reportgen.reporting.util import id_valid
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.path.join(TESTS_DIR, os.pardir, "reportgen", "assets")
+
+
+class TestParseSampleManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_manifest(self, filename, contents):
+        manifest_filename = os.path.join(self.tmp_dir, filename)
+        with open(manifest_filename, "w") as manifest_file:
+            manifest_file.write(contents)
+        return manifest_filename
+
+    def test_parse_tsv(self):
+        manifest_filename = self.write_manifest("manifest.tsv",
+                                                "sample\tvcf\tcnv\tmsi\tpurity\n" +
+                                                "S1\ts1.vcf\ts1_cnv.json\ts1_msi.txt\t\n" +
+                                                "S2\t/data/s2.vcf\ts2_cnv.json\ts2_msi.txt\ts2_purity.json\n")
+        entries = parse_sample_manifest(manifest_filename)
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]["sample"], "S1")
+        self.assertEqual(entries[0]["vcf"], os.path.join(self.tmp_dir, "s1.vcf"))
+        self.assertEqual(entries[0]["purity"], None)
+        self.assertEqual(entries[0]["output"], None)
+        self.assertEqual(entries[1]["vcf"], "/data/s2.vcf")
+        self.assertEqual(entries[1]["purity"], os.path.join(self.tmp_dir, "s2_purity.json"))
+
+    def test_parse_json(self):
+        manifest_filename = self.write_manifest("manifest.json",
+                                                json.dumps([{"sample": "S1", "vcf": "s1.vcf",
+                                                             "cnv": "s1_cnv.json", "msi": "s1_msi.txt"}]))
+        entries = parse_sample_manifest(manifest_filename)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["msi"], os.path.join(self.tmp_dir, "s1_msi.txt"))
+
+    def test_parse_json_numeric_IDs(self):
+        manifest_filename = self.write_manifest("pairs.json", json.dumps([{"blood": 3098121, "tumor": 3098849}]))
+        entries = read_manifest(manifest_filename, ["blood", "tumor"], ["output"], ["output"])
+        self.assertEqual(entries, [{"blood": "3098121", "tumor": "3098849", "output": None}])
+        self.assertTrue(id_valid(entries[0]["blood"]))
+
+        manifest_filename = self.write_manifest("manifest.json",
+                                                json.dumps([{"sample": 12345, "vcf": "s1.vcf",
+                                                             "cnv": "s1_cnv.json", "msi": "s1_msi.txt"}]))
+        self.assertEqual(parse_sample_manifest(manifest_filename)[0]["sample"], "12345")
+
+    def test_parse_json_invalid_value(self):
+        for (raw_entry, field) in [({"blood": 3098121.5, "tumor": 3098849}, "blood"),
+                                   ({"blood": "3098121", "tumor": 3098849, "output": 1}, "output")]:
+            manifest_filename = self.write_manifest("pairs.json", json.dumps([raw_entry]))
+            with self.assertRaisesRegexp(ValueError, "field " + field):
+                read_manifest(manifest_filename, ["blood", "tumor"], ["output"], ["output"])
+
+    def test_missing_required_field(self):
+        manifest_filename = self.write_manifest("manifest.tsv",
+                                                "sample\tvcf\tcnv\n" +
+                                                "S1\ts1.vcf\ts1_cnv.json\n")
+        with self.assertRaises(ValueError):
+            parse_sample_manifest(manifest_filename)
+
+    def test_unknown_column(self):
+        manifest_filename = self.write_manifest("manifest.tsv",
+                                                "sample\tvcf\tcnv\tmsi\tfoo\n" +
+                                                "S1\ts1.vcf\ts1_cnv.json\ts1_msi.txt\tbar\n")
+        with self.assertRaises(ValueError):
+            parse_sample_manifest(manifest_filename)
+
+    def test_duplicate_sample(self):
+        manifest_filename = self.write_manifest("manifest.tsv",
+                                                "sample\tvcf\tcnv\tmsi\n" +
+                                                "S1\ts1.vcf\ts1_cnv.json\ts1_msi.txt\n" +
+                                                "S1\ts1.vcf\ts1_cnv.json\ts1_msi.txt\n")
+        with self.assertRaises(ValueError):
+            parse_sample_manifest(manifest_filename)
+
+
+class TestCompileSamples(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.compiler = AlasccaGenomicReportCompiler(os.path.join(ASSETS_DIR, "COLORECTAL_MUTATION_TABLE.xlsx"),
+                                                     os.path.join(ASSETS_DIR, "ALASCCA_MUTATION_TABLE_SPECIFIC.xlsx"))
+        self.good_entry = {"sample": "GOOD",
+                           "vcf": os.path.join(TESTS_DIR, "multiple_genes_variant_input.vcf"),
+                           "cnv": os.path.join(TESTS_DIR, "pten_hom_loss.json"),
+                           "msi": os.path.join(TESTS_DIR, "msi_high_eg.txt"),
+                           "output": None}
+        self.bad_entry = dict(self.good_entry)
+        self.bad_entry["sample"] = "BAD"
+        self.bad_entry["vcf"] = os.path.join(self.tmp_dir, "missing.vcf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_compile_matches_single_sample(self):
+        statuses = compile_samples(self.compiler, [self.good_entry], self.tmp_dir)
+        self.assertEqual(statuses[0]["status"], STATUS_OK)
+        expected = self.compiler.compile(self.good_entry["vcf"], self.good_entry["cnv"],
+                                         self.good_entry["msi"]).to_dict()
+        with open(statuses[0]["output"]) as output_file:
+            self.assertEqual(json.load(output_file), json.loads(json.dumps(expected)))
+
+    def test_failure_does_not_abort_batch(self):
+        statuses = compile_samples(self.compiler, [self.bad_entry, self.good_entry], self.tmp_dir)
+        self.assertEqual([status["sample"] for status in statuses], ["BAD", "GOOD"])
+        self.assertEqual(statuses[0]["status"], STATUS_FAILED)
+        self.assertTrue("missing.vcf" in statuses[0]["error"])
+        self.assertFalse(os.path.exists(statuses[0]["output"]))
+        self.assertEqual(statuses[1]["status"], STATUS_OK)
+        self.assertTrue(os.path.exists(statuses[1]["output"]))
+
+    def test_invalid_sample_name_does_not_abort_batch(self):
+        # E.g. a numeric sample name in an entry not read with read_manifest:
+        invalid_entry = dict(self.good_entry)
+        invalid_entry["sample"] = 12345
+        for n_workers in [1, 2]:
+            statuses = compile_samples(self.compiler, [invalid_entry, self.good_entry], self.tmp_dir, n_workers)
+            self.assertEqual([status["status"] for status in statuses], [STATUS_FAILED, STATUS_OK])
+            self.assertTrue(statuses[0]["error"].startswith("TypeError"))
+            self.assertEqual(statuses[0]["output"], None)
+
+    def test_compile_with_workers(self):
+        statuses = compile_samples(self.compiler, [self.bad_entry, self.good_entry], self.tmp_dir, 2)
+        self.assertEqual([status["status"] for status in statuses], [STATUS_FAILED, STATUS_OK])
+
+    def test_rule_indexes_compiled_once(self):
+        second_entry = dict(self.good_entry)
+        second_entry["sample"] = "GOOD2"
+        with patch("reportgen.rules.simple_somatic_mutations.compile_rule_index") as compile_crc_index:
+            with patch("reportgen.rules.alascca.compile_rule_index") as compile_alascca_index:
+                statuses = compile_samples(self.compiler, [self.good_entry, second_entry], self.tmp_dir)
+        self.assertEqual([status["status"] for status in statuses], [STATUS_OK, STATUS_OK])
+        self.assertFalse(compile_crc_index.called)
+        self.assertFalse(compile_alascca_index.called)
+
+    def test_single_pass_compiler_with_workers(self):
+        single_pass_compiler = AlasccaGenomicReportCompiler(
+            os.path.join(ASSETS_DIR, "COLORECTAL_MUTATION_TABLE.xlsx"),
+            os.path.join(ASSETS_DIR, "ALASCCA_MUTATION_TABLE_SPECIFIC.xlsx"), single_pass_rules=True)
+        second_entry = dict(self.good_entry)
+        second_entry["sample"] = "GOOD2"
+        statuses = compile_samples(single_pass_compiler, [self.good_entry, second_entry], self.tmp_dir, 2)
+        expected = self.compiler.compile(self.good_entry["vcf"], self.good_entry["cnv"],
+                                         self.good_entry["msi"]).to_dict()
+        for status in statuses:
+            with open(status["output"]) as output_file:
+                self.assertEqual(json.load(output_file), json.loads(json.dumps(expected)))
+
+    def test_write_summary(self):
+        statuses = compile_samples(self.compiler, [self.bad_entry, self.good_entry], self.tmp_dir)
+        summary_file = StringIO()
+        write_summary(statuses, summary_file)
+        lines = summary_file.getvalue().splitlines()
+        self.assertEqual(lines[0], "sample\tstatus\toutput\tseconds\terror")
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split("\t")[1], STATUS_FAILED)
+        self.assertEqual(lines[2].split("\t")[4], "")
@@ -0,0 +1,55 @@
+import os, shutil, tempfile, unittest
+
+from reportgen.reporting.cache import FileCache, file_digest, make_key
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._cache = FileCache(self._tmp_dir, "test")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_load_miss(self):
+        self.assertEqual(self._cache.load("missing"), None)
+
+    def test_store_load(self):
+        self._cache.store("key", [[u"missense_variant"], u"KRAS"])
+        self.assertEqual(self._cache.load("key"), [[u"missense_variant"], u"KRAS"])
+
+    def test_load_corrupt(self):
+        self._cache.store("key", [1, 2, 3])
+        open(self._cache.get_path("key"), "w").write("not a pickle")
+        self.assertEqual(self._cache.load("key"), None)
+        self.assertFalse(os.path.exists(self._cache.get_path("key")))
+
+    def test_load_stale_class(self):
+        # A pickle of a class that no longer exists raises ImportError:
+        self._cache.store("key", [1, 2, 3])
+        open(self._cache.get_path("key"), "w").write("creportgen.no_such_module\nOldClass\np0\n.")
+        self.assertEqual(self._cache.load("key"), None)
+        self.assertFalse(os.path.exists(self._cache.get_path("key")))
+
+    def test_store_unwritable(self):
+        open(os.path.join(self._tmp_dir, "file"), "w").close()
+        cache = FileCache(os.path.join(self._tmp_dir, "file"), "test")
+        self.assertEqual(cache.store_file("key", lambda output_file: output_file.write("data")), None)
+        self.assertEqual(cache.load("key"), None)
+
+
+class TestKeys(unittest.TestCase):
+    def test_file_digest_changes_with_contents(self):
+        (tmp_fd, tmp_filename) = tempfile.mkstemp()
+        try:
+            os.write(tmp_fd, "contents1")
+            digest1 = file_digest(tmp_filename)
+            os.write(tmp_fd, "contents2")
+            self.assertNotEqual(file_digest(tmp_filename), digest1)
+        finally:
+            os.close(tmp_fd)
+            os.remove(tmp_filename)
+
+    def test_make_key_unambiguous(self):
+        self.assertNotEqual(make_key("ab", "c"), make_key("a", "bc"))
+        self.assertEqual(make_key(u"ab", "c"), make_key("ab", "c"))
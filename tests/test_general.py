@@ -1,7 +1,8 @@
 from mock import mock_open, patch, Mock, MagicMock
-import sys, unittest
+import StringIO, gzip, os, shutil, sys, tempfile, unittest
 
-from reportgen.rules.general import AlterationExtractor, AlterationClassification, Gene, AlteredGene, Alteration, MSIStatus
+from reportgen.rules.general import AlterationExtractor, AlterationClassification, CsqDecoder, Gene, AlteredGene, Alteration, MSIStatus, \
+    fetch_vcf_regions, make_annotation_whitelist, open_vcf, parse_bed_regions
 
 
 class TestAlterationClassification(unittest.TestCase):
@@ -71,6 +72,68 @@ class TestAlterationClassification(unittest.TestCase):
         self.assertFalse(self._pik3r1_range_classification.matches_positions(mock_alteration))
 
 
+class TestMakeAnnotationWhitelist(unittest.TestCase):
+    def test_make_annotation_whitelist(self):
+        braf_classification = AlterationClassification("BRAF", ["missense_variant"], "ENST00000288602", ["p.Val600Glu"], "BRAF_COMMON")
+        kras_classification = AlterationClassification("KRAS", ["missense_variant"], "ENST00000256078", ["12", "13"], "KRAS_COMMON")
+        igf2_classification = AlterationClassification("IGF2", ["amplification"], None, [], "ALASCCA_CLASS_B_1")
+
+        whitelist = make_annotation_whitelist([{"BRAF": [braf_classification], "KRAS": [kras_classification]},
+                                               {"IGF2": [igf2_classification], "KRAS": [kras_classification]}])
+
+        self.assertEqual(whitelist, set([("BRAF", "ENST00000288602"), ("KRAS", "ENST00000256078"), ("IGF2", None)]))
+
+
+class TestOpenVcf(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_open_vcf_plain(self):
+        self.assertEqual(open_vcf("tests/simple_variant_input.vcf").readline(), "##fileformat=VCFv4.1\n")
+
+    def test_open_vcf_gzipped(self):
+        gzipped_filename = os.path.join(self._tmp_dir, "simple_variant_input.vcf.gz")
+        gzipped_file = gzip.open(gzipped_filename, "w")
+        gzipped_file.write(open("tests/simple_variant_input.vcf").read())
+        gzipped_file.close()
+
+        self.assertEqual(open_vcf(gzipped_filename).readline(), "##fileformat=VCFv4.1\n")
+
+
+class TestParseBedRegions(unittest.TestCase):
+    def test_parse_bed_regions_merges(self):
+        bed_lines = ["track name=genes\n", "12\t200\t300\n", "1\t10\t20\tNRAS\n", "12\t100\t250\n",
+                     "12\t400\t500\n"]
+        self.assertEqual(parse_bed_regions(bed_lines), [("1", 10, 20), ("12", 100, 300), ("12", 400, 500)])
+
+    def test_parse_bed_regions_invalid(self):
+        self.assertRaises(ValueError, parse_bed_regions, ["12\t200\n"])
+
+
+class TestFetchVcfRegions(unittest.TestCase):
+    def test_tabix_file_closed(self):
+        tabix_file = MagicMock()
+        tabix_file.header = ["##fileformat=VCFv4.1"]
+        tabix_file.contigs = ["12"]
+        tabix_file.fetch.return_value = ["12\t25398284"]
+        with patch("pysam.TabixFile", return_value=tabix_file):
+            lines = list(fetch_vcf_regions("sample.vcf.gz", [("12", 1, 1000)]))
+        self.assertEqual(lines, ["##fileformat=VCFv4.1\n", "12\t25398284\n"])
+        tabix_file.close.assert_called_once_with()
+
+    def test_tabix_file_closed_early(self):
+        tabix_file = MagicMock()
+        tabix_file.header = ["##fileformat=VCFv4.1", "#CHROM"]
+        with patch("pysam.TabixFile", return_value=tabix_file):
+            lines = fetch_vcf_regions("sample.vcf.gz", [])
+            lines.next()
+            lines.close()
+        tabix_file.close.assert_called_once_with()
+
+
 class TestMSIStatus(unittest.TestCase):
     def setUp(self):
         self._msi_status = MSIStatus()
@@ -106,6 +169,26 @@ class TestMSIStatus(unittest.TestCase):
                 self.assertRaises(ValueError, lambda: self._msi_status.set_from_file(open(test_file)))
 
 
+class TestCsqDecoder(unittest.TestCase):
+    def setUp(self):
+        self._decoder = CsqDecoder(["Allele", "Gene", "Feature", "Consequence", "SYMBOL", "HGVSp"])
+
+    def test_decode(self):
+        record = self._decoder.decode("G|ENSG00000213281|ENST00000369535|missense_variant&splice_region_variant|NRAS|ENSP00000358548.2:p.Gln61His")
+        self.assertEqual(record.symbol, "NRAS")
+        self.assertEqual(record.gene_id, "ENSG00000213281")
+        self.assertEqual(record.transcript_id, "ENST00000369535")
+        self.assertEqual(record.alteration_type, "missense_variant")
+        self.assertEqual(record.hgvsp, "p.Gln61His")
+
+    def test_decode_no_hgvsp(self):
+        record = self._decoder.decode("G|ENSG00000213281|ENST00000369535|intron_variant|NRAS|")
+        self.assertEqual(record.hgvsp, "")
+
+    def test_missing_column(self):
+        self.assertRaises(ValueError, CsqDecoder, ["Allele", "Gene", "Feature"])
+
+
 class TestAlterationExtractor(unittest.TestCase):
     _extractor = None
 
@@ -175,6 +258,106 @@ class TestAlterationExtractor(unittest.TestCase):
         self.assertEqual(len(output_dict.keys()), len(expected_dict.keys()))
         self.assertEqual(output_dict["NRAS"].get_gene().get_ID(), expected_dict["NRAS"].get_gene().get_ID())
 
+    def test_extract_mutations_native_empty_input(self):
+        self._extractor.extract_mutations(open("tests/empty_input.vcf"), AlterationExtractor.NATIVE_READER)
+        self.assertDictEqual(self._extractor.to_dict(), {})
+
+    def test_extract_mutations_native_empty_input_without_header(self):
+        self._extractor.extract_mutations(open("tests/empty_input_without_header.vcf"),
+                                          AlterationExtractor.NATIVE_READER)
+        self.assertDictEqual(self._extractor.to_dict(), {})
+
+    def test_extract_mutations_native_matches_pyvcf(self):
+        for vcf_filename in ["tests/36-nras-braf-kras-variants.vcf", "tests/multiple_genes_variant_input.vcf",
+                             "tests/pten_dominant_negative.vcf"]:
+            pyvcf_extractor = AlterationExtractor()
+            pyvcf_extractor.extract_mutations(open(vcf_filename), AlterationExtractor.PYVCF_READER)
+            native_extractor = AlterationExtractor()
+            native_extractor.extract_mutations(open(vcf_filename), AlterationExtractor.NATIVE_READER)
+
+            def summarise(symbol2gene):
+                return dict((symbol, (altered_gene.get_gene().get_ID(),
+                                      [(alteration.get_transcript_ID(), alteration.get_sequence_ontology(),
+                                        alteration.get_hgvsp()) for alteration in altered_gene.get_alterations()]))
+                            for symbol, altered_gene in symbol2gene.items())
+
+            self.assertDictEqual(summarise(native_extractor.to_dict()), summarise(pyvcf_extractor.to_dict()))
+
+    def test_extract_mutations_native_blank_lines(self):
+        vcf_lines = open("tests/multiple_genes_variant_input.vcf").read().splitlines(True)
+        # The file has no final newline:
+        vcf_lines[-1] += "\n"
+        self._extractor.extract_mutations(StringIO.StringIO("".join(vcf_lines + ["\n", "  \t\r\n"])),
+                                          AlterationExtractor.NATIVE_READER)
+        expected_extractor = AlterationExtractor()
+        expected_extractor.extract_mutations(open("tests/multiple_genes_variant_input.vcf"),
+                                             AlterationExtractor.NATIVE_READER)
+        self.assertEqual(self._extractor.count_alterations(), expected_extractor.count_alterations())
+        self.assertEqual(sorted(self._extractor.to_dict().keys()), sorted(expected_extractor.to_dict().keys()))
+
+    def test_extract_mutations_native_truncated_record(self):
+        vcf_lines = open("tests/multiple_genes_variant_input.vcf").read().splitlines(True)
+        # The file has no final newline:
+        vcf_lines[-1] += "\n"
+        vcf_lines.append("12\t25398284\t.\tC\n")
+        with self.assertRaisesRegexp(ValueError, "line %d" % len(vcf_lines)):
+            self._extractor.extract_mutations(StringIO.StringIO("".join(vcf_lines)),
+                                              AlterationExtractor.NATIVE_READER)
+
+    def test_extract_mutations_shares_strings(self):
+        self._extractor.extract_mutations(open("tests/multiple_genes_variant_input.vcf"),
+                                          AlterationExtractor.NATIVE_READER)
+        kras_alterations = self._extractor.to_dict()["KRAS"].get_alterations()
+
+        # Alterations are compact, and refer to single copies of repeated
+        # transcript IDs and sequence ontology terms:
+        self.assertFalse(hasattr(kras_alterations[0], "__dict__"))
+        self.assertTrue(kras_alterations[0].get_transcript_ID() is kras_alterations[1].get_transcript_ID())
+        self.assertTrue(kras_alterations[0].get_sequence_ontology() is
+                        Alteration(None, None, "".join(["missense", "_variant"]), None).get_sequence_ontology())
+
+    def test_extract_mutations_invalid_reader(self):
+        self.assertRaises(ValueError, self._extractor.extract_mutations, open("tests/simple_variant_input.vcf"),
+                          "invalid")
+
+    def test_extract_mutations_whitelist(self):
+        extractor = AlterationExtractor(set([("KRAS", "ENST00000256078")]))
+        extractor.extract_mutations(open("tests/multiple_genes_variant_input.vcf"))
+        output_dict = extractor.to_dict()
+
+        self.assertEqual(output_dict.keys(), ["KRAS"])
+        self.assertEqual(len(output_dict["KRAS"].get_alterations()), 2)
+
+    def test_extract_mutations_whitelist_no_matching_transcript(self):
+        extractor = AlterationExtractor(set([("KRAS", "ENST00000311936")]))
+        extractor.extract_mutations(open("tests/multiple_genes_variant_input.vcf"), AlterationExtractor.NATIVE_READER)
+        self.assertDictEqual(extractor.to_dict(), {})
+
+    def test_extract_mutations_gzipped(self):
+        self._extractor.extract_mutations(open_vcf("tests/multiple_genes_variant_input.vcf.gz"),
+                                          AlterationExtractor.NATIVE_READER)
+        self.assertEqual(sorted(self._extractor.to_dict().keys()), ["KRAS", "NRAS"])
+
+    def test_extract_mutations_in_regions(self):
+        regions = parse_bed_regions(open("tests/kras_region.bed"))
+        self._extractor.extract_mutations_in_regions("tests/multiple_genes_variant_input.vcf.gz", regions)
+        output_dict = self._extractor.to_dict()
+
+        self.assertEqual(output_dict.keys(), ["KRAS"])
+        self.assertEqual(len(output_dict["KRAS"].get_alterations()),
+                         len(self._make_extractor("tests/multiple_genes_variant_input.vcf")["KRAS"].get_alterations()))
+
+    def test_extract_mutations_in_regions_overlapping_regions(self):
+        regions = [("12", 25357722, 25378600), ("12", 25378600, 25403870), ("7", 1, 1000)]
+        self._extractor.extract_mutations_in_regions("tests/multiple_genes_variant_input.vcf.gz", regions)
+        self.assertEqual(len(self._extractor.to_dict()["KRAS"].get_alterations()),
+                         len(self._make_extractor("tests/multiple_genes_variant_input.vcf")["KRAS"].get_alterations()))
+
+    def _make_extractor(self, vcf_filename):
+        extractor = AlterationExtractor()
+        extractor.extract_mutations(open(vcf_filename))
+        return extractor.to_dict()
+
     def test_extract_cnvs_gene_no_call(self):
         self._extractor.extract_cnvs(open("tests/pten_no_call.json"))
         output_dict = self._extractor.to_dict()
@@ -0,0 +1,60 @@
+import unittest
+
+from reportgen.rules.general import AlterationClassification, Gene, AlteredGene, Alteration
+from reportgen.rules.index import ClassificationIndex, PositionPredicate, compile_rule_index
+
+
+class TestPositionPredicate(unittest.TestCase):
+    def test_residue_change(self):
+        predicate = PositionPredicate(["p.Val600Glu"])
+        self.assertTrue(predicate.matches("p.Val600Glu"))
+        self.assertFalse(predicate.matches("p.Val600Lys"))
+
+    def test_position(self):
+        predicate = PositionPredicate(["12", "13"])
+        self.assertTrue(predicate.matches("p.Gly13Asp"))
+        self.assertFalse(predicate.matches("p.Gly14Asp"))
+
+    def test_ranges(self):
+        predicate = PositionPredicate(["340:670", "600:700", "10:20"])
+        self.assertTrue(predicate.matches("p.Val10Leu"))
+        self.assertTrue(predicate.matches("p.Val690Leu"))
+        self.assertFalse(predicate.matches("p.Val21Leu"))
+        self.assertFalse(predicate.matches("p.Val701Leu"))
+
+    def test_no_hgvsp(self):
+        self.assertFalse(PositionPredicate(["12"]).matches(None))
+        self.assertFalse(PositionPredicate(["12"]).matches(""))
+
+    def test_invalid_position_string(self):
+        self.assertRaises(ValueError, PositionPredicate, ["V600E"])
+
+
+class TestClassificationIndex(unittest.TestCase):
+    def setUp(self):
+        self._classifications = [
+            AlterationClassification("PIK3R1", ["frameshift_variant", "inframe_insertion", "stop_gained"], "ENST00000521381", ["340:670"], "ALASCCA_CLASS_B_1"),
+            AlterationClassification("PIK3R1", ["missense_variant"], "ENST00000521381", ["376", "379", "452", "p.Val10Leu"], "ALASCCA_CLASS_B_1"),
+            AlterationClassification("PIK3R1", ["stop_gained", "loss_of_heterozygosity"], "ENST00000521381", [], "ALASCCA_CLASS_B_2"),
+            AlterationClassification("PIK3R1", ["missense_variant", "stop_gained"], "ENST00000521381", ["1:400", "500"], "TEST")]
+        self._index = ClassificationIndex(self._classifications)
+
+        pik3r1 = Gene("PIK3R1")
+        pik3r1.set_ID("ENSG00000145675")
+        self._altered_gene = AlteredGene(pik3r1)
+
+    def test_matches_same_as_classification_match(self):
+        for transcript_ID in ["ENST00000521381", "ENST00000521382"]:
+            for consequence in ["frameshift_variant", "missense_variant", "stop_gained", "loss_of_heterozygosity",
+                                "synonymous_variant"]:
+                for hgvsp in [None, "p.Val10Leu", "p.Val10Lys"] + ["p.Val%dLeu" % position for position in range(1, 800)]:
+                    alteration = Alteration(self._altered_gene, transcript_ID, consequence, hgvsp)
+                    expected = [classification for classification in self._classifications
+                                if classification.match(alteration)]
+                    self.assertEqual(self._index.match(alteration), expected)
+
+    def test_compile_rule_index(self):
+        symbol2index = compile_rule_index({"PIK3R1": self._classifications})
+        alteration = Alteration(self._altered_gene, "ENST00000521381", "stop_gained", "p.Val350Leu")
+        self.assertEqual(symbol2index["PIK3R1"].match(alteration),
+                         [self._classifications[0], self._classifications[2], self._classifications[3]])
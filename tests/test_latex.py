@@ -0,0 +1,107 @@
+import os, shutil, tempfile, unittest
+
+from mock import patch
+
+from reportgen.reporting.latex import LatexRunner, get_format_arguments, needs_rerun
+
+
+def fake_pdflatex(returncodes, log_lines, calls):
+    '''Returns a function standing in for subprocess.call, which writes a pdf
+    file and a log to the output directory, as pdflatex would. Successive
+    passes return the successive exit statuses and log lines.'''
+
+    def call(args, **kwargs):
+        pass_idx = len(calls)
+        calls.append(args)
+        output_name = args[args.index("-jobname") + 1]
+        working_dir = args[args.index("-output-directory") + 1]
+        with open(os.path.join(working_dir, output_name + ".log"), "w") as log_file:
+            log_file.write(log_lines[pass_idx] + "\n")
+        if returncodes[pass_idx] == 0:
+            with open(os.path.join(working_dir, output_name + ".pdf"), "w") as pdf_file:
+                pdf_file.write("%PDF")
+        return returncodes[pass_idx]
+
+    return call
+
+
+class TestLatexRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_filename = os.path.join(self.tmp_dir, "Report.pdf")
+        self.runner = LatexRunner(scratch_parent=self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_single_pass(self):
+        calls = []
+        with patch("reportgen.reporting.latex.subprocess.call",
+                   side_effect=fake_pdflatex([0], ["Output written on Report.pdf"], calls)):
+            result = self.runner.run(u"\\documentclass{article}", "Report", self.output_filename)
+        self.assertEqual(result["returncode"], 0)
+        self.assertEqual(len(result["pass_seconds"]), 1)
+        self.assertEqual(calls[0][:2], ["pdflatex", "-interaction"])
+        self.assertEqual(calls[0][2], "batchmode")
+        self.assertTrue(os.path.exists(self.output_filename))
+
+        # The scratch directory is removed after a successful job:
+        self.assertEqual(result["scratch_dir"], None)
+        self.assertEqual(os.listdir(self.tmp_dir), ["Report.pdf"])
+
+    def test_rerun_when_log_requests_it(self):
+        log_lines = ["LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.",
+                     "Package longtable Warning: Table widths have changed. Rerun LaTeX.",
+                     "Output written on Report.pdf"]
+        calls = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex([0, 0, 0], log_lines, calls)):
+            result = self.runner.run(u"", "Report", self.output_filename)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(result["pass_seconds"]), 3)
+
+    def test_max_passes(self):
+        runner = LatexRunner(scratch_parent=self.tmp_dir, max_passes=2)
+        calls = []
+        with patch("reportgen.reporting.latex.subprocess.call",
+                   side_effect=fake_pdflatex([0, 0, 0], ["Rerun LaTeX."] * 3, calls)):
+            runner.run(u"", "Report", self.output_filename)
+        self.assertEqual(len(calls), 2)
+
+    def test_failure_keeps_scratch_dir(self):
+        calls = []
+        with patch("reportgen.reporting.latex.subprocess.call",
+                   side_effect=fake_pdflatex([1], ["! Undefined control sequence."], calls)):
+            result = self.runner.run(u"\\foo", "Report", self.output_filename)
+        self.assertEqual(result["returncode"], 1)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(os.path.exists(self.output_filename))
+        self.assertEqual(open(os.path.join(result["scratch_dir"], "LatexCode.tex")).read(), "\\foo")
+        self.assertTrue(os.path.exists(result["log"]))
+
+    def test_invalid_interaction(self):
+        self.assertRaises(ValueError, LatexRunner, "errorstopmode")
+
+    def test_needs_rerun(self):
+        log_filename = os.path.join(self.tmp_dir, "Report.log")
+        self.assertFalse(needs_rerun(log_filename))
+        with open(log_filename, "w") as log_file:
+            log_file.write("Package rerunfilecheck Warning: File `Report.out' has changed.\n" +
+                           "(rerunfilecheck)                Rerun to get outlines right\n")
+        self.assertTrue(needs_rerun(log_filename))
+
+    def test_format_arguments(self):
+        self.assertEqual(get_format_arguments(None), [])
+        self.assertEqual(get_format_arguments("/cache/latex_formats/abc.fmt"), ["-fmt", "/cache/latex_formats/abc"])
+
+    def test_missing_pdf(self):
+        def call(args, **kwargs):
+            # E.g. a document without any content, for which pdflatex writes
+            # no output file:
+            working_dir = args[args.index("-output-directory") + 1]
+            open(os.path.join(working_dir, "Report.log"), "w").write("No pages of output.\n")
+            return 0
+
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=call):
+            with self.assertRaisesRegexp(RuntimeError, "pdflatex conversion failed; see .*Report.log"):
+                self.runner.run(u"\\documentclass{article}", "Report", self.output_filename)
+        self.assertFalse(os.path.exists(self.output_filename))
@@ -1,5 +1,6 @@
 import reportgen.rules.general as general
-import unittest
+import os, shutil, tempfile, unittest
+import sqlalchemy
 from mock import mock_open, patch, Mock, MagicMock
 import reportgen.reporting.metadata as metadata
 
@@ -115,3 +116,104 @@ class TestStandaloneFunctions(unittest.TestCase):
         self.assertEqual(out_dict["blood_sample_ID"], "03098121")
         self.assertEqual(out_dict["blood_sample_date"], "2016-01-01")
         self.assertEqual(out_dict["tumor_sample_ID"], "03098849")
+
+
+class TestMetadataLookup(unittest.TestCase):
+    def setUp(self):
+        # Work on a copy of the test referral database, to leave it untouched:
+        self.tmp_dir = tempfile.mkdtemp()
+        db_filename = os.path.join(self.tmp_dir, "referrals.db")
+        shutil.copy(os.path.join(os.path.dirname(__file__), "referrals.db"), db_filename)
+        self.engine = sqlalchemy.create_engine("sqlite:///" + db_filename)
+        self.id2addresses = {"301": [{"attn": "Dr", "line1": "l1", "line2": "l2", "line3": "l3"}]}
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_retrieve_many_pairs(self):
+        lookup = metadata.MetadataLookup(self.engine, self.id2addresses)
+        for _ in range(3):
+            out_dict = lookup.retrieve(3098121, 3098849)
+            self.assertEqual(out_dict["personnummer"], "191212121212")
+            self.assertEqual(out_dict["blood_referral_ID"], 159725)
+            self.assertEqual(out_dict["tumor_referral_ID"], 159977)
+        self.assertEqual(lookup.n_lookups, 3)
+        self.assertTrue(lookup.timings["query"] > 0)
+        lookup.close()
+
+    def test_retrieve_mismatching_pnr(self):
+        lookup = metadata.MetadataLookup(self.engine, self.id2addresses)
+        self.assertRaises(ValueError, lookup.retrieve, 3098121, 3098841)
+        # The lookup remains usable after a failed pair:
+        self.assertEqual(lookup.retrieve(3098121, 3098849)["tumor_sample_ID"], 3098849)
+        lookup.close()
+
+    def test_retrieve_bulk_matches_single_lookups(self):
+        lookup = metadata.MetadataLookup(self.engine, self.id2addresses)
+        sample_pairs = [(3098121, 3098849), (3098122, 3098850), (3098121, 3098841), (12345678, 3098849)]
+        results = lookup.retrieve_bulk(sample_pairs)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0], (lookup.retrieve(3098121, 3098849), None))
+        self.assertEqual(results[1], (lookup.retrieve(3098122, 3098850), None))
+        # Personnummer mismatch and missing referral:
+        self.assertEqual(results[2][0], None)
+        self.assertTrue(isinstance(results[2][1], ValueError))
+        self.assertEqual(results[3][0], None)
+        self.assertTrue("12345678" in str(results[3][1]))
+        lookup.close()
+
+    def test_retrieve_bulk_chunked(self):
+        lookup = metadata.MetadataLookup(self.engine, self.id2addresses)
+        with patch('reportgen.reporting.metadata.BULK_QUERY_CHUNK_SIZE', 1):
+            results = lookup.retrieve_bulk([(3098121, 3098849), (3098122, 3098850)])
+        self.assertEqual([error for (_, error) in results], [None, None])
+        lookup.close()
+
+    def test_retrieve_bulk_string_IDs(self):
+        lookup = metadata.MetadataLookup(self.engine, self.id2addresses)
+        (out_dict, error) = lookup.retrieve_bulk([("03098121", "03098849")])[0]
+        self.assertEqual(error, None)
+        self.assertEqual(out_dict["tumor_referral_ID"], 159977)
+        lookup.close()
+
+    def test_barcode_index(self):
+        session = sqlalchemy.orm.sessionmaker(bind=self.engine)()
+        index = metadata.BarcodeIndex(metadata.AlasccaTissueReferral, session)
+        # Two tissue referrals with two barcodes each:
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.query(3098849).crid, 159977)
+        self.assertEqual(index.query("03098850").crid, 159977)
+        self.assertEqual(index.get_records(12345678), [])
+        self.assertRaises(ValueError, index.query, 12345678)
+        session.close()
+
+    def test_retrieve_with_barcode_index(self):
+        lookup = metadata.MetadataLookup(self.engine, self.id2addresses)
+        indexed_lookup = metadata.MetadataLookup(self.engine, self.id2addresses, use_barcode_index=True)
+        self.assertEqual(indexed_lookup.retrieve(3098122, 3098849), lookup.retrieve(3098122, 3098849))
+        self.assertRaises(ValueError, indexed_lookup.retrieve, 3098121, 3098841)
+        self.assertTrue(indexed_lookup.timings["index"] > 0)
+        lookup.close()
+        indexed_lookup.close()
+
+    def test_retrieve_bulk_with_barcode_index(self):
+        lookup = metadata.MetadataLookup(self.engine, self.id2addresses)
+        indexed_lookup = metadata.MetadataLookup(self.engine, self.id2addresses, use_barcode_index=True)
+        sample_pairs = [(3098121, 3098849), (3098121, 3098841), (3098122, 12345678)]
+        indexed_results = indexed_lookup.retrieve_bulk(sample_pairs)
+        results = lookup.retrieve_bulk(sample_pairs)
+        self.assertEqual(indexed_results[0], results[0])
+        for (out_dict, error) in indexed_results[1:]:
+            self.assertEqual(out_dict, None)
+            self.assertTrue(isinstance(error, ValueError))
+        self.assertEqual(indexed_lookup.n_lookups, 3)
+        lookup.close()
+        indexed_lookup.close()
+
+
+class TestGetBarcodeAttributes(unittest.TestCase):
+    def test_attributes_cached(self):
+        barcode_attributes = metadata.get_barcode_attributes(metadata.AlasccaBloodReferral)
+        self.assertEqual(barcode_attributes, ["barcode1", "barcode2", "barcode3"])
+        self.assertTrue(metadata.get_barcode_attributes(metadata.AlasccaBloodReferral) is barcode_attributes)
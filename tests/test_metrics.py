@@ -0,0 +1,75 @@
+import json, os, shutil, tempfile, unittest
+
+from reportgen.reporting.compilation import AlasccaGenomicReportCompiler
+from reportgen.reporting.metrics import NULL_METRICS, Metrics
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.path.join(TESTS_DIR, os.pardir, "reportgen", "assets")
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_time_and_count(self):
+        metrics = Metrics()
+        self.assertEqual(metrics.time("add", lambda x, y: x + y, 1, y=2), 3)
+        self.assertRaises(ValueError, metrics.time, "add", int, "x")
+        metrics.count("records", 3)
+        metrics.count("records")
+
+        output_filename = os.path.join(self.tmp_dir, "Metrics.json")
+        metrics.write(output_filename)
+        output_dict = json.load(open(output_filename))
+        self.assertEqual(output_dict["timers"]["add"]["calls"], 2)
+        self.assertEqual(output_dict["counters"], {"records": 4})
+
+    def test_null_metrics(self):
+        self.assertFalse(NULL_METRICS.enabled)
+        self.assertEqual(NULL_METRICS.time("add", lambda x, y: x + y, 1, y=2), 3)
+        NULL_METRICS.count("records", 3)
+        NULL_METRICS.add_time("add", 1.0)
+
+
+class TestCompilerMetrics(unittest.TestCase):
+    def make_compiler(self, metrics, single_pass_rules=False):
+        return AlasccaGenomicReportCompiler(os.path.join(ASSETS_DIR, "COLORECTAL_MUTATION_TABLE.xlsx"),
+                                            os.path.join(ASSETS_DIR, "ALASCCA_MUTATION_TABLE_SPECIFIC.xlsx"),
+                                            single_pass_rules=single_pass_rules, metrics=metrics)
+
+    def compile(self, compiler):
+        return compiler.compile(os.path.join(TESTS_DIR, "multiple_genes_variant_input.vcf"),
+                                os.path.join(TESTS_DIR, "pten_hom_loss.json"),
+                                os.path.join(TESTS_DIR, "msi_high_eg.txt"))
+
+    def test_compile_stages_recorded(self):
+        metrics = Metrics()
+        self.compile(self.make_compiler(metrics))
+        timers = metrics.to_dict()["timers"]
+        self.assertEqual(timers["parse_mutation_table"]["calls"], 2)
+        for timer_name in ["extract_mutations", "extract_cnvs", "read_msi", "apply.SimpleSomaticMutationsRule",
+                           "apply.AlasccaClassRule", "apply.MsiStatusRule", "check_caveats"]:
+            self.assertEqual(timers[timer_name]["calls"], 1)
+
+        self.assertEqual(metrics.get_count("vcf_records_read"), 3)
+        self.assertEqual(metrics.get_count("annotations_parsed"), 3)
+        # The three mutations, and the PTEN homozygous loss:
+        self.assertEqual(metrics.get_count("alterations_created"), 4)
+        self.assertTrue(metrics.get_count("classifications_evaluated") > 0)
+
+    def test_single_pass_counts_match(self):
+        metrics = Metrics()
+        self.compile(self.make_compiler(metrics))
+        single_pass_metrics = Metrics()
+        self.compile(self.make_compiler(single_pass_metrics, single_pass_rules=True))
+        self.assertEqual(single_pass_metrics.get_count("classifications_evaluated"),
+                         metrics.get_count("classifications_evaluated"))
+        self.assertEqual(single_pass_metrics.to_dict()["timers"]["match_rules"]["calls"], 1)
+
+    def test_report_unchanged(self):
+        self.assertEqual(self.compile(self.make_compiler(Metrics())).to_dict(),
+                         self.compile(self.make_compiler(NULL_METRICS)).to_dict())
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import json, os, shutil, tempfile, unittest
+
+from mock import Mock, patch
+
+from reportgen.reporting.batch import STATUS_OK
+from reportgen.reporting.genomics import make_jinja_environment
+from reportgen.reporting.pipeline import StageTimings, decode_strings, run_report_pipeline
+from reportgen.reporting.rendering import ReportRenderer
+
+from tests.test_rendering import fake_pdflatex
+
+
+class TestStageTimings(unittest.TestCase):
+    def test_run(self):
+        timings = StageTimings()
+        self.assertEqual(timings.run("add", lambda x, y: x + y, 1, y=2), 3)
+        self.assertRaises(ValueError, timings.run, "fail", int, "x")
+        self.assertEqual([stage_name for (stage_name, _) in timings.stages], ["add", "fail"])
+
+
+class TestDecodeStrings(unittest.TestCase):
+    def test_decode_strings(self):
+        decoded = decode_strings({"line1": "Göteborg", "codes": ("301", 302)})
+        self.assertEqual(decoded, {u"line1": u"Göteborg", u"codes": [u"301", 302]})
+        self.assertTrue(isinstance(decoded.keys()[0], unicode))
+
+
+class TestRunReportPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.compiler = Mock()
+        self.compiler.compile.return_value.to_dict.return_value = {"msi_report": {"msi_status": "MSI-H"}}
+        self.metadata_lookup = Mock()
+        self.metadata_lookup.retrieve.return_value = {"return_addresses": [{"line1": "Göteborg"}]}
+        template = make_jinja_environment().from_string(
+            u"\\VAR{genomicJSON.msi_report.msi_status} \\VAR{metaJSON.return_addresses[0].line1}")
+        self.renderer = ReportRenderer(template, {}, self.tmp_dir)
+        self.entry = {"vcf": "s1.vcf", "cnv": "s1.cnv", "msi": "s1_msi.txt"}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pipeline(self):
+        timings = StageTimings()
+        genomic_json_filename = os.path.join(self.tmp_dir, "GenomicOutput.json")
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex(0, [])):
+            status = run_report_pipeline(self.compiler, self.metadata_lookup, self.renderer, 3098121, 3098849,
+                                         self.entry, "Report", self.tmp_dir, timings,
+                                         genomic_json_filename=genomic_json_filename)
+        self.assertEqual(status["status"], STATUS_OK)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "Report.pdf")))
+        self.metadata_lookup.retrieve.assert_called_with(3098121, 3098849)
+        self.assertEqual(self.compiler.compile.call_args[1]["msi_filename"], "s1_msi.txt")
+        self.assertEqual([stage_name for (stage_name, _) in timings.stages],
+                         ["metadata", "compile", "write_genomic_json", "render"])
+        self.assertEqual(json.load(open(genomic_json_filename)), {"msi_report": {"msi_status": "MSI-H"}})
+
+    def test_latex_matches_json_round_trip(self):
+        latex_strings = []
+        self.renderer._render = lambda name, make_latex_function, output_dir: \
+            latex_strings.append(make_latex_function())
+        run_report_pipeline(self.compiler, self.metadata_lookup, self.renderer, 3098121, 3098849, self.entry,
+                            "Report", self.tmp_dir, StageTimings())
+
+        report_filename = os.path.join(self.tmp_dir, "report.json")
+        json.dump(self.compiler.compile.return_value.to_dict.return_value, open(report_filename, "w"))
+        meta_filename = os.path.join(self.tmp_dir, "meta.json")
+        json.dump(self.metadata_lookup.retrieve.return_value, open(meta_filename, "w"))
+        self.assertEqual(latex_strings, [self.renderer.make_latex(report_filename, meta_filename)])
+        self.assertEqual(latex_strings[0], u"MSI-H Göteborg")
@@ -0,0 +1,299 @@
+import json, os, shutil, tempfile, unittest
+
+from reportgen.reporting.batch import STATUS_FAILED, STATUS_OK
+from reportgen.reporting.genomics import get_jinja_environment, make_jinja_environment
+from reportgen.reporting.rendering import PDFCache, PreambleFormatCache, ReportRenderer, \
+    apply_preamble_format, parse_render_manifest, render_reports, split_latex_preamble
+
+from mock import patch
+
+
+def fake_pdflatex(returncode, scratch_dirs):
+    '''Returns a function standing in for subprocess.call, which writes a pdf
+    file to the output directory, as pdflatex would.'''
+
+    def call(args, **kwargs):
+        output_name = args[args.index("-jobname") + 1]
+        working_dir = args[args.index("-output-directory") + 1]
+        scratch_dirs.append(working_dir)
+        if returncode == 0:
+            with open(os.path.join(working_dir, output_name + ".pdf"), "w") as pdf_file:
+                pdf_file.write("%PDF")
+        return returncode
+
+    return call
+
+
+def fake_pdflatex_ini(returncode, calls):
+    '''Returns a function standing in for subprocess.call, which writes a
+    format file when run with -ini, and otherwise acts as fake_pdflatex.'''
+
+    render = fake_pdflatex(returncode, [])
+
+    def call(args, **kwargs):
+        calls.append(args)
+        if not "-ini" in args:
+            return render(args, **kwargs)
+        if returncode == 0:
+            output_name = args[args.index("-jobname") + 1]
+            working_dir = args[args.index("-output-directory") + 1]
+            with open(os.path.join(working_dir, output_name + ".fmt"), "w") as format_file:
+                format_file.write(open(args[-1]).read())
+        return returncode
+
+    return call
+
+
+class TestMakeJinjaEnvironment(unittest.TestCase):
+    def test_latex_delimiters(self):
+        jinja_env = make_jinja_environment()
+        template = jinja_env.from_string("\\VAR{name}\\BLOCK{if flag} yes\\BLOCK{endif}")
+        self.assertEqual(template.render(name="KRAS", flag=True), "KRAS yes")
+
+    def test_load_report_template(self):
+        jinja_env = make_jinja_environment()
+        self.assertNotEqual(jinja_env.get_template("alascca.tex"), None)
+
+    def test_shared_environment(self):
+        self.assertTrue(get_jinja_environment() is get_jinja_environment())
+
+    def test_bytecode_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            templates_dir = os.path.join(tmp_dir, "templates")
+            os.mkdir(templates_dir)
+            with open(os.path.join(templates_dir, "report.tex"), "w") as template_file:
+                template_file.write("\\VAR{name}")
+            cache_dir = os.path.join(tmp_dir, "cache")
+
+            template = make_jinja_environment(templates_dir, cache_dir).get_template("report.tex")
+            self.assertEqual(len(os.listdir(os.path.join(cache_dir, "jinja_templates"))), 1)
+
+            with patch("jinja2.Environment.compile") as mock_compile:
+                template = make_jinja_environment(templates_dir, cache_dir).get_template("report.tex")
+            self.assertFalse(mock_compile.called)
+            self.assertEqual(template.render(name="KRAS"), "KRAS")
+
+            # A changed template is recompiled:
+            with open(os.path.join(templates_dir, "report.tex"), "w") as template_file:
+                template_file.write("\\VAR{name}!")
+            template = make_jinja_environment(templates_dir, cache_dir).get_template("report.tex")
+            self.assertEqual(template.render(name="KRAS"), "KRAS!")
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestReportRenderer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.template = make_jinja_environment().from_string("\\VAR{genomicJSON.name} \\VAR{metaJSON.pnr}")
+        self.renderer = ReportRenderer(self.template, {}, self.tmp_dir)
+
+        self.report_filename = os.path.join(self.tmp_dir, "report.json")
+        with open(self.report_filename, "w") as report_file:
+            json.dump({"name": "Sample1"}, report_file)
+        self.meta_filename = os.path.join(self.tmp_dir, "meta.json")
+        with open(self.meta_filename, "w") as meta_file:
+            json.dump({"pnr": "191212121212"}, meta_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_make_latex(self):
+        self.assertEqual(self.renderer.make_latex(self.report_filename, self.meta_filename),
+                         "Sample1 191212121212")
+
+    def test_make_latex_report_date(self):
+        template = make_jinja_environment().from_string("\\VAR{reportDate}")
+        renderer = ReportRenderer(template, {}, self.tmp_dir, report_date="2016-05-04")
+        self.assertEqual(renderer.make_latex(self.report_filename, self.meta_filename), "2016-05-04")
+
+    def test_render_success(self):
+        scratch_dirs = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex(0, scratch_dirs)):
+            status = self.renderer.render("Report1", self.report_filename, self.meta_filename, self.tmp_dir)
+        self.assertEqual(status["status"], STATUS_OK)
+        self.assertEqual(status["returncode"], 0)
+        self.assertEqual(status["passes"], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "Report1.pdf")))
+        self.assertFalse(os.path.exists(scratch_dirs[0]))
+
+    def test_render_pdflatex_failure(self):
+        scratch_dirs = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex(1, scratch_dirs)):
+            status = self.renderer.render("Report1", self.report_filename, self.meta_filename, self.tmp_dir)
+        self.assertEqual(status["status"], STATUS_FAILED)
+        self.assertEqual(status["returncode"], 1)
+        # The scratch directory is kept for inspection:
+        self.assertTrue(os.path.exists(os.path.join(scratch_dirs[0], "LatexCode.tex")))
+
+    def test_render_invalid_input(self):
+        with open(self.meta_filename, "w") as meta_file:
+            meta_file.write("{")
+        with patch("reportgen.reporting.latex.subprocess.call") as mock_call:
+            status = self.renderer.render("Report1", self.report_filename, self.meta_filename, self.tmp_dir)
+        self.assertEqual(status["status"], STATUS_FAILED)
+        self.assertEqual(status["returncode"], None)
+        self.assertFalse(mock_call.called)
+
+    def test_render_reports_separate_scratch_dirs(self):
+        entries = [{"name": "Report%d" % idx, "report": self.report_filename, "metadata": self.meta_filename}
+                   for idx in range(4)]
+        scratch_dirs = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex(0, scratch_dirs)):
+            statuses = render_reports(self.renderer, entries, self.tmp_dir, 3)
+        self.assertEqual([status["name"] for status in statuses], ["Report0", "Report1", "Report2", "Report3"])
+        self.assertEqual(set([status["status"] for status in statuses]), set([STATUS_OK]))
+        self.assertEqual(len(set(scratch_dirs)), 4)
+
+    def test_parse_render_manifest(self):
+        manifest_filename = os.path.join(self.tmp_dir, "manifest.tsv")
+        with open(manifest_filename, "w") as manifest_file:
+            manifest_file.write("name\treport\tmetadata\nReport1\treport.json\tmeta.json\n")
+        entries = parse_render_manifest(manifest_filename)
+        self.assertEqual(entries, [{"name": "Report1", "report": self.report_filename,
+                                    "metadata": self.meta_filename, "outputDir": None}])
+
+
+class TestPreambleFormatCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.latex = u"\\documentclass{article}\n\\usepackage{graphicx}\n\\begin{document}\nBody\n\\end{document}\n"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_format_cache(self, format_options=[]):
+        return PreambleFormatCache(os.path.join(self.tmp_dir, "cache"), format_options, self.tmp_dir)
+
+    def test_split_latex_preamble(self):
+        (preamble, body) = split_latex_preamble(self.latex)
+        self.assertEqual(preamble, u"\\documentclass{article}\n\\usepackage{graphicx}\n")
+        self.assertEqual(body, u"\\begin{document}\nBody\n\\end{document}\n")
+        self.assertEqual(split_latex_preamble(u"No document"), None)
+
+    @patch("reportgen.reporting.rendering.get_pdflatex_version", return_value="pdfTeX 3.14")
+    def test_format_built_once(self, mock_version):
+        calls = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex_ini(0, calls)):
+            (body, format_filename) = apply_preamble_format(self.latex, self.make_format_cache())
+            self.assertTrue(body.startswith(u"\\begin{document}"))
+            self.assertTrue(open(format_filename).read().endswith("\\dump\n"))
+
+            # A new cache instance finds the cached format file:
+            (_, cached_filename) = apply_preamble_format(self.latex, self.make_format_cache())
+        self.assertEqual(cached_filename, format_filename)
+        self.assertEqual(len(calls), 1)
+
+    @patch("reportgen.reporting.rendering.get_pdflatex_version", return_value="pdfTeX 3.14")
+    def test_format_rebuilt_on_change(self, mock_version):
+        calls = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex_ini(0, calls)):
+            format_filename = self.make_format_cache(["10pt"]).get_format(u"\\documentclass{article}")
+            self.assertNotEqual(self.make_format_cache(["11pt"]).get_format(u"\\documentclass{article}"),
+                                format_filename)
+            self.assertNotEqual(self.make_format_cache(["10pt"]).get_format(u"\\documentclass{report}"),
+                                format_filename)
+        self.assertEqual(len(calls), 3)
+
+    @patch("reportgen.reporting.rendering.get_pdflatex_version", return_value="pdfTeX 3.14")
+    def test_default_scratch_parent(self, mock_version):
+        scratch_parent = os.path.join(self.tmp_dir, "scratch")
+        os.mkdir(scratch_parent)
+        calls = []
+        with patch("reportgen.reporting.rendering.get_default_scratch_parent", return_value=scratch_parent):
+            format_cache = PreambleFormatCache(os.path.join(self.tmp_dir, "cache"))
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex_ini(0, calls)):
+            format_cache.get_format(u"\\documentclass{article}")
+        output_dir = calls[0][calls[0].index("-output-directory") + 1]
+        self.assertEqual(os.path.dirname(output_dir), scratch_parent)
+
+    @patch("reportgen.reporting.rendering.get_pdflatex_version", return_value="pdfTeX 3.14")
+    def test_failed_build_uses_whole_document(self, mock_version):
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex_ini(1, [])):
+            self.assertEqual(apply_preamble_format(self.latex, self.make_format_cache()), (self.latex, None))
+
+    @patch("reportgen.reporting.rendering.get_pdflatex_version", return_value="pdfTeX 3.14")
+    def test_render_with_format(self, mock_version):
+        report_filename = os.path.join(self.tmp_dir, "report.json")
+        with open(report_filename, "w") as report_file:
+            json.dump({"name": "Sample1"}, report_file)
+        meta_filename = os.path.join(self.tmp_dir, "meta.json")
+        with open(meta_filename, "w") as meta_file:
+            json.dump({}, meta_file)
+
+        template = make_jinja_environment().from_string(
+            "\\documentclass{article}\n\\begin{document}\\VAR{genomicJSON.name}\\end{document}")
+        renderer = ReportRenderer(template, {}, self.tmp_dir, True, self.make_format_cache())
+        calls = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex_ini(0, calls)):
+            status = renderer.render("Report1", report_filename, meta_filename, self.tmp_dir)
+        self.assertEqual(status["status"], STATUS_OK)
+
+        render_args = calls[-1]
+        self.assertTrue("-fmt" in render_args)
+        latex_filename = os.path.join(status["scratch_dir"], "LatexCode.tex")
+        self.assertEqual(open(latex_filename).read(), "\\begin{document}Sample1\\end{document}")
+
+
+@patch("reportgen.reporting.rendering.get_pdflatex_version", return_value="pdfTeX 3.14")
+class TestPDFCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        self.asset_filename = os.path.join(self.tmp_dir, "logo.png")
+        with open(self.asset_filename, "w") as asset_file:
+            asset_file.write("PNG1")
+
+        self.report_filename = os.path.join(self.tmp_dir, "report.json")
+        with open(self.report_filename, "w") as report_file:
+            json.dump({"name": "Sample1"}, report_file)
+        self.meta_filename = os.path.join(self.tmp_dir, "meta.json")
+        with open(self.meta_filename, "w") as meta_file:
+            json.dump({}, meta_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_key_covers_assets_and_options(self, mock_version):
+        key = PDFCache(self.cache_dir, [self.asset_filename], ["10pt"]).get_key(u"latex")
+        self.assertEqual(PDFCache(self.cache_dir, [self.asset_filename], ["10pt"]).get_key(u"latex"), key)
+        self.assertNotEqual(PDFCache(self.cache_dir, [self.asset_filename], ["11pt"]).get_key(u"latex"), key)
+        self.assertNotEqual(PDFCache(self.cache_dir, [self.asset_filename], ["10pt"]).get_key(u"latex2"), key)
+        with open(self.asset_filename, "w") as asset_file:
+            asset_file.write("PNG2")
+        self.assertNotEqual(PDFCache(self.cache_dir, [self.asset_filename], ["10pt"]).get_key(u"latex"), key)
+
+    def test_retrieve(self, mock_version):
+        for link in [False, True]:
+            pdf_cache = PDFCache(self.cache_dir, link=link)
+            output_filename = os.path.join(self.tmp_dir, "Report.pdf")
+            self.assertFalse(pdf_cache.retrieve("key", output_filename))
+            with open(output_filename, "w") as pdf_file:
+                pdf_file.write("%PDF")
+            pdf_cache.store("key", output_filename)
+            os.remove(output_filename)
+
+            self.assertTrue(pdf_cache.retrieve("key", output_filename))
+            self.assertEqual(open(output_filename).read(), "%PDF")
+            shutil.rmtree(self.cache_dir)
+
+    def test_render_skips_pdflatex_on_hit(self, mock_version):
+        template = make_jinja_environment().from_string("\\VAR{genomicJSON.name} \\VAR{reportDate}")
+        renderer = ReportRenderer(template, {}, self.tmp_dir, pdf_cache=PDFCache(self.cache_dir),
+                                  report_date="2016-05-04")
+        scratch_dirs = []
+        with patch("reportgen.reporting.latex.subprocess.call", side_effect=fake_pdflatex(0, scratch_dirs)):
+            status = renderer.render("Report1", self.report_filename, self.meta_filename, self.tmp_dir)
+            self.assertFalse(status["cached"])
+            status = renderer.render("Report2", self.report_filename, self.meta_filename, self.tmp_dir)
+            self.assertTrue(status["cached"])
+            self.assertEqual(status["status"], STATUS_OK)
+            self.assertEqual(open(os.path.join(self.tmp_dir, "Report2.pdf")).read(), "%PDF")
+
+            # A different report date is a cache miss:
+            renderer = ReportRenderer(template, {}, self.tmp_dir, pdf_cache=PDFCache(self.cache_dir),
+                                      report_date="2016-05-05")
+            self.assertFalse(renderer.render("Report3", self.report_filename, self.meta_filename,
+                                             self.tmp_dir)["cached"])
+        self.assertEqual(len(scratch_dirs), 2)
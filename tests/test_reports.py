@@ -1,6 +1,10 @@
 import json, os, unittest
 
 from reportgen.reporting.genomics import ReportCompiler
+from reportgen.rules.alascca import AlasccaClassRule
+from reportgen.rules.general import AlterationClassification, Gene, AlteredGene, Alteration
+from reportgen.rules.index import AlterationMatchEngine, compile_rule_index, find_matches
+from reportgen.rules.simple_somatic_mutations import SimpleSomaticMutationsRule
 
 from mock import mock_open, patch, Mock, MagicMock
 
@@ -20,60 +24,82 @@ class TestReportCompiler(unittest.TestCase):
         compiler.extract_features()
         self.assertEqual({}, compiler.to_dict())
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    def test_extract_features_single_pass(self):
+        crc_table = {"KRAS": [AlterationClassification("KRAS", ["missense_variant"], "ENST00000256078", ["12", "13", "61", "146"], "KRAS_COMMON"),
+                              AlterationClassification("KRAS", ["missense_variant"], "ENST00000256078", ["10:150"], "KRAS_UNCOMMON")],
+                     "PIK3CA": [AlterationClassification("PIK3CA", ["missense_variant"], "ENST00000263967", ["542"], "PIK3CA_COMMON")]}
+        alascca_table = {"PIK3CA": [AlterationClassification("PIK3CA", ["missense_variant"], "ENST00000263967", ["38"], "ALASCCA_CLASS_B_1"),
+                                    AlterationClassification("PIK3CA", ["missense_variant"], "ENST00000263967", ["542"], "ALASCCA_CLASS_A")]}
+
+        kras = AlteredGene(Gene("KRAS"))
+        kras.add_alteration(Alteration(kras, "ENST00000256078", "missense_variant", "p.Ala146Pro"))
+        kras.add_alteration(Alteration(kras, "ENST00000256078", "missense_variant", "p.Lys117Asn"))
+        kras.add_alteration(Alteration(kras, "ENST00000311936", "missense_variant", "p.Gly12Asp"))
+        pik3ca = AlteredGene(Gene("PIK3CA"))
+        pik3ca.add_alteration(Alteration(pik3ca, "ENST00000263967", "missense_variant", "p.Glu542Lys"))
+        symbol2gene = {"KRAS": kras, "PIK3CA": pik3ca}
+
+        def make_rules():
+            return [SimpleSomaticMutationsRule(None, symbol2gene, crc_table),
+                    AlasccaClassRule(None, symbol2gene, alascca_table)]
+
+        per_rule_compiler = ReportCompiler(make_rules())
+        per_rule_compiler.extract_features()
+        single_pass_compiler = ReportCompiler(make_rules())
+        single_pass_compiler.extract_features(single_pass=True)
+
+        self.assertEqual(single_pass_compiler.to_dict(), per_rule_compiler.to_dict())
+        self.assertEqual(single_pass_compiler.to_dict()["alascca_class_report"]["alascca_class"], "Mutation class A")
+        self.assertEqual(len(single_pass_compiler.to_dict()["simple_somatic_mutations_report"]["KRAS"]["alterations"]), 3)
+
+
+class TestAlterationMatchEngine(unittest.TestCase):
+    def test_run_separate_symbol2genes(self):
+        table = {"KRAS": [AlterationClassification("KRAS", ["missense_variant"], "ENST00000256078", ["12"], "KRAS_COMMON")]}
+
+        symbol2gene1 = {"KRAS": AlteredGene(Gene("KRAS"))}
+        alteration1 = Alteration(symbol2gene1["KRAS"], "ENST00000256078", "missense_variant", "p.Gly12Asp")
+        symbol2gene1["KRAS"].add_alteration(alteration1)
+        symbol2gene2 = {"KRAS": AlteredGene(Gene("KRAS"))}
+        symbol2gene2["KRAS"].add_alteration(Alteration(symbol2gene2["KRAS"], "ENST00000256078", "missense_variant", "p.Gly13Asp"))
+
+        engine = AlterationMatchEngine()
+        engine.register(table)
+        (matches1, matches2) = engine.run([(table, symbol2gene1), (table, symbol2gene2)])
+
+        self.assertEqual([alteration for (alteration, _) in matches1], [alteration1])
+        self.assertEqual(matches2, [])
+
+    def test_run_matches_find_matches_per_gene(self):
+        table = {"KRAS": [AlterationClassification("KRAS", ["missense_variant"], "ENST00000256078", ["12:13"], "KRAS_A"),
+                          AlterationClassification("KRAS", ["missense_variant"], "ENST00000256078", [], "KRAS_B")],
+                 "BRAF": [AlterationClassification("BRAF", ["missense_variant"], "ENST00000288602", [], "BRAF_A")]}
+        other_table = {"KRAS": [AlterationClassification("KRAS", ["missense_variant"], "ENST00000256078", [], "KRAS_C")]}
+
+        symbol2gene = {}
+        for (symbol, transcript_ID, hgvsps) in [("KRAS", "ENST00000256078", ["p.Gly13Asp", "p.Gly61Leu", "p.Gly12Asp"]),
+                                                ("BRAF", "ENST00000288602", ["p.Val600Glu"])]:
+            symbol2gene[symbol] = AlteredGene(Gene(symbol))
+            for hgvsp in hgvsps:
+                symbol2gene[symbol].add_alteration(Alteration(symbol2gene[symbol], transcript_ID, "missense_variant", hgvsp))
+
+        engine = AlterationMatchEngine()
+        engine.register(other_table)
+        engine.register(table)
+        (matches,) = engine.run([(table, symbol2gene)])
+        expected_matches = find_matches(compile_rule_index(table), symbol2gene)
+
+        def get_gene_matches(matches, symbol):
+            return [(alteration.get_hgvsp(), classification.get_output_flag()) for (alteration, classification) in matches
+                    if alteration.get_altered_gene().get_gene().get_symbol() == symbol]
+
+        self.assertEqual(len(matches), len(expected_matches))
+        for symbol in ["KRAS", "BRAF"]:
+            self.assertEqual(get_gene_matches(matches, symbol), get_gene_matches(expected_matches, symbol))
+        self.assertEqual(get_gene_matches(matches, "KRAS"),
+                         [("p.Gly13Asp", "KRAS_A"), ("p.Gly13Asp", "KRAS_B"), ("p.Gly61Leu", "KRAS_B"),
+                          ("p.Gly12Asp", "KRAS_A"), ("p.Gly12Asp", "KRAS_B")])
+
+    def test_run_unregistered_table(self):
+        engine = AlterationMatchEngine()
+        self.assertRaises(ValueError, engine.run, [({}, {})])
@@ -83,6 +83,18 @@ class TestSimpleSomaticMutationsRule(unittest.TestCase):
                                                                            {"hgvsp": 'p.Lys117Asn', "flag": u'KRAS_COMMON'}]}}
         self.assertDictEqual(test_report.to_dict(), expected_outdict)
 
+    # Test supplying pre-parsed classifications instead of a spreadsheet:
+    def test_apply_preparsed_classifications(self):
+        input_symbol2gene = {"BRAF": self._braf_gene_single_mutation, "KRAS": self._kras_gene_multiple_mutations}
+        rule = SimpleSomaticMutationsRule(None, input_symbol2gene, self._symbol2classifications)
+        test_report = rule.apply()
+
+        expected_outdict = {'NRAS': {"status" : 'Not mutated', "alterations": []},
+                            'BRAF': {"status": 'Mutated', "alterations": [{"hgvsp": 'p.Val600Glu', "flag": 'BRAF_COMMON'}]},
+                            'KRAS': {"status": 'Mutated', "alterations" : [{"hgvsp": 'p.Ala146Pro', "flag": 'KRAS_COMMON'},
+                                                                           {"hgvsp": 'p.Lys117Asn', "flag": 'KRAS_COMMON'}]}}
+        self.assertDictEqual(test_report.to_dict(), expected_outdict)
+
 
 class TestAlasccaClassRule(unittest.TestCase):
     def setUp(self):
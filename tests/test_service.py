@@ -0,0 +1,256 @@
+import json, os, shutil, socket, stat, tempfile, threading, time, unittest, urllib2
+
+from mock import Mock
+
+from reportgen.reporting.batch import STATUS_FAILED, STATUS_OK
+from reportgen.reporting.service import InvalidRequestError, JobQueue, QueueFullError, ReloadingResource, \
+    ReportService, make_server, resolve_output_path
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_run(self):
+        queue = JobQueue(2, 0)
+        self.assertEqual(queue.run(lambda x: x + 1, 1), 2)
+        self.assertEqual(queue.get_counts(), {"pending": 0, "running": 0, "completed": 1, "rejected": 0})
+
+    def test_full_queue_rejects_jobs(self):
+        queue = JobQueue(1, 0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_job():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=queue.run, args=(blocking_job,))
+        thread.start()
+        started.wait()
+        self.assertRaises(QueueFullError, queue.run, lambda: None)
+        release.set()
+        thread.join()
+
+        self.assertEqual(queue.get_counts()["rejected"], 1)
+        queue.run(lambda: None)
+        self.assertEqual(queue.get_counts()["completed"], 2)
+
+    def test_invalid_workers(self):
+        self.assertRaises(ValueError, JobQueue, 0, 1)
+
+
+class TestReloadingResource(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, "rules.txt")
+        self.write_file("v1", 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, contents, mtime):
+        with open(self.filename, "w") as output_file:
+            output_file.write(contents)
+        os.utime(self.filename, (mtime, mtime))
+
+    def test_reload_on_change(self):
+        resource = ReloadingResource("rules", [self.filename], lambda: open(self.filename).read(), 0)
+        self.assertEqual(resource.get(), "v1")
+        self.assertEqual(resource.get(), "v1")
+        self.assertEqual(resource.n_loads, 1)
+
+        self.write_file("v2", 2000)
+        self.assertEqual(resource.get(), "v2")
+        self.assertEqual(resource.n_loads, 2)
+
+    def test_failed_reload_keeps_previous_value(self):
+        def load():
+            contents = open(self.filename).read()
+            if contents == "broken":
+                raise ValueError("Invalid rules")
+            return contents
+
+        resource = ReloadingResource("rules", [self.filename], load, 0)
+        self.assertEqual(resource.get(), "v1")
+        self.write_file("broken", 2000)
+        self.assertEqual(resource.get(), "v1")
+        self.write_file("v3", 3000)
+        self.assertEqual(resource.get(), "v3")
+
+    def test_check_interval(self):
+        resource = ReloadingResource("rules", [self.filename], lambda: open(self.filename).read(), 3600)
+        resource.get()
+        self.write_file("v2", 2000)
+        self.assertEqual(resource.get(), "v1")
+
+
+class TestReportServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.compiler = Mock()
+        self.compiler.compile.return_value.to_dict.return_value = {"msi_report": {"msi_status": "MSI-H"}}
+        compiler_resource = ReloadingResource("rules", [], lambda: self.compiler)
+        self.renderer = Mock()
+        renderer_resource = ReloadingResource("template", [], lambda: self.renderer)
+        self.service = ReportService(compiler_resource, renderer_resource, output_root=self.tmp_dir)
+
+        self.server = make_server(self.service, port=0)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def post(self, path, body, content_type="application/json"):
+        try:
+            response = urllib2.urlopen(urllib2.Request(self.url + path, body,
+                                                       {"Content-Type": content_type}))
+            return (response.getcode(), json.loads(response.read()))
+        except urllib2.HTTPError, e:
+            return (e.code, json.loads(e.read()))
+
+    def test_compile(self):
+        (code, status) = self.post("/compile", json.dumps({"sample": "S1", "vcf": "s1.vcf", "cnv": "s1.cnv",
+                                                           "msi": "s1_msi.txt"}))
+        self.assertEqual(code, 200)
+        self.assertEqual(status["status"], STATUS_OK)
+        self.assertEqual(status["report"], {"msi_report": {"msi_status": "MSI-H"}})
+        self.assertEqual(self.compiler.compile.call_args[1]["vcf_filename"], "s1.vcf")
+
+    def test_compile_to_file(self):
+        (code, status) = self.post("/compile", json.dumps({"sample": "S1", "vcf": "s1.vcf", "cnv": "s1.cnv",
+                                                           "msi": "s1_msi.txt", "output": "S1_GenomicOutput.json"}))
+        self.assertEqual(status["status"], STATUS_OK)
+        self.assertEqual(json.load(open(os.path.join(self.tmp_dir, "S1_GenomicOutput.json"))),
+                         {"msi_report": {"msi_status": "MSI-H"}})
+
+    def test_output_outside_root_rejected(self):
+        for output in [os.path.join(self.tmp_dir, "S1_GenomicOutput.json"), "../S1_GenomicOutput.json",
+                       "sub/../../S1_GenomicOutput.json"]:
+            (code, status) = self.post("/compile", json.dumps({"sample": "S1", "output": output}))
+            self.assertEqual(code, 400)
+        self.assertEqual(self.compiler.compile.call_count, 0)
+
+    def test_non_json_content_type_rejected(self):
+        # As sent by a cross-origin form or text/plain POST from a web page:
+        (code, status) = self.post("/compile", json.dumps({"sample": "S1"}), "text/plain")
+        self.assertEqual(code, 415)
+        self.assertEqual(self.compiler.compile.call_count, 0)
+
+    def test_compile_failure(self):
+        self.compiler.compile.side_effect = IOError("No such file: s1.vcf")
+        (code, status) = self.post("/compile", json.dumps({"sample": "S1", "vcf": "s1.vcf"}))
+        self.assertEqual(code, 200)
+        self.assertEqual(status["status"], STATUS_FAILED)
+        self.assertTrue("s1.vcf" in status["error"])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post("/compile", "{")[0], 400)
+        self.assertEqual(self.post("/compile", "[]")[0], 400)
+        self.assertEqual(self.post("/render", "{}")[0], 400)
+        for name in [12345, None, ["R1"]]:
+            (code, status) = self.post("/render", json.dumps({"name": name, "report": "r.json", "metadata": "m.json",
+                                                              "outputDir": "reports"}))
+            self.assertEqual(code, 400)
+            self.assertTrue("name" in status["error"])
+        self.assertEqual(self.renderer.render.call_count, 0)
+        # Metadata jobs are not configured:
+        self.assertEqual(self.post("/metadata", "{}")[0], 404)
+
+    def test_status(self):
+        self.post("/compile", json.dumps({"sample": "S1"}))
+        status = json.loads(urllib2.urlopen(self.url + "/status").read())
+        self.assertEqual(status["job_types"], ["compile", "render"])
+        self.assertEqual(status["jobs"]["completed"], 1)
+        self.assertEqual(status["loads"], {"rules": 1, "template": 0})
+
+
+class TestMetadataService(unittest.TestCase):
+    def test_retrieve_metadata(self):
+        import sqlalchemy
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_filename = os.path.join(tmp_dir, "referrals.db")
+            shutil.copy(os.path.join(os.path.dirname(__file__), "referrals.db"), db_filename)
+            engine = sqlalchemy.create_engine("sqlite:///" + db_filename)
+            id2addresses = {"301": [{"attn": "Dr", "line1": "l1", "line2": "l2", "line3": "l3"}]}
+            service = ReportService(engine=engine,
+                                    address_resource=ReloadingResource("addresses", [], lambda: id2addresses))
+            self.assertEqual(service.get_job_types(), ["metadata"])
+
+            status = service.run_job("metadata", {"blood": "03098121", "tumor": "03098849"})
+            self.assertEqual(status["status"], STATUS_OK)
+            self.assertEqual(status["metadata"]["tumor_referral_ID"], 159977)
+
+            status = service.run_job("metadata", {"blood": "03098121", "tumor": "03098841"})
+            self.assertEqual(status["status"], STATUS_FAILED)
+            engine.dispose()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestRenderOutputPaths(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.renderer = Mock()
+        self.service = ReportService(renderer_resource=ReloadingResource("template", [], lambda: self.renderer),
+                                     output_root=self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_render_output_dir(self):
+        self.service.run_job("render", {"name": "R1", "report": "r.json", "metadata": "m.json",
+                                        "outputDir": "reports"})
+        self.assertEqual(self.renderer.render.call_args[0][3], os.path.join(os.path.realpath(self.tmp_dir),
+                                                                              "reports"))
+
+    def test_render_outside_root_rejected(self):
+        for (name, output_dir) in [("R1", "/tmp"), ("R1", ".."), ("../R1", "reports")]:
+            self.assertRaises(InvalidRequestError, self.service.run_job, "render",
+                              {"name": name, "report": "r.json", "metadata": "m.json", "outputDir": output_dir})
+        self.assertEqual(self.renderer.render.call_count, 0)
+
+    def test_symlink_outside_root_rejected(self):
+        os.symlink("/tmp", os.path.join(self.tmp_dir, "link"))
+        self.assertRaises(InvalidRequestError, resolve_output_path, self.tmp_dir, "link/R1.pdf")
+
+
+class TestMakeServer(unittest.TestCase):
+    def test_unix_socket_is_private(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            socket_filename = os.path.join(tmp_dir, "service.sock")
+            server = make_server(ReportService(), socket_filename=socket_filename)
+            self.assertEqual(stat.S_IMODE(os.stat(socket_filename).st_mode), 0600)
+            server.server_close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_stale_socket_replaced(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            socket_filename = os.path.join(tmp_dir, "service.sock")
+            make_server(ReportService(), socket_filename=socket_filename).server_close()
+            self.assertTrue(stat.S_ISSOCK(os.lstat(socket_filename).st_mode))
+            make_server(ReportService(), socket_filename=socket_filename).server_close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_existing_file_not_replaced(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            socket_filename = os.path.join(tmp_dir, "service.sock")
+            with open(socket_filename, "w") as existing_file:
+                existing_file.write("data")
+            self.assertRaises(ValueError, make_server, ReportService(), socket_filename=socket_filename)
+            self.assertEqual(open(socket_filename).read(), "data")
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_tcp_requires_port(self):
+        self.assertRaises(ValueError, make_server, ReportService())
@@ -0,0 +1,78 @@
+import datetime, os, shutil, stat, tempfile, unittest
+
+import sqlalchemy
+
+from reportgen.reporting.metadata import AlasccaBloodReferral, AlasccaTissueReferral, MetadataLookup
+from reportgen.reporting.snapshot import get_snapshot_uri, sync_snapshot
+
+
+class TestSyncSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        db_filename = os.path.join(self.tmp_dir, "referrals.db")
+        shutil.copy(os.path.join(os.path.dirname(__file__), "referrals.db"), db_filename)
+        self.source_engine = sqlalchemy.create_engine("sqlite:///" + db_filename)
+        self.snapshot_filename = os.path.join(self.tmp_dir, "snapshot.sqlite")
+        self.id2addresses = {"301": [{"attn": "Dr", "line1": "l1", "line2": "l2", "line3": "l3"}]}
+
+    def tearDown(self):
+        self.source_engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def add_tissue_referral(self, crid, barcode, collection_date):
+        self.source_engine.execute(AlasccaTissueReferral.__table__.insert(),
+                                   {"crid": crid, "pnr": "191212121212", "collection_date": collection_date,
+                                    "hospital_code": 301, "barcode1": barcode})
+
+    def count_snapshot_tissue_referrals(self):
+        snapshot_engine = sqlalchemy.create_engine(get_snapshot_uri(self.snapshot_filename))
+        n_rows = snapshot_engine.execute(sqlalchemy.select([sqlalchemy.func.count()]).
+                                         select_from(AlasccaTissueReferral.__table__)).scalar()
+        snapshot_engine.dispose()
+        return n_rows
+
+    def test_snapshot_matches_source(self):
+        table_name2n_rows = sync_snapshot(self.source_engine, self.snapshot_filename)
+        self.assertEqual(table_name2n_rows, {"alascca_bloodreferrals": 1, "alascca_tissuereferrals": 2})
+
+        snapshot_engine = sqlalchemy.create_engine(get_snapshot_uri(self.snapshot_filename))
+        snapshot_lookup = MetadataLookup(snapshot_engine, self.id2addresses)
+        source_lookup = MetadataLookup(self.source_engine, self.id2addresses)
+        self.assertEqual(snapshot_lookup.retrieve(3098121, 3098849), source_lookup.retrieve(3098121, 3098849))
+        snapshot_lookup.close()
+        source_lookup.close()
+        snapshot_engine.dispose()
+
+    def test_incremental_sync(self):
+        for referral_type in [AlasccaBloodReferral, AlasccaTissueReferral]:
+            self.source_engine.execute(referral_type.__table__.update().
+                                       values(collection_date=datetime.date(2016, 1, 1)))
+        self.add_tissue_referral(200000, 4000000, datetime.date(2016, 6, 1))
+        sync_snapshot(self.source_engine, self.snapshot_filename, "collection_date")
+
+        # Only referrals at or after the latest timestamp in the snapshot are
+        # copied, replacing their earlier copies:
+        self.add_tissue_referral(200001, 4000002, datetime.date(2017, 1, 1))
+        self.assertEqual(sync_snapshot(self.source_engine, self.snapshot_filename, "collection_date"),
+                         {"alascca_bloodreferrals": 1, "alascca_tissuereferrals": 2})
+        self.assertEqual(self.count_snapshot_tissue_referrals(), 4)
+
+    def test_full_refresh_removes_deleted_referrals(self):
+        sync_snapshot(self.source_engine, self.snapshot_filename)
+        self.source_engine.execute(AlasccaTissueReferral.__table__.delete().
+                                   where(AlasccaTissueReferral.__table__.c.crid == 159978))
+
+        sync_snapshot(self.source_engine, self.snapshot_filename)
+        self.assertEqual(self.count_snapshot_tissue_referrals(), 1)
+
+    def test_snapshot_permissions(self):
+        snapshot_dir = os.path.join(self.tmp_dir, "cache", "reportgen")
+        self.snapshot_filename = os.path.join(snapshot_dir, "snapshot.sqlite")
+        sync_snapshot(self.source_engine, self.snapshot_filename)
+        self.assertEqual(stat.S_IMODE(os.stat(snapshot_dir).st_mode), 0700)
+        self.assertEqual(stat.S_IMODE(os.stat(self.snapshot_filename).st_mode), 0600)
+
+        # An existing snapshot is restricted on the next sync:
+        os.chmod(self.snapshot_filename, 0644)
+        sync_snapshot(self.source_engine, self.snapshot_filename)
+        self.assertEqual(stat.S_IMODE(os.stat(self.snapshot_filename).st_mode), 0600)
@@ -1,7 +1,7 @@
 from mock import mock_open, patch, Mock, MagicMock
 from sqlalchemy.exc import ArgumentError
 import reportgen.reporting.util as util
-import unittest
+import os, shutil, tempfile, unittest
 
 class TestStandaloneFunctions(unittest.TestCase):
     def setUp(self):
@@ -60,6 +60,54 @@ class TestStandaloneFunctions(unittest.TestCase):
                           "inframe_deletion", "stop_gained",
                           "splice_acceptor_variant", "splice_donor_variant"])
 
+    @patch('reportgen.reporting.util.openpyxl')
+    def test_extract_mutation_spreadsheet_contents_stops_at_blank_row(self, mock_openpyxl):
+        def wrapToken(token):
+            wrappedToken = Mock()
+            wrappedToken.value = token
+            return wrappedToken
+
+        rows = [["Consequence", "Symbol", "Gene", "Feature", "Amino_acid_changes", "Flag"],
+                ["missense_variant", "BRAF", "ENSG00000157764", "ENST00000288602", "p.Val600Glu", "BRAF_COMMON"],
+                ["missense_variant", "KRAS", "ENSG00000133703", "ENST00000256078"],
+                [None, None, None, None, None, None],
+                ["missense_variant", "NRAS", "ENSG00000213281", "ENST00000369535", "12,13,61", "NRAS_COMMON"]]
+        mock_openpyxl.load_workbook().get_sheet_by_name().iter_rows = MagicMock()
+        mock_openpyxl.load_workbook().get_sheet_by_name().iter_rows.return_value = \
+            iter(map(lambda row: map(lambda token: wrapToken(token), row), rows))
+
+        spreadsheet_contents = util.extract_mutation_spreadsheet_contents("dummy_filename")
+
+        self.assertEqual(len(spreadsheet_contents), 2)
+        self.assertEqual(spreadsheet_contents[1], [["missense_variant"], "KRAS", "ENSG00000133703",
+                                                   "ENST00000256078", [], None])
+
+    @patch('reportgen.reporting.util.openpyxl')
+    def test_extract_mutation_spreadsheet_contents_cached(self, mock_openpyxl):
+        mock_openpyxl.load_workbook().get_sheet_by_name().iter_rows = MagicMock()
+        mock_openpyxl.load_workbook().get_sheet_by_name().iter_rows.return_value = \
+            self.mock_iter_rows_valid_colorectal_mutations_table
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            spreadsheet_filename = os.path.join(tmp_dir, "rules.xlsx")
+            open(spreadsheet_filename, "w").write("spreadsheet contents")
+            cache_dir = os.path.join(tmp_dir, "cache")
+
+            spreadsheet_contents = util.extract_mutation_spreadsheet_contents(spreadsheet_filename, cache_dir)
+
+            # The second extraction must be served from the cache:
+            mock_openpyxl.load_workbook = Mock(side_effect=AssertionError("Spreadsheet parsed despite cache hit"))
+            self.assertEqual(util.extract_mutation_spreadsheet_contents(spreadsheet_filename, cache_dir),
+                             spreadsheet_contents)
+
+            # Changing the spreadsheet invalidates the cache entry:
+            open(spreadsheet_filename, "w").write("modified spreadsheet contents")
+            self.assertRaises(AssertionError, util.extract_mutation_spreadsheet_contents, spreadsheet_filename,
+                              cache_dir)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_id_valid_valid_input(self):
         self.assertTrue(util.id_valid("01234567"))
 
@@ -121,6 +169,46 @@ class TestStandaloneFunctions(unittest.TestCase):
 
         self.assertRaises(ValueError, util.get_addresses, id2addresses, ["100", "101"])
 
+    def test_address_index_matches_get_addresses(self):
+        id2addresses = {"100": [{"attn": "name2", "line1": "street2", "line2": "city2", "line3": "0124"},
+                                {"attn": "name1", "line1": "street1", "line2": "city1", "line3": "0123"}],
+                        "101": [{"attn": "name3", "line1": "street3", "line2": "city3", "line3": "0125"},
+                                {"attn": "name2", "line1": "street2", "line2": "city2", "line3": "0124"}]}
+        address_index = util.AddressIndex(id2addresses)
+        for ids in [["100"], ["101"], ["100", "101"], ["101", "100"]]:
+            self.assertEqual(util.get_addresses(address_index, ids), util.get_addresses(id2addresses, ids))
+        self.assertEqual(address_index["100"], id2addresses["100"])
+        self.assertRaises(ValueError, util.get_addresses, address_index, ["100", "102"])
+
+    def test_address_index_returns_copies(self):
+        address_index = util.AddressIndex({"100": [{"attn": "name1", "line1": "street1", "line2": "city1",
+                                                    "line3": "0123"}]})
+        util.get_addresses(address_index, ["100"])[0]["attn"] = "modified"
+        self.assertEqual(util.get_addresses(address_index, ["100"])[0]["attn"], "name1")
+
+    def test_load_address_index_cached(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            address_table_filename = os.path.join(tmp_dir, "addresses.csv")
+            with open(address_table_filename, "w") as address_table_file:
+                address_table_file.write("Nr\tKlinik\tAttn\tMail\tAdress\tAdress\tAdress\n" +
+                                         "1\tHospital\tDoctors name\tmail\tStreetname 1\tSuburb\t100 00 City\n")
+            cache_dir = os.path.join(tmp_dir, "cache")
+            address_index = util.load_address_index(address_table_filename, cache_dir)
+            self.assertEqual(address_index.keys(), ["1"])
+
+            # The second load must be served from the cache:
+            with patch('reportgen.reporting.util.parse_address_table',
+                       Mock(side_effect=AssertionError("Address table parsed despite cache hit"))):
+                self.assertEqual(util.load_address_index(address_table_filename, cache_dir), address_index)
+
+            # Modifying the file invalidates the cache entry:
+            with open(address_table_filename, "a") as address_table_file:
+                address_table_file.write("2\tHospital\tOther name\tmail\tStreetname 2\tSuburb\t100 00 City\n")
+            self.assertEqual(sorted(util.load_address_index(address_table_filename, cache_dir).keys()), ["1", "2"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
 
     def test_parse_address_table_invalid_header(self):
         open_name = '%s.open' % __name__
@@ -167,6 +255,32 @@ class TestStandaloneFunctions(unittest.TestCase):
         self.assertRaises(ArgumentError, util.create_sql_session, "dummy.json")
 
 
+    @patch('reportgen.reporting.util._uri2engine', {})
+    @patch('referralmanager.cli.dbimport.create_tables')
+    @patch('sqlalchemy.create_engine')
+    def test_get_engine_reused_without_ddl(self, mock_create_engine, mock_create_tables):
+        mock_create_engine.side_effect = [Mock(), Mock()]
+        engine = util.get_engine("sqlite:///dummy.db")
+        self.assertTrue(util.get_engine("sqlite:///dummy.db") is engine)
+        self.assertEqual(mock_create_engine.call_count, 1)
+        self.assertFalse(mock_create_tables.called)
+
+
+    @patch('reportgen.reporting.util._uri2engine', {})
+    @patch('referralmanager.cli.dbimport.create_tables')
+    @patch('sqlalchemy.create_engine')
+    def test_get_engine_create_missing_tables(self, mock_create_engine, mock_create_tables):
+        old_engine = util.get_engine("sqlite:///dummy.db")
+        engine = util.get_engine("sqlite:///dummy.db", create_missing_tables=True)
+        mock_create_tables.assert_called_once_with("sqlite:///dummy.db")
+        # The tables are created with a separate engine, and the shared
+        # engine is kept:
+        self.assertTrue(mock_create_tables.return_value.dispose.called)
+        self.assertTrue(engine is old_engine)
+        self.assertFalse(old_engine.dispose.called)
+        self.assertEqual(mock_create_engine.call_count, 1)
+
+
 #class TestMisc(unittest.TestCase):
 #    '''Tests for miscellaneous functions in the reports module.'''
 